@@ -6,14 +6,38 @@ calcul des manques/surplus, validation des envois, exécution des décisions
 LLM et composition des messages de broadcast.
 
 Il ne fait aucun appel direct à Ollama (délégué à llm.py) et ne connaît
-pas FastAPI (délégué à app.py).
+pas FastAPI (délégué à app.py). Les fonctions qui parlent à Butler sont des
+coroutines : elles reçoivent le ButlerClient de l'AgenteRuntime appelant,
+ainsi que ce dont elles se souviennent d'un appel à l'autre (carnet
+d'ordres, menus et chaînes proposés, mémoire des négociations), qui
+appartient au slot.
 """
 
+import asyncio
 import json
 import logging
-
-from config import ButlerState
-from butler import enviar_carta, enviar_paquete
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+import httpx
+from pydantic import ValidationError
+
+import decisiones
+import mercado
+import metricas
+import planificador
+import trazas
+from butler import ButlerClient
+from config import (
+    BROADCAST_MAX_WORKERS,
+    CADENAS_HISTORIAL,
+    MENUS_HISTORIAL,
+    OFERTAS_POR_LOTE,
+    ButlerState,
+)
+from negociaciones import Negociaciones
 
 logger = logging.getLogger(__name__)
 
@@ -49,98 +73,389 @@ def calcular_faltan_sobran(recursos: dict, objetivo: dict) -> tuple[dict, dict]:
 # ── Validation et exécution ────────────────────────────────────────────────────
 
 
-def validar_envio(envio: dict, estado: ButlerState) -> dict | None:
+def es_lote(envio: dict) -> bool:
+    """Un envoi de plusieurs unités (d'une ou plusieurs ressources) est un lot."""
+    return sum(c for c in envio.values() if isinstance(c, int) and c > 0) > 1
+
+
+def validar_envio(
+    envio: dict,
+    estado: ButlerState,
+    comprometido: dict | None = None,
+    completo: bool = False,
+) -> dict | None:
     """Valide et plafonne un envoi proposé contre les ressources réellement disponibles.
 
     Filet de sécurité contre les hallucinations LLM : même si le LLM propose
     un envoi invalide, cette fonction le bloque ou le corrige silencieusement.
 
     Args:
-        envio:  Dictionnaire {ressource: quantité} proposé par le LLM.
-        estado: État courant de l'agent (déjà récupéré par l'appelant, sans re-fetch HTTP).
+        envio:        Dictionnaire {ressource: quantité} proposé par le LLM.
+        estado:       État courant de l'agent (déjà récupéré par l'appelant, sans re-fetch HTTP).
+        comprometido: Ressources déjà engagées par d'autres envois en cours sur le
+                      même état (LibroReservas), à déduire de SOBRAN.
+        completo:     Si True, tout ou rien : None dès qu'une quantité devrait être
+                      plafonnée (un lot amputé ne respecterait plus l'accord).
 
     Returns:
         Dictionnaire des quantités réellement envoyables, ou None si rien n'est valide.
     """
     _, sobran = calcular_faltan_sobran(estado.Recursos, estado.Objetivo)
+    if comprometido:
+        sobran = {rec: cant - comprometido.get(rec, 0) for rec, cant in sobran.items()}
     envio_valido = {
         rec: min(cant, sobran[rec])
         for rec, cant in envio.items()
         if isinstance(cant, int) and cant > 0 and sobran.get(rec, 0) > 0
     }
+    if completo and envio_valido != envio:
+        return None
     return envio_valido or None
 
 
-def ejecutar_decision(decision: dict, mi_alias: str, estado: ButlerState) -> dict:
-    """Exécute la décision prise par le LLM.
+class LibroReservas:
+    """Registre des ressources engagées par les décisions 'aceptar' en cours.
+
+    Quand plusieurs cartas sont traitées en parallèle sur le même snapshot
+    d'état, chacune verrait tout le SOBRAN disponible : sans registre, deux
+    acceptations simultanées pourraient promettre la même unité. La
+    réservation (validation + engagement) ne contient aucun await, donc
+    aucune autre tâche ne s'intercale ; le verrou la protège aussi d'un
+    appel depuis un autre thread.
+
+    Un registre n'est valable que pour un snapshot d'état : l'appelant en crée
+    un nouveau à chaque lot de cartas, une fois l'état rafraîchi.
+    """
+
+    def __init__(self) -> None:
+        self._comprometido: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def reservar(
+        self, envio: dict, estado: ButlerState, completo: bool = False
+    ) -> dict | None:
+        """Valide `envio` contre SOBRAN moins les réservations, puis l'engage.
+
+        Args:
+            completo: Tout ou rien (voir validar_envio).
+
+        Returns:
+            Les quantités réservées (plafonnées), ou None si rien n'est disponible.
+        """
+        with self._lock:
+            envio_valido = validar_envio(envio, estado, self._comprometido, completo)
+            for rec, cant in (envio_valido or {}).items():
+                self._comprometido[rec] = self._comprometido.get(rec, 0) + cant
+            return envio_valido
+
+    def liberar(self, envio: dict) -> None:
+        """Annule une réservation (ex : l'envoi du paquete a échoué)."""
+        with self._lock:
+            for rec, cant in envio.items():
+                self._comprometido[rec] = self._comprometido.get(rec, 0) - cant
+
+    def comprometido(self) -> dict:
+        """Copie des quantités actuellement réservées."""
+        with self._lock:
+            return {rec: cant for rec, cant in self._comprometido.items() if cant > 0}
+
+
+async def ejecutar_decision(
+    decision: decisiones.Decision | dict,
+    mi_alias: str,
+    estado: ButlerState,
+    cliente: ButlerClient,
+    reservas: LibroReservas | None = None,
+    negociaciones: Negociaciones | None = None,
+) -> dict:
+    """Exécute une décision (règles ou LLM).
 
     Dispatche selon l'action :
     - 'esperar'         : ne fait rien
     - 'ofrecer'/'pedir' : envoie une carta de négociation
     - 'aceptar'         : valide l'envoi, envoie le paquet + carta de confirmation
 
+    Une décision reçue sous forme de dict est d'abord validée en modèle typé
+    (decisiones.py) ; invalide, elle n'est pas exécutée. Un lot (plusieurs
+    unités, éventuellement de plusieurs ressources) part en un seul paquete,
+    en entier ou pas du tout.
+
     Args:
-        decision: Dictionnaire JSON produit par le LLM.
+        decision: Décision typée, ou dictionnaire JSON au même format.
         mi_alias: Alias de cet agent.
         estado:   État courant (transmis à validar_envio sans re-fetch HTTP).
+        cliente:  Client Butler à utiliser.
+        reservas: Registre partagé par les cartas traitées en parallèle ; si
+                  fourni, l'envoi est réservé atomiquement au lieu d'être
+                  seulement validé.
+        negociaciones: Mémoire des négociations du slot : y sont enregistrés
+                  les paquetes envoyés et les contre-offres aux termes connus.
 
     Returns:
         Dictionnaire de résultat, ex: {"estado": "aceptado_y_enviado", "paquete": {...}}
     """
-    accion = decision.get("accion")
-    logger.info("Ejecutando: %s", decision)
-
-    if accion == "esperar":
-        return {"estado": "esperando"}
-
-    dest = decision.get("dest", "")
-
-    if accion == "aceptar" and dest:
-        envio_valido = validar_envio(decision.get("envio", {}), estado)
-        if envio_valido:
-            recibir = decision.get("recibir", {})
-            recibir_txt = f" Espero recibir: {json.dumps(recibir)}." if recibir else ""
-            enviar_paquete(dest, envio_valido)
-            enviar_carta(
-                remi=mi_alias,
-                dest=dest,
-                asunto="Intercambio aceptado",
-                cuerpo=(
-                    f"Acepto el trato. Te envié: {json.dumps(envio_valido)}.{recibir_txt}"
-                    " Envíame tu parte si aún no lo has hecho."
-                ),
+    if isinstance(decision, dict):
+        try:
+            decision = decisiones.validar(decision)
+        except ValidationError as e:
+            logger.warning(
+                "Acción inválida o campos faltantes: %s (%s)",
+                decision,
+                decisiones.resumir_errores(e),
             )
-            return {"estado": "aceptado_y_enviado", "paquete": envio_valido}
-        logger.warning(
-            "Envío bloqueado: %s no disponible en SOBRAN", decision.get("envio")
-        )
-        return {"estado": "envio_bloqueado"}
-
-    if accion in ("pedir", "ofrecer") and dest and decision.get("cuerpo"):
-        enviar_carta(
+            return {"estado": "esperando"}
+
+    with trazas.span("ejecutar", accion=decision.accion):
+        logger.info("Ejecutando: %s", decisiones.como_dict(decision))
+
+        if isinstance(decision, decisiones.Esperar):
+            return {"estado": "esperando"}
+
+        dest = decision.dest
+
+        if isinstance(decision, decisiones.Aceptar):
+            envio = decision.envio
+            completo = es_lote(envio)
+            with trazas.span("validar", lote=completo):
+                if reservas is not None:
+                    envio_valido = reservas.reservar(envio, estado, completo)
+                else:
+                    envio_valido = validar_envio(envio, estado, completo=completo)
+            if envio_valido:
+                recibir = decision.recibir
+                recibir_txt = (
+                    f" Espero recibir: {json.dumps(recibir)}." if recibir else ""
+                )
+                inicio = time.monotonic()
+                try:
+                    enviado = await cliente.enviar_paquete(dest, envio_valido)
+                except httpx.HTTPError as e:
+                    logger.error("Error enviando paquete a %s: %s", dest, e)
+                    enviado = False
+                if not enviado:
+                    if reservas is not None:
+                        reservas.liberar(envio_valido)
+                    return {"estado": "paquete_fallido", "paquete": envio_valido}
+                if negociaciones is not None:
+                    negociaciones.registrar_envio(dest, envio_valido, recibir, inicio)
+                # Le paquete est parti : la carta de confirmation est un simple
+                # avis, son échec ne doit pas faire repayer l'offre.
+                try:
+                    await cliente.enviar_carta(
+                        remi=mi_alias,
+                        dest=dest,
+                        asunto="Intercambio aceptado",
+                        cuerpo=(
+                            f"Acepto el trato. Te envié: {json.dumps(envio_valido)}.{recibir_txt}"
+                            " Envíame tu parte si aún no lo has hecho."
+                        ),
+                    )
+                except httpx.HTTPError as e:
+                    logger.error("Error enviando confirmación a %s: %s", dest, e)
+                return {"estado": "aceptado_y_enviado", "paquete": envio_valido}
+            logger.warning("Envío bloqueado: %s no disponible en SOBRAN", envio)
+            metricas.envios_bloqueados_total.inc()
+            return {"estado": "envio_bloqueado"}
+
+        await cliente.enviar_carta(
             remi=mi_alias,
             dest=dest,
-            asunto=decision.get("asunto", "Propuesta de intercambio"),
-            cuerpo=decision["cuerpo"],
+            asunto=decision.asunto,
+            cuerpo=decision.cuerpo,
         )
-        return {"estado": f"{accion}_enviado"}
+        if negociaciones is not None:
+            negociaciones.registrar_ofertas(
+                [{"dest": dest, "envio": decision.envio, "recibir": decision.recibir}],
+                decision.accion,
+            )
+        return {"estado": f"{decision.accion}_enviado"}
+
+
+# ── Envoi concurrent des cartas ────────────────────────────────────────────────
 
-    logger.warning("Acción inválida o campos faltantes: %s", decision)
-    return {"estado": "esperando"}
+
+@dataclass
+class ResumenEnvio:
+    """Bilan d'un envoi groupé de cartas : succès, échecs et détail des erreurs."""
+
+    enviadas: int = 0
+    fallidas: int = 0
+    errores: list[tuple[str, str, str]] = field(
+        default_factory=list
+    )  # dest, asunto, motivo
+
+    @property
+    def total(self) -> int:
+        return self.enviadas + self.fallidas
+
+    def agregar(self, otro: "ResumenEnvio") -> "ResumenEnvio":
+        """Cumule un autre bilan dans celui-ci (utile pour un cycle complet)."""
+        self.enviadas += otro.enviadas
+        self.fallidas += otro.fallidas
+        self.errores.extend(otro.errores)
+        return self
+
+
+async def enviar_cartas(
+    remi: str,
+    cartas: list[tuple[str, str, str]],
+    cliente: ButlerClient,
+    max_workers: int = BROADCAST_MAX_WORKERS,
+) -> ResumenEnvio:
+    """Envoie un lot de cartas en parallèle borné, en préservant l'ordre par destinataire.
+
+    Les cartas sont regroupées par destinataire : chaque groupe est envoyé
+    séquentiellement par une seule tâche, si bien qu'un agent reçoit toujours
+    ses cartas dans l'ordre de composition. Au plus `max_workers` groupes
+    sont en cours d'envoi à la fois (max_workers=1 : envoi entièrement
+    séquentiel). Les tâches appartiennent à un TaskGroup : annuler l'appelant
+    annule les envois restants.
+
+    Args:
+        remi:        Alias de l'expéditeur.
+        cartas:      Liste de tuples (dest, asunto, cuerpo), dans l'ordre voulu.
+        cliente:     Client Butler à utiliser.
+        max_workers: Nombre maximal d'envois simultanés.
+
+    Returns:
+        ResumenEnvio avec le nombre de cartas envoyées et échouées.
+    """
+    por_dest: dict[str, list[tuple[str, str]]] = {}
+    for dest, asunto, cuerpo in cartas:
+        por_dest.setdefault(dest, []).append((asunto, cuerpo))
+    limite = asyncio.Semaphore(max(1, max_workers))
+
+    async def _enviar_grupo(dest: str, grupo: list[tuple[str, str]]) -> ResumenEnvio:
+        resumen = ResumenEnvio()
+        async with limite:
+            for asunto, cuerpo in grupo:
+                try:
+                    ok = await cliente.enviar_carta(remi, dest, asunto, cuerpo)
+                    motivo = "" if ok else "respuesta HTTP no exitosa"
+                except httpx.HTTPError as e:
+                    ok, motivo = False, str(e)
+                if ok:
+                    resumen.enviadas += 1
+                else:
+                    resumen.fallidas += 1
+                    resumen.errores.append((dest, asunto, motivo))
+        return resumen
+
+    async with asyncio.TaskGroup() as grupo_tareas:
+        tareas = [
+            grupo_tareas.create_task(_enviar_grupo(d, g)) for d, g in por_dest.items()
+        ]
+    resumen = ResumenEnvio()
+    for tarea in tareas:
+        resumen.agregar(tarea.result())
+    return resumen
+
+
+def _registrar_resumen(nombre: str, resumen: ResumenEnvio, evitadas: int = 0) -> None:
+    """Journalise et compte le bilan d'un broadcast, en warning s'il y a des échecs.
+
+    Args:
+        evitadas: Cartas non envoyées grâce au carnet d'ordres (mercado.py).
+    """
+    metricas.broadcast_cartas_total.inc(
+        resumen.enviadas, tipo=nombre, resultado="enviada"
+    )
+    metricas.broadcast_cartas_total.inc(
+        resumen.fallidas, tipo=nombre, resultado="fallida"
+    )
+    metricas.broadcast_cartas_total.inc(evitadas, tipo=nombre, resultado="evitada")
+    if evitadas:
+        logger.info("Broadcast %s: %d cartas evitadas (mercado).", nombre, evitadas)
+    if resumen.fallidas:
+        logger.warning(
+            "Broadcast %s: %d cartas enviadas, %d fallidas (ej. %s).",
+            nombre,
+            resumen.enviadas,
+            resumen.fallidas,
+            resumen.errores[0],
+        )
+    else:
+        logger.info("Broadcast %s: %d cartas enviadas.", nombre, resumen.enviadas)
+
+
+def _registrar_ofertas(
+    negociaciones: Negociaciones | None,
+    ofertas: list[dict],
+    resumen: ResumenEnvio,
+    origen: str,
+) -> None:
+    """Enregistre dans la mémoire des négociations les offres dont la carta
+    est bien partie (chaque offre porte le dest et l'asunto de sa carta)."""
+    if negociaciones is None:
+        return
+    fallidas = {(dest, asunto) for dest, asunto, _ in resumen.errores}
+    negociaciones.registrar_ofertas(
+        [o for o in ofertas if (o["dest"], o["asunto"]) not in fallidas], origen
+    )
+
+
+# ── Lots ───────────────────────────────────────────────────────────────────────
+
+
+def _repartir(cantidad: int, disponibles: dict) -> dict:
+    """Compose `cantidad` unités en puisant d'abord dans les plus gros SOBRAN."""
+    envio = {}
+    for rec, cant in sorted(disponibles.items(), key=lambda x: -x[1]):
+        if cantidad <= 0:
+            break
+        envio[rec] = min(cant, cantidad)
+        cantidad -= envio[rec]
+    return envio
+
+
+def componer_lotes(faltan: dict, sobran: dict) -> list[dict]:
+    """Offres qui couvrent d'un coup tout le FALTAN de chaque ressource.
+
+    Pour une ressource manquante de q unités : q unités (ou tout ce qu'il y a
+    si moins) de chaque SOBRAN hors oro, 1:1 ; si aucun SOBRAN n'a q unités,
+    un paquete multi-ressources de q unités composé des plus gros SOBRAN ; et
+    q unités contre 3×q oro. Les offres d'une seule unité sont laissées aux
+    offres unitaires (voir _componer_lineas_menu).
+
+    Returns:
+        Liste d'offres {"envio": {...}, "recibir": {...}}, vide si
+        OFERTAS_POR_LOTE est désactivé.
+    """
+    if not OFERTAS_POR_LOTE:
+        return []
+    mercancias = {k: v for k, v in sobran.items() if k != "oro" and v > 0}
+    oro = sobran.get("oro", 0)
+    lotes = []
+    for rec, cant in faltan.items():
+        for rec_dar, disponible in mercancias.items():
+            n = min(cant, disponible)
+            if n > 1:
+                lotes.append({"envio": {rec_dar: n}, "recibir": {rec: n}})
+        if len(mercancias) > 1 and max(mercancias.values()) < cant <= sum(
+            mercancias.values()
+        ):
+            lotes.append({"envio": _repartir(cant, mercancias), "recibir": {rec: cant}})
+        n = min(cant, oro // 3)
+        if n > 1:
+            lotes.append({"envio": {"oro": 3 * n}, "recibir": {rec: n}})
+    return lotes
 
 
 # ── Broadcasts ─────────────────────────────────────────────────────────────────
 
 
-def hacer_broadcast_general(estado: ButlerState, otros: list[str]) -> list[str]:
+async def hacer_broadcast_general(
+    estado: ButlerState, otros: list[str], cliente: ButlerClient
+) -> ResumenEnvio:
     """Envoie une carta d'annonce générale (besoins/offres) à tous les agents.
 
     Args:
-        estado: État courant (pré-chargé par l'appelant).
-        otros:  Liste des alias des autres agents.
+        estado:  État courant (pré-chargé par l'appelant).
+        otros:   Liste des alias des autres agents.
+        cliente: Client Butler à utiliser.
 
     Returns:
-        Liste des alias auxquels la carta a été envoyée.
+        ResumenEnvio des cartas envoyées / échouées.
     """
     alias = estado.Alias or "agente"
     faltan, sobran = calcular_faltan_sobran(estado.Recursos, estado.Objetivo)
@@ -150,63 +465,103 @@ def hacer_broadcast_general(estado: ButlerState, otros: list[str]) -> list[str]:
         f"Ofrezco a cambio: {', '.join(f'{v} de {k}' for k, v in sobran.items())}.\n"
         "Si te interesa, propón un intercambio concreto."
     )
-    for dest in otros:
-        enviar_carta(remi=alias, dest=dest, asunto="Busco intercambio", cuerpo=cuerpo)
-    logger.info("Broadcast general: %d cartas enviadas.", len(otros))
-    return otros
+    cartas = [(dest, "Busco intercambio", cuerpo) for dest in otros]
+    resumen = await enviar_cartas(alias, cartas, cliente)
+    _registrar_resumen("general", resumen)
+    return resumen
 
 
-def hacer_broadcast_propuestas_1a1(estado: ButlerState, otros: list[str]) -> int:
-    """Envoie des propositions d'échange 1:1 (1 SOBRAN contre 1 FALTAN) à tous les agents.
+async def hacer_broadcast_propuestas_1a1(
+    estado: ButlerState,
+    otros: list[str],
+    cliente: ButlerClient,
+    libro: mercado.LibroOrdenes,
+    negociaciones: Negociaciones | None = None,
+) -> ResumenEnvio:
+    """Envoie des propositions d'échange 1:1 (SOBRAN contre FALTAN) à tous les agents.
 
     Pour chaque paire (ressource_à_donner × ressource_voulue), envoie une carta
-    individuelle à chaque agent. Le cooldown doit être mis à jour par l'appelant
-    (app.py) après cet appel.
+    individuelle à chaque agent qui peut la satisfaire d'après le carnet
+    d'ordres, ou dont on ne sait rien. Avec OFERTAS_POR_LOTE,
+    la quantité proposée couvre tout le FALTAN (dans la limite du SOBRAN) au
+    lieu d'une unité.
+    Le cooldown doit être mis à jour par l'appelant (app.py) après cet appel.
 
     Args:
-        estado: État courant (pré-chargé par l'appelant).
-        otros:  Liste des alias des autres agents.
+        estado:  État courant (pré-chargé par l'appelant).
+        otros:   Liste des alias des autres agents.
+        cliente: Client Butler à utiliser.
+        libro:   Carnet d'ordres du slot.
+        negociaciones: Mémoire des négociations (offres envoyées enregistrées).
 
     Returns:
-        Nombre de cartas envoyées (0 si rien à proposer).
+        ResumenEnvio des cartas envoyées / échouées (vide si rien à proposer).
     """
     alias = estado.Alias or "agente"
     faltan, sobran = calcular_faltan_sobran(estado.Recursos, estado.Objetivo)
 
     if not faltan or not sobran:
         logger.info("Broadcast 1:1 omis : rien à proposer.")
-        return 0
+        return ResumenEnvio()
 
-    count = 0
+    cartas = []
+    ofertas = []
+    evitadas = 0
     for rec_dar, cant_dar in sobran.items():
-        for rec_recibir in faltan:
-            asunto = f"Oferta: 1 {rec_dar} por 1 {rec_recibir}"
+        for rec_recibir, cant_recibir in faltan.items():
+            n = max(1, min(cant_dar, cant_recibir)) if OFERTAS_POR_LOTE else 1
+            asunto = f"Oferta: {n} {rec_dar} por {n} {rec_recibir}"
             cuerpo = (
                 f"Hola, soy {alias}.\n"
-                f"Te propongo: te doy 1 de {rec_dar} a cambio de 1 de {rec_recibir}.\n"
+                f"Te propongo: te doy {n} de {rec_dar} a cambio de {n} de {rec_recibir}.\n"
                 f"Tengo {cant_dar} de {rec_dar} disponibles.\n"
-                f"Si aceptas, envíame 1 de {rec_recibir} y yo te envío 1 de {rec_dar}."
+                f"Si aceptas, envíame {n} de {rec_recibir} y yo te envío {n} de {rec_dar}."
+            )
+            destinos = libro.destinatarios({rec_recibir: n}, otros)
+            evitadas += len(otros) - len(destinos)
+            cartas.extend((dest, asunto, cuerpo) for dest in destinos)
+            ofertas.extend(
+                {
+                    "dest": dest,
+                    "asunto": asunto,
+                    "envio": {rec_dar: n},
+                    "recibir": {rec_recibir: n},
+                }
+                for dest in destinos
             )
-            for dest in otros:
-                enviar_carta(remi=alias, dest=dest, asunto=asunto, cuerpo=cuerpo)
-                count += 1
 
-    logger.info("Broadcast 1:1: %d cartas enviadas.", count)
-    return count
+    resumen = await enviar_cartas(alias, cartas, cliente)
+    _registrar_resumen("1:1", resumen, evitadas)
+    _registrar_ofertas(negociaciones, ofertas, resumen, "1:1")
+    return resumen
 
 
-def hacer_broadcast_compras_con_oro(estado: ButlerState, otros: list[str]) -> int:
-    """Propose d'acheter chaque ressource manquante pour 3 oro.
+async def hacer_broadcast_compras_con_oro(
+    estado: ButlerState,
+    otros: list[str],
+    cliente: ButlerClient,
+    libro: mercado.LibroOrdenes,
+    negociaciones: Negociaciones | None = None,
+) -> ResumenEnvio:
+    """Propose d'acheter chaque ressource manquante pour 3 oro l'unité.
 
     L'or est une monnaie universelle : personne n'en a besoin dans son objectif,
     donc tout le monde est prêt à en recevoir en échange de leurs surplus.
+    Avec OFERTAS_POR_LOTE, chaque achat porte sur tout le FALTAN de la
+    ressource (dans la limite de l'oro disponible). Comme pour les offres
+    1:1, seuls les vendeurs possibles (d'après `libro`) et les agents
+    inconnus reçoivent la carta.
 
     Args:
-        estado: État courant (pré-chargé par l'appelant).
-        otros:  Liste des alias des autres agents.
+        estado:  État courant (pré-chargé par l'appelant).
+        otros:   Liste des alias des autres agents.
+        cliente: Client Butler à utiliser.
+        libro:   Carnet d'ordres du slot.
+        negociaciones: Mémoire des négociations (offres envoyées enregistrées).
 
     Returns:
-        Nombre de cartas envoyées (0 si pas assez d'oro ou rien à acheter).
+        ResumenEnvio des cartas envoyées / échouées (vide si pas assez d'oro
+        ou rien à acheter).
     """
     alias = estado.Alias or "agente"
     faltan, sobran = calcular_faltan_sobran(estado.Recursos, estado.Objetivo)
@@ -214,20 +569,346 @@ def hacer_broadcast_compras_con_oro(estado: ButlerState, otros: list[str]) -> in
 
     if not faltan or oro_disponible < 3:
         logger.info("Broadcast oro omis : pas assez d'oro ou rien à acheter.")
-        return 0
-
-    count = 0
-    for rec_faltan in faltan:
-        asunto = f"Compro: 1 {rec_faltan} por 3 oro"
+        return ResumenEnvio()
+
+    cartas = []
+    ofertas = []
+    evitadas = 0
+    for rec_faltan, cant in faltan.items():
+        n = min(cant, oro_disponible // 3) if OFERTAS_POR_LOTE else 1
+        asunto = f"Compro: {n} {rec_faltan} por {3 * n} oro"
         cuerpo = (
             f"Hola, soy {alias}.\n"
-            f"Compro 1 de {rec_faltan} a cambio de 3 de oro.\n"
+            f"Compro {n} de {rec_faltan} a cambio de {3 * n} de oro.\n"
             f"Tengo {oro_disponible} de oro disponibles.\n"
-            f"Si aceptas, envíame 1 de {rec_faltan} y yo te envío 3 de oro inmediatamente."
+            f"Si aceptas, envíame {n} de {rec_faltan} y yo te envío {3 * n} de oro inmediatamente."
+        )
+        destinos = libro.destinatarios({rec_faltan: n}, otros)
+        evitadas += len(otros) - len(destinos)
+        cartas.extend((dest, asunto, cuerpo) for dest in destinos)
+        ofertas.extend(
+            {
+                "dest": dest,
+                "asunto": asunto,
+                "envio": {"oro": 3 * n},
+                "recibir": {rec_faltan: n},
+            }
+            for dest in destinos
+        )
+
+    resumen = await enviar_cartas(alias, cartas, cliente)
+    _registrar_resumen("oro", resumen, evitadas)
+    _registrar_ofertas(negociaciones, ofertas, resumen, "oro")
+    return resumen
+
+
+# ── Menús consolidés ───────────────────────────────────────────────────────────
+
+_REF_MENU = re.compile(r"#(\d+)-(\d+)")
+
+
+class RegistroMenus:
+    """Historique borné des menus d'offres envoyés, pour résoudre les références.
+
+    Chaque menu reçoit un numéro de version croissant ; chaque ligne est citée
+    par son code « #version-ligne ». Seuls les `capacidad` derniers menus sont
+    conservés : une référence à un menu plus ancien n'est plus résolue (les
+    ressources ont changé depuis).
+    """
+
+    def __init__(self, capacidad: int = MENUS_HISTORIAL) -> None:
+        self._capacidad = capacidad
+        self._menus: dict[int, dict[int, dict]] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, lineas: list[dict]) -> int:
+        """Enregistre un nouveau menu et retourne son numéro de version.
+
+        Args:
+            lineas: Offres du menu, chacune {"envio": {...}, "recibir": {...}}.
+        """
+        with self._lock:
+            self._version += 1
+            self._menus[self._version] = dict(enumerate(lineas, start=1))
+            for version in sorted(self._menus)[: -self._capacidad]:
+                del self._menus[version]
+            return self._version
+
+    def resolver(self, version: int, linea: int) -> dict | None:
+        """Retourne l'offre {"envio", "recibir"} citée, ou None si inconnue."""
+        with self._lock:
+            return self._menus.get(version, {}).get(linea)
+
+
+def _componer_lineas_menu(faltan: dict, sobran: dict) -> list[dict]:
+    """Liste les lots (componer_lotes), puis les offres unitaires 1:1
+    (SOBRAN × FALTAN) et les achats d'une unité à 3 oro.
+
+    Les lots viennent en premier : un pair qui peut tout fournir accepte le
+    lot ; les offres unitaires restent en repli pour celui qui n'a qu'une
+    partie des unités.
+    """
+    lineas = componer_lotes(faltan, sobran) + [
+        {"envio": {rec_dar: 1}, "recibir": {rec_recibir: 1}}
+        for rec_dar in sobran
+        for rec_recibir in faltan
+    ]
+    if sobran.get("oro", 0) >= 3:
+        lineas += [{"envio": {"oro": 3}, "recibir": {rec: 1}} for rec in faltan]
+    return lineas
+
+
+def _describir_linea(linea: dict) -> str:
+    """Formate une offre du menu : 'te doy 1 de X a cambio de 1 de Y'."""
+    dar = " y ".join(f"{v} de {k}" for k, v in linea["envio"].items())
+    recibir = " y ".join(f"{v} de {k}" for k, v in linea["recibir"].items())
+    return f"te doy {dar} a cambio de {recibir}"
+
+
+async def hacer_broadcast_menu(
+    estado: ButlerState,
+    otros: list[str],
+    cliente: ButlerClient,
+    menus: RegistroMenus,
+    libro: mercado.LibroOrdenes,
+    negociaciones: Negociaciones | None = None,
+) -> ResumenEnvio:
+    """Envoie à chaque agent UNE carta « menu » listant toutes les offres 1:1 et oro.
+
+    Remplace les broadcasts 1:1 et oro en mode BROADCAST_MODO="menu" : le
+    nombre de cartas passe de |SOBRAN|×|FALTAN|×|agents| + |FALTAN|×|agents|
+    à |agents|. Chaque ligne porte un code « #version-ligne » que le
+    destinataire cite pour accepter (résolu par expandir_referencias_menu).
+
+    Un agent connu du carnet d'ordres ne reçoit que les lignes qu'il a
+    annoncé pouvoir satisfaire, au moins en partie, et aucune carta s'il n'en
+    reste pas ; un agent inconnu reçoit le menu complet.
+
+    Args:
+        estado:  État courant (pré-chargé par l'appelant).
+        otros:   Liste des alias des autres agents.
+        cliente: Client Butler à utiliser.
+        menus:   Menus envoyés par le slot (le nouveau y est enregistré).
+        libro:   Carnet d'ordres du slot.
+        negociaciones: Mémoire des négociations (une offre par ligne envoyée).
+
+    Returns:
+        ResumenEnvio des cartas envoyées / échouées (vide si rien à proposer).
+    """
+    alias = estado.Alias or "agente"
+    faltan, sobran = calcular_faltan_sobran(estado.Recursos, estado.Objetivo)
+    lineas = _componer_lineas_menu(faltan, sobran) if faltan else []
+
+    if not lineas:
+        logger.info("Broadcast menú omis : rien à proposer.")
+        return ResumenEnvio()
+
+    version = menus.registrar(lineas)
+    cartas = []
+    ofertas = []
+    for dest in otros:
+        numeradas = [
+            (n, linea)
+            for n, linea in enumerate(lineas, start=1)
+            if libro.puede_dar(dest, linea["recibir"]) is not False
+        ]
+        if not numeradas:
+            continue
+        cuerpo = (
+            f"Hola, soy {alias}. Estas son mis ofertas "
+            f'(para aceptar una, responde citando su código, p. ej. "Acepto #{version}-{numeradas[0][0]}"):\n'
+            + "\n".join(
+                f"#{version}-{n}: {_describir_linea(linea)}" for n, linea in numeradas
+            )
+            + "\nSi aceptas, envíame lo que pido y yo te envío mi parte."
         )
-        for dest in otros:
-            enviar_carta(remi=alias, dest=dest, asunto=asunto, cuerpo=cuerpo)
-            count += 1
+        cartas.append((dest, f"Menú de ofertas #{version}", cuerpo))
+        ofertas.extend(
+            {
+                "dest": dest,
+                "asunto": f"Menú de ofertas #{version}",
+                "envio": linea["envio"],
+                "recibir": linea["recibir"],
+                "referencia": f"#{version}-{n}",
+            }
+            for n, linea in numeradas
+        )
+    resumen = await enviar_cartas(alias, cartas, cliente)
+    _registrar_resumen("menú", resumen, len(otros) - len(cartas))
+    _registrar_ofertas(negociaciones, ofertas, resumen, "menú")
+    return resumen
+
+
+def expandir_referencias_menu(carta: dict, menus: RegistroMenus) -> dict:
+    """Explicite dans la carta les lignes de menu qu'elle cite (« #v-n »).
 
-    logger.info("Broadcast oro: %d cartas enviadas.", count)
-    return count
+    Le texte d'une acceptation comme « Acepto #7-2 » ne dit rien des termes :
+    on ajoute au cuerpo l'offre correspondante pour que la décision (LLM ou
+    règles) sache quoi envoyer et quoi attendre.
+
+    Args:
+        carta: La carta reçue.
+        menus: Menus envoyés par le slot destinataire.
+
+    Returns:
+        La carta inchangée si elle ne cite aucune ligne connue, sinon une copie
+        dont le cuerpo est complété par les termes de chaque ligne citée.
+    """
+    texto = f"{carta.get('asunto', '')} {carta.get('cuerpo', '')}"
+    notas = []
+    for version, linea in _REF_MENU.findall(texto):
+        oferta = menus.resolver(int(version), int(linea))
+        if oferta:
+            notas.append(
+                f"(Referencia a tu oferta #{version}-{linea}: tú envías "
+                f"{json.dumps(oferta['envio'])} y recibes {json.dumps(oferta['recibir'])})"
+            )
+    if not notas:
+        return carta
+    return {**carta, "cuerpo": f"{carta.get('cuerpo', '')}\n" + "\n".join(notas)}
+
+
+# ── Chaînes d'échanges multi-agents ────────────────────────────────────────────
+
+_REF_CADENA = re.compile(r"\bcadena #(\d+)", re.IGNORECASE)
+
+
+class RegistroCadenas:
+    """Chaînes proposées (planificador.Plan) en attente de leur fournisseur.
+
+    Chaque chaîne reçoit un numéro ; notre envoi part quand l'agent qui nous
+    livre la ressource accepte en citant ce numéro, une seule fois : la
+    chaîne n'est retirée qu'une fois notre envoi parti (completar), et reste
+    résoluble si la décision échoue. Seules les `capacidad` dernières
+    chaînes sont conservées.
+    """
+
+    def __init__(self, capacidad: int = CADENAS_HISTORIAL) -> None:
+        self._capacidad = capacidad
+        self._cadenas: dict[int, planificador.Plan] = {}
+        self._aceptadas: set[int] = set()  # acceptées par leur fournisseur
+        self._numero = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, plan: planificador.Plan) -> int | None:
+        """Enregistre une chaîne et retourne son numéro, ou None si la même
+        chaîne (mêmes agents, mêmes ressources) attend déjà une réponse."""
+        with self._lock:
+            if any(p.firma() == plan.firma() for p in self._cadenas.values()):
+                return None
+            self._numero += 1
+            self._cadenas[self._numero] = plan
+            for numero in sorted(self._cadenas)[: -self._capacidad]:
+                del self._cadenas[numero]
+                self._aceptadas.discard(numero)
+            return self._numero
+
+    def resolver(self, numero: int, remi: str) -> planificador.Plan | None:
+        """Retourne la chaîne si `remi` en est le fournisseur, sans la retirer."""
+        with self._lock:
+            plan = self._cadenas.get(numero)
+            if plan is None or plan.proveedor != remi:
+                return None
+            self._aceptadas.add(numero)
+            return plan
+
+    def completar(self, numero: int) -> bool:
+        """Retire la chaîne acceptée `numero`, dont notre part vient de partir ;
+        False si elle n'est pas (ou plus) en attente."""
+        with self._lock:
+            if numero not in self._aceptadas:
+                return False
+            self._aceptadas.discard(numero)
+            del self._cadenas[numero]
+            return True
+
+
+def _describir_paso(paso: planificador.Paso) -> str:
+    return f"{paso.de} envía {json.dumps(paso.recursos)} a {paso.para}"
+
+
+async def hacer_broadcast_cadenas(
+    estado: ButlerState,
+    otros: list[str],
+    cliente: ButlerClient,
+    cadenas: RegistroCadenas,
+    libro: mercado.LibroOrdenes,
+) -> ResumenEnvio:
+    """Propose les chaînes d'échanges à plusieurs agents trouvées par le planificateur.
+
+    Le planificateur n'y voit que les annonces des agents connus (`otros`) et
+    ne retient que les chaînes de 3 paquetes ou plus : les plans bilatéraux
+    sont déjà couverts par les offres 1:1, oro et menu.
+    Chaque participant reçoit une carta « Cadena #n » qui décrit toute la
+    chaîne et sa part ; il envoie sa part en acceptant. Notre envoi part quand
+    le fournisseur accepte (expandir_referencias_cadena).
+
+    Args:
+        estado:  État courant (pré-chargé par l'appelant).
+        otros:   Liste des alias des autres agents (seuls ceux-ci sont sollicités).
+        cliente: Client Butler à utiliser.
+        cadenas: Chaînes proposées par le slot (les nouvelles y sont enregistrées).
+        libro:   Carnet d'ordres du slot, source des annonces.
+
+    Returns:
+        ResumenEnvio des cartas envoyées / échouées (vide si aucune chaîne).
+    """
+    alias = estado.Alias or "agente"
+    faltan, sobran = calcular_faltan_sobran(estado.Recursos, estado.Objetivo)
+    if not faltan:
+        return ResumenEnvio()
+    conocidos = set(otros)
+    anuncios = {a: e for a, e in libro.instantanea().items() if a in conocidos}
+    planes = planificador.planificar(alias, faltan, sobran, anuncios)
+    cartas = []
+    for plan in planes:
+        numero = cadenas.registrar(plan)
+        if numero is None:
+            continue
+        resumen_cadena = "\n".join(f"- {_describir_paso(p)}" for p in plan.pasos)
+        for i, paso in enumerate(plan.pasos[1:], start=1):
+            recibe = plan.pasos[i - 1]
+            cuerpo = (
+                f"Hola, soy {alias}. Propongo un intercambio en cadena #{numero} "
+                f"entre {plan.paquetes} agentes:\n{resumen_cadena}\n"
+                f"Tu parte: envía {json.dumps(paso.recursos)} a {paso.para}; "
+                f"recibirás {json.dumps(recibe.recursos)} de {recibe.de}.\n"
+                f'Si aceptas, envía tu parte y responde "Acepto cadena #{numero}".'
+            )
+            cartas.append((paso.de, f"Cadena #{numero}", cuerpo))
+    if not cartas:
+        return ResumenEnvio()
+    resumen = await enviar_cartas(alias, cartas, cliente)
+    _registrar_resumen("cadena", resumen)
+    return resumen
+
+
+def expandir_referencias_cadena(carta: dict, cadenas: RegistroCadenas) -> dict:
+    """Explicite notre part d'une chaîne quand son fournisseur l'accepte.
+
+    Comme pour les menus, on ajoute au cuerpo les termes à exécuter : ce que
+    nous envoyons, à qui (le dernier maillon, pas l'expéditeur) et ce que
+    nous recevons. Les acceptations des autres maillons ne demandent rien.
+
+    Args:
+        carta:   La carta reçue.
+        cadenas: Chaînes proposées par le slot destinataire.
+
+    Returns:
+        La carta inchangée, ou une copie complétée par la note de la chaîne.
+    """
+    texto = f"{carta.get('asunto', '')} {carta.get('cuerpo', '')}"
+    notas = []
+    for numero in dict.fromkeys(_REF_CADENA.findall(texto)):
+        plan = cadenas.resolver(int(numero), carta.get("remi", ""))
+        if plan:
+            nuestro = plan.pasos[0]
+            notas.append(
+                f"(Referencia a tu cadena #{numero}: tu envias "
+                f"{json.dumps(nuestro.recursos)} a {nuestro.para} y recibes "
+                f"{json.dumps(plan.pasos[-1].recursos)})"
+            )
+    if not notas:
+        return carta
+    return {**carta, "cuerpo": f"{carta.get('cuerpo', '')}\n" + "\n".join(notas)}
@@ -1,5 +1,5 @@
 """
-app.py — Orquestación: polling, broadcasts y endpoints FastAPI.
+app.py — Endpoints FastAPI y ciclo de vida del runtime del agente.
 
 Agente autónomo de intercambio de recursos — FDI (Fundamentos de la Informática)
 
@@ -8,191 +8,185 @@ Arquitectura modular:
   butler.py — Cliente HTTP de Butler    (IA clásica: capa de acceso a datos)
   agent.py  — Lógica de negocio         (IA clásica: validación y decisiones)
   llm.py    — Prompts y consultas Ollama (IA moderna: negociación con LLM)
-  app.py    — Orquestación: polling, broadcasts y endpoints FastAPI
+  decisiones.py — Modelo tipado de las decisiones y esquema JSON para Ollama
+  intenciones.py — Clasificador de intención de las cartas (n-gramas, con confianza)
+  reglas.py — Motor de reglas         (IA clásica: fast-path antes del LLM)
+  buzon.py  — Sincronización del buzón (IA clásica: estado persistente)
+  planificador.py — Cadenas de intercambio entre varios agentes (oro como puente)
+  mercado.py — Libro de órdenes (quién ofrece/necesita qué) para broadcasts dirigidos
+  negociaciones.py — Ofertas enviadas y su liquidación sin LLM (SQLite por slot)
+  metricas.py — Métricas en memoria expuestas en /metrics (Prometheus)
+  trazas.py — Trazas por spans de cada carta (GET /trazas, logs JSON)
+  perfilador.py — Perfilador por muestreo del polling (POST /admin/perfil)
+  runtime.py — AgenteRuntime: polling, tratamiento de cartas y broadcasts (asyncio);
+               Anfitrion: varios slots en un proceso (pool Butler y cola LLM compartidos)
+  app.py    — Endpoints FastAPI y ciclo de vida del runtime
+
+Los endpoints de un slot se sirven bajo /slots/{slot}/...; sin prefijo,
+apuntan al primer slot de AGENTE_SLOTS (modo monopuesto).
+
+Banco de pruebas: simulador.py (Butler simulado), benchmark.py y replay.py;
+entrenar_intenciones.py entrena y evalúa el clasificador de intención.
 """
 
+import asyncio
 import json
 import logging
-import threading
 import time
 from contextlib import asynccontextmanager
-from datetime import datetime
+from typing import Annotated
 
-from fastapi import FastAPI
+import httpx
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 
-import agent
-import butler
-import llm
-from config import ACCEPT_COOLDOWN, BROADCAST_INTERVAL, POLL_INTERVAL
+import metricas
+import perfilador
+import trazas
+from config import LOG_JSON, PERFIL_MAX_SEGUNDOS
+from runtime import AgenteRuntime, Anfitrion
 
 # ── Logging ───────────────────────────────────────────────────────────────────
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    format="%(asctime)s [%(levelname)s] %(prefijo_slot)s%(name)s: %(message)s",
     datefmt="%H:%M:%S",
 )
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(trazas.FiltroTraza())
+    if LOG_JSON:
+        _handler.setFormatter(trazas.FormateadorJSON())
 logger = logging.getLogger(__name__)
 
-# ── État global du polling ────────────────────────────────────────────────────
-cartas_vistas: set[str] = set()  # IDs des cartas déjà traitées
-broadcast_cooldown_until: float = 0.0  # Timestamp : n'accepte pas avant cette heure
 
-
-# ── Orchestration des broadcasts ──────────────────────────────────────────────
+# ── FastAPI ────────────────────────────────────────────────────────────────────
 
 
-def hacer_broadcast_completo() -> None:
-    """Exécute le cycle complet de broadcast : général + 1:1 + achats oro.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Démarre un AgenteRuntime par slot dans la boucle de FastAPI et les
+    arrête proprement.
 
-    Récupère l'état et la liste des agents UNE SEULE FOIS, puis délègue
-    aux fonctions de broadcast dans agent.py. Met à jour le cooldown global
-    après le broadcast 1:1 pour éviter les sur-engagements de ressources.
+    À l'arrêt du serveur, les tâches de polling et leurs tâches filles sont
+    annulées avant la fermeture des clients HTTP partagés.
     """
-    global broadcast_cooldown_until
-    estado = butler.obtener_estado()
-    otros = butler.obtener_otros_agentes(estado.Alias)
+    anfitrion = Anfitrion()
+    app.state.anfitrion = anfitrion
+    anfitrion.iniciar()
+    try:
+        yield
+    finally:
+        await anfitrion.detener()
 
-    agent.hacer_broadcast_general(estado, otros)
-    agent.hacer_broadcast_propuestas_1a1(estado, otros)
-    broadcast_cooldown_until = time.time() + ACCEPT_COOLDOWN  # cooldown après 1:1
-    agent.hacer_broadcast_compras_con_oro(estado, otros)
 
-    logger.info("Broadcast completo enviado a %d agentes.", len(otros))
+app = FastAPI(
+    title="Agente de intercambio de recursos",
+    description="Agent autonome FDI — architecture modulaire Butler / Agent / LLM",
+    lifespan=lifespan,
+)
 
 
-# ── Traitement des cartas ──────────────────────────────────────────────────────
+def _runtime(request: Request, slot: str | None = None) -> AgenteRuntime:
+    """Runtime du slot de l'URL (/slots/{slot}/...), ou du slot par défaut."""
+    try:
+        return request.app.state.anfitrion.runtime(slot)
+    except KeyError:
+        raise HTTPException(
+            status_code=404, detail=f"Slot desconocido: {slot}"
+        ) from None
 
 
-def _procesar_carta(estado, carta: dict) -> None:
-    """Traite une seule carta : prompt → LLM → décision → exécution.
+RuntimeSlot = Annotated[AgenteRuntime, Depends(_runtime)]
 
-    Si la décision est 'aceptar', déclenche un re-broadcast pour mettre
-    à jour les propositions avec les ressources actualisées post-échange.
+# Endpoints d'un slot, montés sous /slots/{slot} et sans préfixe (slot par défaut)
+por_slot = APIRouter()
 
-    Args:
-        estado: État déjà récupéré par le polling_loop (pas de re-fetch HTTP).
-        carta:  La carta à traiter.
-    """
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    en_cooldown = time.time() < broadcast_cooldown_until
 
-    logger.info(
-        "[%s] CARTA de '%s' | %s", timestamp, carta.get("remi"), carta.get("asunto")
-    )
-    logger.info("  Cuerpo: %s", str(carta.get("cuerpo", ""))[:120])
-    if en_cooldown:
-        logger.info(
-            "  [cooldown] %ds restantes", int(broadcast_cooldown_until - time.time())
-        )
+@app.get("/slots")
+async def ver_slots(request: Request) -> dict:
+    """Slots hébergés par le processus, avec l'état de leur polling, et la
+    file LLM partagée (profondeur par type, attente, requêtes abandonnées)."""
+    anfitrion = request.app.state.anfitrion
+    return {
+        "por_defecto": anfitrion.por_defecto,
+        "slots": {slot: {"activo": r.activo} for slot, r in anfitrion.runtimes.items()},
+        "llm": anfitrion.cola.estadisticas(),
+    }
 
-    prompt = llm.construir_prompt_nueva_carta(estado, carta, en_cooldown=en_cooldown)
-    decision = llm.consultar_ollama(prompt)
-    resultado = agent.ejecutar_decision(decision, estado.Alias or "agente", estado)
 
-    logger.info("  → %s", resultado)
+@por_slot.post("/broadcast")
+async def broadcast(runtime: RuntimeSlot) -> dict:
+    """Déclenche manuellement un cycle complet de broadcast vers tous les agents."""
+    resumen = await runtime.broadcast_completo()
+    return {
+        "status": "broadcast envoyé",
+        "enviadas": resumen.enviadas,
+        "fallidas": resumen.fallidas,
+    }
 
-    if resultado.get("estado") == "aceptado_y_enviado":
-        logger.info("Post-accept: re-broadcast avec ressources mises à jour.")
-        try:
-            hacer_broadcast_completo()
-        except Exception as e:
-            logger.error("Erreur re-broadcast post-accept: %s", e)
 
+@por_slot.post("/notify")
+async def notify(runtime: RuntimeSlot) -> dict:
+    """Signale l'arrivée d'une carta (Butler ou stand-in) : poll immédiat du buzón."""
+    runtime.despertar.set()
+    return {"status": "poll programado"}
 
-# ── Boucle de polling ──────────────────────────────────────────────────────────
 
+@por_slot.get("/latencia")
+async def latencia(runtime: RuntimeSlot) -> dict:
+    """Latences récentes arrivée → décision et détection → décision (secondes)."""
+    return runtime.resumen_latencias()
 
-def polling_loop() -> None:
-    """Boucle principale du daemon de polling.
 
-    1. Attend que Butler soit accessible au démarrage (retry toutes les 5s).
-    2. Marque les cartas existantes comme déjà vues (évite de les retraiter).
-    3. Envoie les broadcasts initiaux.
-    4. Toutes les POLL_INTERVAL secondes : détecte et traite les nouvelles cartas.
-    5. Toutes les BROADCAST_INTERVAL secondes : re-broadcast périodique.
-    """
-    logger.info("Polling démarré.")
-
-    # Attente de Butler
-    while True:
-        try:
-            estado = butler.obtener_estado()
-            for carta_id in estado.Buzon or {}:
-                cartas_vistas.add(carta_id)
-            logger.info(
-                "Butler connecté. %d cartas existantes ignorées.", len(cartas_vistas)
-            )
-            break
-        except Exception:
-            logger.warning("Butler non disponible, retry dans 5s...")
-            time.sleep(5)
-
-    # Broadcasts initiaux
-    try:
-        hacer_broadcast_completo()
-    except Exception as e:
-        logger.error("Erreur broadcast initial: %s", e)
-
-    ultimo_broadcast = time.time()
-
-    # Boucle principale
-    while True:
-        time.sleep(POLL_INTERVAL)
-        try:
-            # Broadcast périodique
-            if time.time() - ultimo_broadcast >= BROADCAST_INTERVAL:
-                logger.info("Broadcast périodique...")
-                try:
-                    hacer_broadcast_completo()
-                    ultimo_broadcast = time.time()
-                except Exception as e:
-                    logger.error("Erreur broadcast périodique: %s", e)
-
-            # Détection des nouvelles cartas
-            estado = butler.obtener_estado()
-            nuevas = {
-                cid: carta
-                for cid, carta in (estado.Buzon or {}).items()
-                if cid not in cartas_vistas
-            }
-            if nuevas:
-                logger.info("%d nouvelle(s) carta(s) détectée(s).", len(nuevas))
-                for cid, carta in nuevas.items():
-                    cartas_vistas.add(cid)
-                    _procesar_carta(estado, carta)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Métriques au format d'exposition Prometheus (compteurs et histogrammes)."""
+    return PlainTextResponse(
+        metricas.registro.exponer(), media_type="text/plain; version=0.0.4"
+    )
 
-        except Exception as e:
-            logger.error("Erreur polling: %s", e)
 
+@por_slot.get("/mercado")
+async def ver_mercado(runtime: RuntimeSlot) -> dict:
+    """Carnet d'ordres : demandes et offres fraîches annoncées par chaque agent."""
+    return runtime.libro.instantanea()
 
-# ── FastAPI ────────────────────────────────────────────────────────────────────
 
+@por_slot.get("/negociaciones")
+async def ver_negociaciones(runtime: RuntimeSlot) -> dict:
+    """Offres enregistrées par état, llegadas non imputées et règlements en cours."""
+    return runtime.negociaciones.instantanea()
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    thread = threading.Thread(target=polling_loop, daemon=True)
-    thread.start()
-    yield
 
+@app.get("/trazas")
+async def ver_trazas(n: int = 20) -> list[dict]:
+    """Chronologie (spans) des n dernières traces : polls avec cartas, broadcasts."""
+    return trazas.ultimas(n)
 
-app = FastAPI(
-    title="Agente de intercambio de recursos",
-    description="Agent autonome FDI — architecture modulaire Butler / Agent / LLM",
-    lifespan=lifespan,
-)
 
+@app.post("/admin/perfil")
+async def perfil(request: Request, segundos: float = 10.0) -> dict:
+    """Profile par échantillonnage la boucle d'événements de l'agent pendant N s.
 
-@app.post("/broadcast")
-def broadcast() -> dict:
-    """Déclenche manuellement un cycle complet de broadcast vers tous les agents."""
-    hacer_broadcast_completo()
-    return {"status": "broadcast envoyé"}
+    L'échantillonneur tourne dans un thread à part : la boucle continue de
+    servir le polling et les autres endpoints pendant la mesure. Tous les
+    slots partagent cette boucle : le profil les couvre ensemble.
+    """
+    runtime = _runtime(request)
+    if not runtime.activo or runtime.hilo is None:
+        raise HTTPException(status_code=409, detail="Polling no activo")
+    return await asyncio.to_thread(
+        perfilador.perfilar,
+        [runtime.hilo],
+        segundos=max(0.1, min(segundos, PERFIL_MAX_SEGUNDOS)),
+    )
 
 
-@app.post("/aceptar/{dest}")
-def aceptar(dest: str, envio: dict) -> dict:
+@por_slot.post("/aceptar/{dest}")
+async def aceptar(dest: str, envio: dict, runtime: RuntimeSlot) -> dict:
     """Accepte manuellement un échange : envoie un paquet et une carta de confirmation."""
-    estado = butler.obtener_estado()
+    cliente = runtime.cliente
+    estado = await cliente.obtener_estado()
     alias = estado.Alias or "agente"
 
     for rec, cant in envio.items():
@@ -201,11 +195,27 @@ def aceptar(dest: str, envio: dict) -> dict:
                 "error": f"No tienes suficiente {rec} (tienes {estado.Recursos.get(rec, 0)})"
             }
 
-    butler.enviar_paquete(dest, envio)
-    butler.enviar_carta(
-        remi=alias,
-        dest=dest,
-        asunto="Intercambio aceptado",
-        cuerpo=f"Acepto el trato. Te envié: {json.dumps(envio)}. Envíame tu parte si aún no lo has hecho.",
-    )
-    return {"estado": "aceptado_y_enviado", "dest": dest, "paquete": envio}
+    inicio = time.monotonic()
+    if not await cliente.enviar_paquete(dest, envio):
+        return {"estado": "paquete_fallido", "dest": dest, "paquete": envio}
+    runtime.negociaciones.registrar_envio(dest, envio, {}, inicio)
+    resultado = {"estado": "aceptado_y_enviado", "dest": dest, "paquete": envio}
+    # Le paquete est parti : l'échec de la carta de confirmation ne change
+    # pas l'issue de l'échange, il est seulement signalé.
+    try:
+        carta_enviada = await cliente.enviar_carta(
+            remi=alias,
+            dest=dest,
+            asunto="Intercambio aceptado",
+            cuerpo=f"Acepto el trato. Te envié: {json.dumps(envio)}. Envíame tu parte si aún no lo has hecho.",
+        )
+    except httpx.HTTPError as e:
+        logger.error("Error enviando confirmación a %s: %s", dest, e)
+        carta_enviada = False
+    if not carta_enviada:
+        resultado["carta_fallida"] = True
+    return resultado
+
+
+app.include_router(por_slot)
+app.include_router(por_slot, prefix="/slots/{slot}")
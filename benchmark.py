@@ -0,0 +1,287 @@
+"""
+benchmark.py — Banc de charge multi-agents sur le Butler simulé.
+
+Fait jouer l'agent (AgenteRuntime de runtime.py, via HTTP) contre N agents synthétiques
+(simulador.py) jusqu'à ce que tous aient atteint leur objectif, que le
+marché soit bloqué (plus aucun paquete) ou que le temps maximal soit
+écoulé, puis affiche :
+
+- cartas/s et paquetes/s (total et agent testé) ;
+- appels LLM (faux Ollama), appels LLM par carta reçue par l'agent testé
+  et taux de fast-path des règles ; --sin-agrupar rejoue la partie avec un
+  appel LLM par carta (sans LLM_AGRUPAR) pour comparer ;
+- temps jusqu'à l'objectif (agent testé et agents synthétiques) et trafic
+  de l'agent testé pour l'atteindre (cartas envoyées, paquetes échangés,
+  appels LLM) ; --unitario rejoue la partie avec des offres d'une unité
+  (sans OFERTAS_POR_LOTE) pour comparer ;
+- cartas de broadcast évitées par le carnet d'ordres (mercado.py) ;
+  --sin-mercado rejoue la partie en fan-out complet pour comparer ;
+- pic mémoire Python (tracemalloc) du processus.
+
+Usage :
+    python benchmark.py --agentes 10 --semilla 1 --max-segundos 60
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import tracemalloc
+
+import agent
+import app  # noqa: F401 — configuration du logging de l'agent
+import buzon
+import llm
+import mercado
+import metricas
+from butler import ButlerClient
+from config import ACCEPT_COOLDOWN, BROADCAST_INTERVAL, MERCADO_TTL
+from negociaciones import Negociaciones
+from runtime import AgenteRuntime
+from simulador import (
+    ESTRATEGIAS,
+    AgenteSintetico,
+    MundoSimulado,
+    ServidorSimulado,
+    generar_mundo,
+)
+
+ALIAS_PROBADO = "agente_probado"
+SLOT_PROBADO = "probado"
+
+
+async def _jugar(
+    runtime: AgenteRuntime,
+    mundo: MundoSimulado,
+    sinteticos: list[AgenteSintetico],
+    max_segundos: float,
+    tick: float,
+    intervalo_broadcast: float,
+    estancamiento: float,
+    intervalo_poll: float = 0.0,
+) -> str:
+    """Déroule la partie dans une boucle d'événements ; retourne le motif de fin."""
+    try:
+        runtime.sincronizador.inicializar(
+            (await runtime.cliente.obtener_estado()).Buzon or {}
+        )
+        await runtime.broadcast_completo()
+        ultimo_broadcast = ultimo_paquete = ultimo_poll = time.time()
+        paquetes_vistos = 0
+        while time.time() - mundo.inicio < max_segundos:
+            for sintetico in sinteticos:
+                sintetico.avanzar()
+            if time.time() - ultimo_poll >= intervalo_poll:
+                await runtime.poll_buzon()
+                ultimo_poll = time.time()
+            if len(mundo.completados()) == len(mundo.agentes):
+                return "completado"
+            if sum(mundo.paquetes.values()) != paquetes_vistos:
+                paquetes_vistos = sum(mundo.paquetes.values())
+                ultimo_paquete = time.time()
+            elif time.time() - ultimo_paquete >= estancamiento:
+                return "estancado"
+            if time.time() - ultimo_broadcast >= intervalo_broadcast:
+                await runtime.broadcast_completo()
+                ultimo_broadcast = time.time()
+            await asyncio.sleep(tick)
+        return "max_segundos"
+    finally:
+        await runtime.cerrar()
+
+
+def ejecutar_benchmark(
+    n_agentes: int = 10,
+    semilla: int = 0,
+    max_segundos: float = 60.0,
+    latencia_llm: float = 0.5,
+    estrategias: list[str] | None = None,
+    tick: float = 0.05,
+    prob_propuesta: float = 0.1,
+    cooldown: float | None = None,
+    intervalo_broadcast: float = BROADCAST_INTERVAL,
+    estancamiento: float = 15.0,
+    lotes: bool = True,
+    max_unidades: int = 3,
+    dirigido: bool = True,
+    agrupar: bool = True,
+    intervalo_poll: float = 0.0,
+) -> dict:
+    """Exécute une partie complète et retourne les mesures.
+
+    Args:
+        n_agentes:           Nombre d'agents synthétiques.
+        semilla:             Graine (monde et comportements reproductibles).
+        max_segundos:        Durée maximale de la partie.
+        latencia_llm:        Latence de chaque appel au faux Ollama (s).
+        estrategias:         Estrategias attribuées à tour de rôle aux agents
+                             synthétiques (par défaut cooperativo/exigente).
+        tick:                Pause entre deux tours (agents synthétiques + poll).
+        prob_propuesta:      Probabilité de proposition spontanée par agent et par tick.
+        cooldown:            Remplace ACCEPT_COOLDOWN de l'agent testé si fourni.
+        intervalo_broadcast: Période des re-broadcasts de l'agent testé (s).
+        estancamiento:       Arrête la partie si aucun paquete n'a circulé
+                             depuis ce délai (s) : le marché est bloqué.
+        lotes:               Offres par lots (OFERTAS_POR_LOTE) de l'agent testé ;
+                             False : offres d'une unité.
+        max_unidades:        Unités maximales visées par ressource (generar_mundo).
+        dirigido:            Broadcasts ciblés par le carnet d'ordres ; False :
+                             carnet toujours périmé, donc fan-out complet.
+        agrupar:             Un appel LLM par expéditeur et par lot ; False :
+                             un appel par carta.
+        intervalo_poll:      Période (s) des polls de l'agent testé (0 : à
+                             chaque tick) ; plus longue, elle laisse plusieurs
+                             cartas d'un même expéditeur s'accumuler.
+    """
+    estrategias = estrategias or ["cooperativo", "exigente"]
+    tracemalloc.start()
+    mundo = generar_mundo(
+        n_agentes, ALIAS_PROBADO, SLOT_PROBADO, semilla, max_unidades=max_unidades
+    )
+    rnd = random.Random(semilla)
+    sinteticos = [
+        AgenteSintetico(
+            mundo, alias, estrategias[i % len(estrategias)], rnd, prob_propuesta
+        )
+        for i, alias in enumerate(a for a in mundo.agentes if a != ALIAS_PROBADO)
+    ]
+    servidor = ServidorSimulado(mundo, latencia_llm)
+    url = servidor.iniciar()
+
+    # L'agent testé parle au Butler simulé et au faux Ollama.
+    runtime = AgenteRuntime(
+        ButlerClient(base_url=url, slot=SLOT_PROBADO),
+        buzon.SincronizadorBuzon(ruta=None),
+        accept_cooldown=ACCEPT_COOLDOWN if cooldown is None else cooldown,
+        libro=mercado.LibroOrdenes(MERCADO_TTL if dirigido else 0),
+        agrupar=agrupar,
+        negociaciones=Negociaciones(ruta=None),
+    )
+    llm.OLLAMA_URL = f"{url}/api/chat"
+    agent.OFERTAS_POR_LOTE = lotes
+
+    mundo.inicio = inicio = time.time()
+    try:
+        motivo = asyncio.run(
+            _jugar(
+                runtime,
+                mundo,
+                sinteticos,
+                max_segundos,
+                tick,
+                intervalo_broadcast,
+                estancamiento,
+                intervalo_poll,
+            )
+        )
+    finally:
+        duracion = time.time() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        servidor.detener()
+
+    completados = mundo.completados()
+    tiempos_sinteticos = sorted(
+        t for alias, t in completados.items() if alias != ALIAS_PROBADO
+    )
+    cartas, paquetes = sum(mundo.cartas.values()), sum(mundo.paquetes.values())
+    trafico = mundo.agentes[ALIAS_PROBADO].trafico_objetivo or {}
+    recibidas = mundo.cartas_recibidas.get(ALIAS_PROBADO, 0)
+    return {
+        "agentes": n_agentes,
+        "semilla": semilla,
+        "duracion_s": round(duracion, 2),
+        "fin": motivo,
+        "cartas": cartas,
+        "cartas_por_s": round(cartas / duracion, 1),
+        "cartas_agente": mundo.cartas.get(ALIAS_PROBADO, 0),
+        "paquetes": paquetes,
+        "paquetes_por_s": round(paquetes / duracion, 2),
+        "paquetes_agente": mundo.paquetes.get(ALIAS_PROBADO, 0),
+        "llamadas_llm": mundo.llamadas_llm,
+        "cartas_recibidas_agente": recibidas,
+        "llamadas_llm_por_carta": (
+            round(mundo.llamadas_llm / recibidas, 3) if recibidas else None
+        ),
+        "cartas_broadcast_evitadas": int(
+            sum(
+                metricas.broadcast_cartas_total.valor(tipo=t, resultado="evitada")
+                for t in ("1:1", "oro", "menú")
+            )
+        ),
+        "fast_path": runtime.estadisticas_reglas.estadisticas(),
+        "objetivo_agente_s": (
+            round(completados[ALIAS_PROBADO], 2)
+            if ALIAS_PROBADO in completados
+            else None
+        ),
+        "cartas_hasta_objetivo": trafico.get("cartas"),
+        "paquetes_hasta_objetivo": trafico.get("paquetes"),
+        "llamadas_llm_hasta_objetivo": trafico.get("llamadas_llm"),
+        "sinteticos_completados": f"{len(tiempos_sinteticos)}/{n_agentes}",
+        "objetivo_sinteticos_p50_s": (
+            round(tiempos_sinteticos[len(tiempos_sinteticos) // 2], 2)
+            if tiempos_sinteticos
+            else None
+        ),
+        "memoria_pico_mb": round(pico / 1e6, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--agentes", type=int, default=10)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--max-segundos", type=float, default=60.0)
+    parser.add_argument("--latencia-llm", type=float, default=0.5)
+    parser.add_argument(
+        "--estrategias",
+        default="cooperativo,exigente",
+        help=f"liste séparée par des virgules parmi {', '.join(ESTRATEGIAS)}",
+    )
+    parser.add_argument("--tick", type=float, default=0.05)
+    parser.add_argument("--prob-propuesta", type=float, default=0.1)
+    parser.add_argument("--cooldown", type=float, default=None)
+    parser.add_argument("--intervalo-broadcast", type=float, default=BROADCAST_INTERVAL)
+    parser.add_argument("--estancamiento", type=float, default=15.0)
+    parser.add_argument("--intervalo-poll", type=float, default=0.0)
+    parser.add_argument("--unidades-max", type=int, default=3)
+    parser.add_argument(
+        "--sin-mercado", action="store_true", help="broadcasts sans ciblage"
+    )
+    parser.add_argument(
+        "--unitario", action="store_true", help="offres d'une unité (sans lots)"
+    )
+    parser.add_argument(
+        "--sin-agrupar",
+        action="store_true",
+        help="un appel LLM par carta (sans regroupement par expéditeur)",
+    )
+    parser.add_argument("--verbose", action="store_true", help="logs INFO de l'agent")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    resultado = ejecutar_benchmark(
+        n_agentes=args.agentes,
+        semilla=args.semilla,
+        max_segundos=args.max_segundos,
+        latencia_llm=args.latencia_llm,
+        estrategias=args.estrategias.split(","),
+        tick=args.tick,
+        prob_propuesta=args.prob_propuesta,
+        cooldown=args.cooldown,
+        intervalo_broadcast=args.intervalo_broadcast,
+        estancamiento=args.estancamiento,
+        lotes=not args.unitario,
+        max_unidades=args.unidades_max,
+        dirigido=not args.sin_mercado,
+        agrupar=not args.sin_agrupar,
+        intervalo_poll=args.intervalo_poll,
+    )
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,88 +4,279 @@ butler.py — Couche réseau vers le serveur Butler (IA classique : accès aux d
 Ce module est la seule source de vérité pour les appels HTTP vers Butler.
 Il ne contient aucune logique métier : il reçoit des paramètres, exécute
 une requête HTTP et retourne le résultat brut ou lève une exception.
+
+Toutes les requêtes passent par un ButlerClient asynchrone qui partage un
+pool de connexions keep-alive (httpx.AsyncClient) : un broadcast de
+plusieurs centaines de cartas réutilise les mêmes sockets TCP au lieu
+d'ouvrir une connexion par appel, et les envois simultanés ne bloquent pas
+la boucle d'événements de l'agent. Un client est lié à la boucle qui s'en
+sert : c'est AgenteRuntime (runtime.py) qui le crée et le ferme. En mode
+multi-slot, les ButlerClient de tous les slots partagent une même session
+(nueva_sesion) : un seul pool de connexions pour tout le processus.
+
+Les lectures passent par un cache : la liste des agents (/gente) est gardée
+BUTLER_GENTE_TTL secondes ; une lecture de /info est partagée par les
+coroutines qui la demandent pendant qu'elle est en cours ou dans les
+BUTLER_INFO_VENTANA secondes qui suivent (broadcasts, /aceptar), et oubliée
+dès que nous envoyons un paquete (nos Recursos changent). Le polling, lui,
+interroge toujours Butler (fresco=True) et rafraîchit ce cache. Une réponse /info identique à la
+précédente (304 si Butler gère les ETag, sinon mêmes octets) n'est pas
+re-parsée : le ButlerState précédent est renvoyé tel quel. Les états
+renvoyés sont donc partagés et ne doivent pas être modifiés.
 """
 
+import asyncio
 import logging
+import time
 
-import requests
+import httpx
 
-from config import AGENTE_SLOT, BUTLER_BASE_URL, ButlerState
+import metricas
+import trazas
+from config import (
+    AGENTE_SLOT,
+    BUTLER_BASE_URL,
+    BUTLER_CONNECT_TIMEOUT,
+    BUTLER_GENTE_TTL,
+    BUTLER_INFO_VENTANA,
+    BUTLER_POOL_SIZE,
+    BUTLER_READ_TIMEOUT,
+    ButlerState,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def obtener_estado() -> ButlerState:
-    """Récupère l'état courant de l'agent depuis l'endpoint /info de Butler.
+def _comprobar_respuesta(r: httpx.Response) -> bool:
+    """Journalise la réponse d'une écriture Butler et indique si elle a réussi."""
+    if r.is_success:
+        logger.debug("Butler: %s %s", r.status_code, r.text)
+    else:
+        logger.warning("Butler rechazó %s: %s %s", r.url, r.status_code, r.text)
+    return r.is_success
 
-    Returns:
-        ButlerState avec les ressources, l'objectif et le buzón actuel.
 
-    Raises:
-        requests.RequestException: Si Butler est inaccessible.
+def nueva_sesion(
+    pool_size: int = BUTLER_POOL_SIZE,
+    connect_timeout: float = BUTLER_CONNECT_TIMEOUT,
+    read_timeout: float = BUTLER_READ_TIMEOUT,
+) -> httpx.AsyncClient:
+    """Session httpx (pool keep-alive) partageable entre plusieurs ButlerClient.
+
+    Args:
+        pool_size:       Nombre maximal de connexions gardées ouvertes.
+        connect_timeout: Délai maximal d'établissement de connexion (s).
+        read_timeout:    Délai maximal d'attente de la réponse (s).
     """
-    r = requests.get(
-        f"{BUTLER_BASE_URL}/info", params={"agente": AGENTE_SLOT}, timeout=10
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size
+        ),
     )
-    r.raise_for_status()
-    return ButlerState(**r.json())
 
 
-def obtener_otros_agentes(mi_alias: str) -> list[str]:
-    """Retourne la liste des alias de tous les autres agents actifs.
+class ButlerClient:
+    """Client HTTP asynchrone vers Butler, avec pool de connexions keep-alive.
 
-    Args:
-        mi_alias: L'alias de cet agent, exclu de la liste retournée.
-
-    Returns:
-        Liste des alias. Retourne [] en cas d'erreur réseau.
-    """
-    try:
-        r = requests.get(
-            f"{BUTLER_BASE_URL}/gente", params={"agente": AGENTE_SLOT}, timeout=10
-        )
-        r.raise_for_status()
-        return [
-            g.get("Alias", g.get("alias", ""))
-            for g in r.json()
-            if g.get("Alias", g.get("alias", "")) != mi_alias
-        ]
-    except Exception as e:
-        logger.error("Error obteniendo agentes: %s", e)
-        return []
-
-
-def enviar_carta(remi: str, dest: str, asunto: str, cuerpo: str) -> None:
-    """Envoie une carta (lettre) à un agent via Butler.
+    Les coroutines d'une même boucle peuvent l'utiliser simultanément : le
+    pool httpx distribue une connexion par requête en cours (au plus
+    `pool_size`, les suivantes attendent qu'une connexion se libère).
 
     Args:
-        remi:   Alias de l'expéditeur.
-        dest:   Alias du destinataire.
-        asunto: Objet de la carta.
-        cuerpo: Corps de la carta.
+        base_url:        URL racine du serveur Butler.
+        slot:            Identifiant de slot envoyé dans le paramètre `agente`.
+        pool_size:       Nombre maximal de connexions gardées ouvertes.
+        connect_timeout: Délai maximal d'établissement de connexion (s).
+        read_timeout:    Délai maximal d'attente de la réponse (s).
+        session:         Session partagée (nueva_sesion) ; si fournie, les
+                         paramètres de pool sont ignorés et close() ne la
+                         ferme pas.
+        gente_ttl:       Durée de vie (s) de la liste des agents en cache.
+        info_ventana:    Fenêtre (s) pendant laquelle une lecture de /info est
+                         réutilisée (0 : seulement partagée pendant la requête).
     """
-    logger.info("CARTA → %s | %s", dest, asunto)
-    r = requests.post(
-        f"{BUTLER_BASE_URL}/carta",
-        params={"agente": AGENTE_SLOT},
-        json={"remi": remi, "dest": dest, "asunto": asunto, "cuerpo": cuerpo},
-        timeout=10,
-    )
-    logger.debug("Butler: %s %s", r.status_code, r.text)
 
+    def __init__(
+        self,
+        base_url: str = BUTLER_BASE_URL,
+        slot: str = AGENTE_SLOT,
+        pool_size: int = BUTLER_POOL_SIZE,
+        connect_timeout: float = BUTLER_CONNECT_TIMEOUT,
+        read_timeout: float = BUTLER_READ_TIMEOUT,
+        session: httpx.AsyncClient | None = None,
+        gente_ttl: float = BUTLER_GENTE_TTL,
+        info_ventana: float = BUTLER_INFO_VENTANA,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.slot = slot
+        self._sesion_propia = session is None
+        self.session = session or nueva_sesion(pool_size, connect_timeout, read_timeout)
+        self.gente_ttl = gente_ttl
+        self.info_ventana = info_ventana
+        self._gente: tuple[float, list[str]] | None = None  # (instant, alias)
+        self._info: tuple[float, ButlerState] | None = None  # (début de lecture, état)
+        self._info_en_curso: asyncio.Task | None = None
+        self._info_version = 0  # incrémentée par invalidar_estado
+        self._ultima_info: tuple[bytes, str | None, ButlerState] | None = None
 
-def enviar_paquete(dest: str, recursos: dict) -> None:
-    """Envoie un paquet de ressources à un agent via Butler.
+    async def close(self) -> None:
+        """Ferme toutes les connexions du pool (sauf session partagée)."""
+        if self._sesion_propia:
+            await self.session.aclose()
 
-    Args:
-        dest:     Alias du destinataire.
-        recursos: Dictionnaire {ressource: quantité} à transférer.
-    """
-    logger.info("PAQUETE → %s: %s", dest, recursos)
-    r = requests.post(
-        f"{BUTLER_BASE_URL}/paquete/{dest}",
-        params={"agente": AGENTE_SLOT},
-        json=recursos,
-        timeout=10,
-    )
-    logger.debug("Butler: %s %s", r.status_code, r.text)
+    def invalidar_estado(self) -> None:
+        """Oublie la lecture de /info en cache ou en cours : la prochaine
+        lecture interroge Butler."""
+        self._info = None
+        self._info_en_curso = None
+        self._info_version += 1
+
+    async def obtener_estado(self, fresco: bool = False) -> ButlerState:
+        """Récupère l'état courant de l'agent depuis l'endpoint /info de Butler.
+
+        Une lecture en cours, ou terminée depuis moins de `info_ventana`
+        secondes, est partagée au lieu d'envoyer une nouvelle requête.
+
+        Args:
+            fresco: Interroger Butler dans tous les cas (polling : une carta
+                    signalée par /notify doit être vue) ; la réponse
+                    rafraîchit le cache des autres lecteurs.
+
+        Returns:
+            ButlerState avec les ressources, l'objectif et le buzón actuel.
+
+        Raises:
+            httpx.HTTPError: Si Butler est inaccessible.
+        """
+        if fresco:
+            return await self._leer_estado()
+        if self._info and time.monotonic() - self._info[0] < self.info_ventana:
+            metricas.butler_cache_total.inc(endpoint="info", resultado="acierto")
+            return self._info[1]
+        if self._info_en_curso is None:
+            tarea = asyncio.ensure_future(self._leer_estado())
+            tarea.add_done_callback(self._fin_lectura)
+            self._info_en_curso = tarea
+        else:
+            metricas.butler_cache_total.inc(endpoint="info", resultado="compartida")
+        # shield : l'annulation d'un lecteur n'interrompt pas celle des autres
+        return await asyncio.shield(self._info_en_curso)
+
+    def _fin_lectura(self, tarea: asyncio.Task) -> None:
+        if self._info_en_curso is tarea:
+            self._info_en_curso = None
+        # l'exception éventuelle est remontée aux lecteurs, pas au journal asyncio
+        if not tarea.cancelled():
+            tarea.exception()
+
+    async def _leer_estado(self) -> ButlerState:
+        """GET /info ; une réponse identique à la précédente n'est pas re-parsée."""
+        version, inicio = self._info_version, time.monotonic()
+        ultima = self._ultima_info
+        cabeceras = {"If-None-Match": ultima[1]} if ultima and ultima[1] else None
+        with (
+            metricas.butler_obtener_estado_segundos.medir(),
+            trazas.span("butler.info"),
+        ):
+            r = await self.session.get(
+                f"{self.base_url}/info",
+                params={"agente": self.slot},
+                headers=cabeceras,
+            )
+        if ultima and (r.status_code == 304 or r.content == ultima[0]):
+            estado, resultado = ultima[2], "sin_cambios"
+        else:
+            r.raise_for_status()
+            estado, resultado = ButlerState(**r.json()), "leida"
+            self._ultima_info = (r.content, r.headers.get("etag"), estado)
+        metricas.butler_cache_total.inc(endpoint="info", resultado=resultado)
+        if version == self._info_version:  # pas de paquete envoyé entre-temps
+            self._info = (inicio, estado)
+        return estado
+
+    async def obtener_otros_agentes(self, mi_alias: str) -> list[str]:
+        """Retourne la liste des alias de tous les autres agents actifs.
+
+        La liste est gardée `gente_ttl` secondes ; en cas d'erreur réseau, la
+        dernière liste connue (même expirée) est renvoyée.
+
+        Args:
+            mi_alias: L'alias de cet agent, exclu de la liste retournée.
+
+        Returns:
+            Liste des alias. Retourne [] en cas d'erreur réseau sans liste connue.
+        """
+        ahora = time.monotonic()
+        if self._gente and ahora - self._gente[0] < self.gente_ttl:
+            metricas.butler_cache_total.inc(endpoint="gente", resultado="acierto")
+            return [a for a in self._gente[1] if a != mi_alias]
+        try:
+            with trazas.span("butler.gente"):
+                r = await self.session.get(
+                    f"{self.base_url}/gente", params={"agente": self.slot}
+                )
+            r.raise_for_status()
+            self._gente = (
+                ahora,
+                [g.get("Alias", g.get("alias", "")) for g in r.json()],
+            )
+            metricas.butler_cache_total.inc(endpoint="gente", resultado="leida")
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error("Error obteniendo agentes: %s", e)
+            if self._gente is None:
+                return []
+        return [a for a in self._gente[1] if a != mi_alias]
+
+    async def enviar_carta(
+        self, remi: str, dest: str, asunto: str, cuerpo: str
+    ) -> bool:
+        """Envoie une carta (lettre) à un agent via Butler.
+
+        Args:
+            remi:   Alias de l'expéditeur.
+            dest:   Alias du destinataire.
+            asunto: Objet de la carta.
+            cuerpo: Corps de la carta.
+
+        Returns:
+            True si Butler a accepté la carta (réponse 2xx).
+
+        Raises:
+            httpx.HTTPError: Si Butler est inaccessible.
+        """
+        logger.info("CARTA → %s | %s", dest, asunto)
+        with trazas.span("butler.carta", dest=dest) as s:
+            r = await self.session.post(
+                f"{self.base_url}/carta",
+                params={"agente": self.slot},
+                json={"remi": remi, "dest": dest, "asunto": asunto, "cuerpo": cuerpo},
+            )
+            s.anotar(status=r.status_code)
+        return _comprobar_respuesta(r)
+
+    async def enviar_paquete(self, dest: str, recursos: dict) -> bool:
+        """Envoie un paquet de ressources à un agent via Butler.
+
+        Args:
+            dest:     Alias du destinataire.
+            recursos: Dictionnaire {ressource: quantité} à transférer.
+
+        Returns:
+            True si Butler a accepté le paquete (réponse 2xx).
+
+        Raises:
+            httpx.HTTPError: Si Butler est inaccessible.
+        """
+        logger.info("PAQUETE → %s: %s", dest, recursos)
+        try:
+            with trazas.span("butler.paquete", dest=dest) as s:
+                r = await self.session.post(
+                    f"{self.base_url}/paquete/{dest}",
+                    params={"agente": self.slot},
+                    json=recursos,
+                )
+                s.anotar(status=r.status_code)
+        finally:
+            self.invalidar_estado()  # nos Recursos ont (peut-être) changé
+        return _comprobar_respuesta(r)
@@ -0,0 +1,199 @@
+"""
+buzon.py — Synchronisation incrémentale du buzón (IA classique : état persistant).
+
+Butler ne renvoie que le buzón complet via /info. Ce module décide, à chaque
+poll, quelles cartas sont nouvelles, sans garder un ensemble d'IDs qui
+grossit indéfiniment et sans perdre cet état au redémarrage :
+
+- une marque haute (high-water mark) suit la `fecha` la plus récente vue ;
+- l'ensemble des cartas vues est borné par âge : une carta plus ancienne que
+  marque_haute - retención est oubliée, et toute carta aussi ancienne est
+  considérée comme déjà vue ;
+- les cartas détectées mais pas encore traitées sont « pendientes » ;
+- le tout est checkpointé sur disque (écriture atomique) pour qu'un
+  redémarrage reprenne là où il s'était arrêté : les cartas arrivées pendant
+  l'arrêt et les pendientes sont traitées, les autres ne le sont pas.
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from config import BUZON_CHECKPOINT, BUZON_RETENCION
+
+logger = logging.getLogger(__name__)
+
+
+def _parsear_fecha(fecha: str | None) -> datetime | None:
+    try:
+        return datetime.fromisoformat(fecha) if fecha else None
+    except ValueError:
+        return None
+
+
+def ruta_checkpoint(slot: str) -> str:
+    """Fichier de checkpoint du slot (gabarit BUZON_CHECKPOINT)."""
+    return BUZON_CHECKPOINT.format(slot=slot)
+
+
+class SincronizadorBuzon:
+    """Détection incrémentale des nouvelles cartas avec seen-set borné et persistant.
+
+    Args:
+        ruta:      Fichier de checkpoint du slot (ruta_checkpoint ; None : pas
+                   de persistance).
+        retencion: Âge maximal (s) d'une carta, relatif à la marque haute,
+                   au-delà duquel elle est oubliée du seen-set.
+    """
+
+    def __init__(
+        self,
+        ruta: str | None,
+        retencion: float = BUZON_RETENCION,
+    ) -> None:
+        self.ruta = ruta
+        self.retencion = timedelta(seconds=retencion)
+        self._vistas: dict[str, str] = {}  # id → fecha
+        self._pendientes: set[str] = set()
+        self._marca_alta: datetime | None = None
+        self._lock = threading.Lock()
+        self.reanudado = False
+
+    # ── Persistance ────────────────────────────────────────────────────────────
+
+    def cargar(self) -> bool:
+        """Recharge le checkpoint s'il existe. Retourne True si l'état a été repris."""
+        if not self.ruta or not os.path.exists(self.ruta):
+            return False
+        try:
+            with open(self.ruta, encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Checkpoint buzón illisible (%s), ignoré.", e)
+            return False
+        with self._lock:
+            self._vistas = dict(datos.get("vistas", {}))
+            self._pendientes = set(datos.get("pendientes", []))
+            self._marca_alta = _parsear_fecha(datos.get("marca_alta"))
+            self.reanudado = True
+        logger.info(
+            "Checkpoint buzón repris : %d cartas vues, %d pendientes, marque haute %s.",
+            len(self._vistas),
+            len(self._pendientes),
+            self._marca_alta,
+        )
+        return True
+
+    def _guardar(self) -> None:
+        """Écrit le checkpoint de façon atomique (fichier temporaire + rename)."""
+        if not self.ruta:
+            return
+        datos = {
+            "vistas": self._vistas,
+            "pendientes": sorted(self._pendientes),
+            "marca_alta": self._marca_alta.isoformat() if self._marca_alta else None,
+        }
+        tmp = f"{self.ruta}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(datos, f)
+            os.replace(tmp, self.ruta)
+        except OSError as e:
+            logger.error("Erreur écriture checkpoint buzón: %s", e)
+
+    # ── Synchronisation ────────────────────────────────────────────────────────
+
+    def _limite(self) -> datetime | None:
+        return self._marca_alta - self.retencion if self._marca_alta else None
+
+    def _es_vieja(self, carta: dict) -> bool:
+        limite = self._limite()
+        fecha = _parsear_fecha(carta.get("fecha"))
+        return limite is not None and fecha is not None and fecha < limite
+
+    def _ver(self, cid: str, carta: dict) -> None:
+        fecha = _parsear_fecha(carta.get("fecha"))
+        if fecha and (self._marca_alta is None or fecha > self._marca_alta):
+            self._marca_alta = fecha
+        self._vistas[cid] = carta.get("fecha") or (
+            self._marca_alta.isoformat() if self._marca_alta else ""
+        )
+
+    def _expulsar(self) -> None:
+        """Oublie les cartas plus anciennes que la fenêtre de rétention."""
+        limite = self._limite()
+        if limite is None:
+            return
+        viejas = [
+            cid
+            for cid, fecha in self._vistas.items()
+            if (f := _parsear_fecha(fecha)) is not None and f < limite
+        ]
+        for cid in viejas:
+            del self._vistas[cid]
+
+    def inicializar(self, buzon: dict) -> int:
+        """Premier contact avec Butler : sans checkpoint, ignore le buzón existant.
+
+        Avec un checkpoint repris, ne fait rien : les cartas arrivées pendant
+        l'arrêt seront détectées par le prochain appel à detectar().
+
+        Returns:
+            Nombre de cartas marquées comme vues (ignorées).
+        """
+        with self._lock:
+            if self.reanudado:
+                return 0
+            for cid, carta in buzon.items():
+                self._ver(cid, carta)
+            self._expulsar()
+            self._guardar()
+            return len(buzon)
+
+    def detectar(self, buzon: dict) -> dict[str, dict]:
+        """Retourne les cartas à traiter : nouvelles + pendientes non terminées.
+
+        Les cartas retournées sont marquées vues ET pendientes (checkpoint
+        écrit) jusqu'à l'appel de completar().
+
+        Args:
+            buzon: Le buzón complet renvoyé par /info, {id: carta}.
+
+        Returns:
+            {id: carta} à traiter, dans l'ordre du buzón.
+        """
+        with self._lock:
+            self._pendientes &= buzon.keys()  # cartas disparues : plus rien à faire
+            nuevas = {
+                cid: carta
+                for cid, carta in buzon.items()
+                if cid in self._pendientes
+                or (cid not in self._vistas and not self._es_vieja(carta))
+            }
+            if not nuevas:
+                return {}
+            for cid, carta in nuevas.items():
+                self._ver(cid, carta)
+                self._pendientes.add(cid)
+            self._expulsar()
+            self._guardar()
+            return nuevas
+
+    def completar(self, cid: str) -> None:
+        """Marque une carta comme entièrement traitée."""
+        with self._lock:
+            self._pendientes.discard(cid)
+            self._guardar()
+
+    def estadisticas(self) -> dict:
+        """Taille du seen-set, nombre de pendientes et marque haute."""
+        with self._lock:
+            return {
+                "vistas": len(self._vistas),
+                "pendientes": len(self._pendientes),
+                "marca_alta": self._marca_alta.isoformat()
+                if self._marca_alta
+                else None,
+            }
@@ -14,16 +14,90 @@ BUTLER_BASE_URL: str = os.environ.get(
     "FDI_PLN__BUTLER_ADDRESS", "http://127.0.0.1:7719"
 )
 AGENTE_SLOT: str = "lobo_leal"  # Identifiant de slot pour le mode monopuesto
+AGENTE_SLOTS: list[str] = [
+    s.strip()
+    for s in os.environ.get("FDI_PLN__SLOTS", AGENTE_SLOT).split(",")
+    if s.strip()
+]  # Slots hébergés par le processus (le premier sert les routes sans /slots/{slot})
+BUTLER_POOL_SIZE: int = 16  # Connexions keep-alive gardées ouvertes vers Butler
+BUTLER_CONNECT_TIMEOUT: float = 3.0  # Établissement de la connexion TCP
+BUTLER_READ_TIMEOUT: float = 10.0  # Attente de la réponse de Butler
+BUTLER_GENTE_TTL: float = 60.0  # Durée de vie (s) de la liste des agents (/gente)
+BUTLER_INFO_VENTANA: float = 0.5  # Fenêtre (s) où une lecture de /info est partagée
+BROADCAST_MAX_WORKERS: int = 8  # Envois de cartas simultanés (1 = séquentiel)
+BROADCAST_MODO: str = "menu"  # "menu" (1 carta/agent) ou "detallado" (1 carta/offre)
+MENUS_HISTORIAL: int = 5  # Menus d'offres dont les références « #v-n » restent valides
+OFERTAS_POR_LOTE: bool = (
+    True  # Offres couvrant tout le FALTAN d'une ressource en un échange
+)
+CADENAS_MAX_PARTICIPANTES: int = (
+    4  # Autres agents d'une chaîne d'échanges (0 : désactivé)
+)
+CADENAS_HISTORIAL: int = (
+    50  # Chaînes proposées dont les acceptations restent résolubles
+)
+MERCADO_TTL: int = (
+    600  # Fraîcheur (s) d'une annonce dans le carnet d'ordres (mercado.py)
+)
+
+# — Persistance du buzón ———————————————————————————————————————————————————————
+BUZON_CHECKPOINT: str = os.environ.get(
+    "FDI_PLN__BUZON_CHECKPOINT", "buzon_{slot}.json"
+)  # Gabarit : {slot} est remplacé par l'identifiant du slot
+BUZON_RETENCION: int = 6 * 3600  # Âge (s) au-delà duquel une carta vue est oubliée
+
+# — Mémoire des négociations (SQLite) ——————————————————————————————————————————
+NEGOCIACIONES_DB: str = os.environ.get(
+    "FDI_PLN__NEGOCIACIONES_DB", "negociaciones_{slot}.db"
+)  # Gabarit : {slot} est remplacé par l'identifiant du slot
+NEGOCIACIONES_TTL: int = 3600  # Offre sans nouvelle (s) considérée caduque
 
 # — Modèle LLM local (Ollama) ——————————————————————————————————————————————————
-OLLAMA_URL: str = "http://127.0.0.1:11434/api/generate"
+OLLAMA_URL: str = "http://127.0.0.1:11434/api/chat"
 MODEL: str = "qwen2.5-coder:3b"
+OLLAMA_STREAM: bool = True  # Streaming + arrêt dès que le JSON de décision est complet
+OLLAMA_MAX_TOKENS: int = 256  # Plafond de tokens générés (num_predict)
+OLLAMA_STOP: list[str] = []  # Séquences d'arrêt supplémentaires passées à Ollama
+OLLAMA_KEEP_ALIVE: str = "30m"  # Garde le modèle et le cache KV du préfixe en mémoire
+OLLAMA_FORMATO: bool = True  # Génération contrainte par le schéma JSON des décisions
+LLM_REPARACIONES: int = (
+    1  # Relances (avec l'erreur) quand la décision du LLM est invalide
+)
+CARTAS_MAX_WORKERS: int = 4  # Cartas (expéditeurs distincts) décidées en parallèle
+LLM_AGRUPAR: bool = (
+    True  # Un seul appel LLM pour les cartas d'un expéditeur dans un lot
+)
+LLM_CONCURRENCIA: int = 4  # Requêtes Ollama simultanées, tous slots confondus
+LLM_PLAZOS: dict[str, float | None] = {
+    "confirmacion": None,
+    "propuesta": 60,
+    "general": 20,
+    "sistema": 5,
+}  # Attente max (s) dans la file LLM par type de carta (None : jamais abandonnée)
+INTENCIONES_MODELO: str = os.environ.get(
+    "FDI_PLN__INTENCIONES_MODELO",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "intenciones_modelo.json"),
+)  # Classifieur d'intention (entrenar_intenciones.py) ; absent : mots-clés
+INTENCIONES_CONFIANZA_MIN: float = 0.8  # En dessous, le LLM voit les types plausibles
+LLM_CACHE_SIZE: int = 256  # Décisions LLM gardées en cache (LRU)
+LLM_CACHE_TTL: int = 600  # Durée de vie d'une décision en cache (s)
+LLM_GRABACION: str | None = os.environ.get(
+    "FDI_PLN__LLM_GRABACION"
+)  # JSONL des décisions LLM (état, carta, décision, latence) rejouables par replay.py
 
 # — Intervalles de temps (en secondes) ————————————————————————————————————————
-POLL_INTERVAL: int = 10  # Entre chaque vérification du buzón
+POLL_INTERVAL_MIN: float = 2  # Intervalle de polling après une activité
+POLL_INTERVAL_MAX: float = 30  # Intervalle maximal quand le buzón reste calme
+POLL_BACKOFF: float = 1.5  # Facteur d'allongement de l'intervalle par poll vide
 BROADCAST_INTERVAL: int = 300  # Entre chaque broadcast périodique (5 min)
 ACCEPT_COOLDOWN: int = 60  # Attente avant d'accepter après un broadcast 1:1
 
+# — Observabilité ——————————————————————————————————————————————————————————————
+LOG_JSON: bool = os.environ.get("FDI_PLN__LOG_JSON", "") == "1"  # Logs en JSON
+TRAZAS_HISTORIAL: int = 50  # Traces terminées gardées pour GET /trazas
+TRAZAS_MAX_SPANS: int = 500  # Spans gardés par trace (au-delà : comptés, pas gardés)
+PERFIL_MAX_SEGUNDOS: float = 60  # Durée maximale d'un profilage /admin/perfil
+
 
 class ButlerState(BaseModel):
     """État complet de l'agent, retourné par l'endpoint /info de Butler."""
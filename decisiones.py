@@ -0,0 +1,125 @@
+"""
+decisiones.py — Modèle typé des décisions (esperar / ofrecer / aceptar).
+
+Une décision, qu'elle vienne du moteur de règles, du cache ou du LLM, est
+validée ici avant d'être exécutée par agent.ejecutar_decision : champs
+obligatoires présents, quantités entières et positives, destinataire non
+vide. Les schémas JSON dérivés de ces modèles sont passés à Ollama (option
+`format`) pour contraindre la génération à une décision bien formée.
+"""
+
+from typing import Annotated, Literal
+
+from pydantic import (
+    BaseModel,
+    Field,
+    NonNegativeInt,
+    PositiveInt,
+    TypeAdapter,
+    ValidationError,
+)
+
+
+class Esperar(BaseModel):
+    """Ne rien faire (le motif explique un repli : json_invalido, plazo_vencido...)."""
+
+    accion: Literal["esperar"]
+    motivo: str | None = None
+
+
+class Ofrecer(BaseModel):
+    """Envoyer une carta de négociation au destinataire ; `envio`/`recibir`
+    sont les termes proposés, quand ils sont connus (négociations.py)."""
+
+    accion: Literal["ofrecer", "pedir"]
+    dest: str = Field(min_length=1)
+    asunto: str = "Propuesta de intercambio"
+    cuerpo: str = Field(min_length=1)
+    envio: dict[str, PositiveInt] = {}
+    recibir: dict[str, PositiveInt] = {}
+
+
+class Aceptar(BaseModel):
+    """Envoyer `envio` (un paquete) et une carta de confirmation ; `recibir`
+    est ce que l'on attend en retour."""
+
+    accion: Literal["aceptar"]
+    dest: str = Field(min_length=1)
+    envio: dict[str, PositiveInt] = Field(min_length=1)
+    recibir: dict[str, NonNegativeInt] = {}
+
+
+Decision = Annotated[Esperar | Ofrecer | Aceptar, Field(discriminator="accion")]
+
+
+class ListaDecisiones(BaseModel):
+    """Réponse du LLM pour une conversation (plusieurs cartas d'un expéditeur)."""
+
+    decisiones: list[Decision] = Field(min_length=1)
+
+
+_adaptador = TypeAdapter(Decision)
+
+
+def _esquema(modelo: type[BaseModel]) -> dict:
+    """Schéma JSON d'un modèle, sans titres ni descriptions (docstrings)."""
+    esquema = modelo.model_json_schema()
+    esquema.pop("title", None)
+    esquema.pop("description", None)
+    for propiedad in esquema["properties"].values():
+        propiedad.pop("title", None)
+    return esquema
+
+
+# Schémas passés à Ollama (`format`) : une décision, ou {"decisiones": [...]}
+ESQUEMA_DECISION: dict = {"anyOf": [_esquema(m) for m in (Esperar, Ofrecer, Aceptar)]}
+ESQUEMA_DECISIONES: dict = {
+    "type": "object",
+    "properties": {
+        "decisiones": {"type": "array", "items": ESQUEMA_DECISION, "minItems": 1}
+    },
+    "required": ["decisiones"],
+}
+
+
+def validar(objeto: dict) -> Esperar | Ofrecer | Aceptar:
+    """Valide un objet JSON en décision typée.
+
+    Raises:
+        ValidationError: Action inconnue, champ manquant ou quantité invalide.
+    """
+    return _adaptador.validate_python(objeto)
+
+
+def validar_lista(
+    objeto: dict, maximo: int | None = None
+) -> list[Esperar | Ofrecer | Aceptar]:
+    """Valide une réponse {"decisiones": [...]} ; une décision isolée est
+    acceptée comme liste d'un élément. Les doublons sont retirés et la liste
+    est bornée à `maximo` (si fourni).
+
+    Raises:
+        ValidationError: Si la liste ou l'une de ses décisions est invalide.
+    """
+    if "decisiones" in objeto:
+        lista = ListaDecisiones.model_validate(objeto).decisiones
+    else:
+        lista = [validar(objeto)]
+    unicas = []
+    for decision in lista:
+        if decision not in unicas:
+            unicas.append(decision)
+    return unicas[:maximo]
+
+
+def como_dict(decision: Esperar | Ofrecer | Aceptar) -> dict:
+    """Forme JSON d'une décision (cache, enregistrement, journaux)."""
+    return decision.model_dump(exclude_none=True)
+
+
+def resumir_errores(error: ValidationError, maximo: int = 3) -> str:
+    """Résumé court des erreurs de validation, renvoyé au LLM pour correction."""
+    return "; ".join(
+        f"{'.'.join(str(p) for p in e['loc']) or 'raíz'}: {e['msg']}"
+        for e in error.errors()[:maximo]
+    )
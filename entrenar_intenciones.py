@@ -0,0 +1,281 @@
+"""
+entrenar_intenciones.py — Entraînement et évaluation du classifieur d'intention.
+
+Construit le corpus étiqueté, calibre la température du classifieur
+n-grammes (intenciones.py) par validation croisée, le mesure face aux
+mots-clés de llm.clasificar_por_palabras, puis l'entraîne sur tout le corpus
+et l'écrit en JSON. Les notifications système (reconnues à leur remi) sont
+exclues du corpus.
+
+Sources acceptées :
+- les JSONL étiquetés {"remi", "asunto", "cuerpo", "tipo", "origen"}
+  (logs/intenciones.jsonl) ;
+- les sources de replay.py (logs texte de logs/, JSONL de
+  llm.grabar_decision) : leurs cartas sont étiquetées quand le moteur de
+  règles reconnaît un gabarit (reglas.parsear_carta), ignorées sinon.
+Une carta présente dans plusieurs sources garde la première étiquette lue.
+
+Le rapport donne, par validation croisée en k plis :
+- l'exactitude des deux classifieurs, globale et sur les cartas réelles
+  (origen « logs ») ;
+- le rappel par type ;
+- la part des cartas sous le seuil de confiance et l'exactitude au-dessus ;
+- le débit (µs par carta) sur un buzón entier.
+
+Usage :
+    python entrenar_intenciones.py logs/intenciones.jsonl logs/*.log
+    python entrenar_intenciones.py logs/intenciones.jsonl grabacion.jsonl --pliegues 10
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import time
+from collections import Counter
+
+import llm
+import reglas
+import replay
+from config import INTENCIONES_CONFIANZA_MIN, INTENCIONES_MODELO
+from intenciones import ClasificadorIntencion
+
+logger = logging.getLogger(__name__)
+
+# Températures essayées pour calibrer la confiance (log-loss en validation croisée)
+TEMPERATURAS = (1, 2, 3, 5, 8, 13, 20)
+
+
+# ── Corpus ─────────────────────────────────────────────────────────────────────
+
+
+def etiquetar(carta: dict) -> str | None:
+    """Étiquette d'une carta reconnue par le moteur de règles, sinon None."""
+    terminos = reglas.parsear_carta(carta)
+    if terminos is None or terminos["tipo"] == "cadena":
+        return None
+    return terminos["tipo"]
+
+
+def _es_etiquetado(ruta: str) -> bool:
+    """Vrai si `ruta` est un JSONL étiqueté (sa première ligne porte un tipo)."""
+    if not ruta.endswith(".jsonl"):
+        return False
+    with open(ruta, encoding="utf-8") as f:
+        primera = f.readline().strip()
+    return bool(primera) and "tipo" in json.loads(primera)
+
+
+def cargar_corpus(rutas: list[str]) -> list[dict]:
+    """Exemples {"carta", "tipo", "origen"} des sources, sans doublons ni
+    notifications système."""
+    ejemplos, vistas = [], set()
+
+    def _agregar(carta: dict, tipo: str | None, origen: str) -> None:
+        clave = (carta.get("asunto") or "", carta.get("cuerpo") or "")
+        if tipo in (None, "sistema") or clave in vistas:
+            return
+        vistas.add(clave)
+        ejemplos.append({"carta": carta, "tipo": tipo, "origen": origen})
+
+    sin_etiqueta = []
+    for ruta in rutas:
+        if not _es_etiquetado(ruta):
+            sin_etiqueta.append(ruta)
+            continue
+        with open(ruta, encoding="utf-8") as f:
+            for linea in f:
+                if linea.strip():
+                    fila = json.loads(linea)
+                    carta = {k: fila.get(k, "") for k in ("remi", "asunto", "cuerpo")}
+                    _agregar(carta, fila["tipo"], fila.get("origen", ruta))
+    for caso in replay.cargar_casos(sin_etiqueta) if sin_etiqueta else []:
+        _agregar(caso["carta"], etiquetar(caso["carta"]), "reglas")
+    return ejemplos
+
+
+# ── Évaluation ─────────────────────────────────────────────────────────────────
+
+
+def _pliegues(ejemplos: list[dict], k: int, semilla: int) -> list[list[int]]:
+    """Indices répartis en k plis, stratifiés par type."""
+    pliegues: list[list[int]] = [[] for _ in range(k)]
+    por_tipo: dict[str, list[int]] = {}
+    for i, ejemplo in enumerate(ejemplos):
+        por_tipo.setdefault(ejemplo["tipo"], []).append(i)
+    rng = random.Random(semilla)
+    n = 0
+    for tipo in sorted(por_tipo):
+        indices = por_tipo[tipo]
+        rng.shuffle(indices)
+        for i in indices:
+            pliegues[n % k].append(i)
+            n += 1
+    return pliegues
+
+
+def validacion_cruzada(
+    ejemplos: list[dict], k: int = 5, semilla: int = 0
+) -> dict[float, list[dict[str, float]]]:
+    """Probabilités de chaque exemple, par un modèle entraîné sans son pli,
+    pour chacune des TEMPERATURAS."""
+    probabilidades: dict[float, list] = {
+        t: [None] * len(ejemplos) for t in TEMPERATURAS
+    }
+    for pliegue in _pliegues(ejemplos, k, semilla):
+        excluidos = set(pliegue)
+        modelo = ClasificadorIntencion.entrenar(
+            [
+                (e["carta"], e["tipo"])
+                for i, e in enumerate(ejemplos)
+                if i not in excluidos
+            ]
+        )
+        for temperatura in TEMPERATURAS:
+            modelo.temperatura = temperatura
+            for i in pliegue:
+                probabilidades[temperatura][i] = modelo.probabilidades(
+                    ejemplos[i]["carta"]
+                )
+    return probabilidades
+
+
+def calibrar_temperatura(
+    ejemplos: list[dict], probabilidades: dict[float, list[dict[str, float]]]
+) -> float:
+    """Température qui minimise la log-loss des prédictions croisées."""
+
+    def _log_loss(temperatura: float) -> float:
+        return -sum(
+            math.log(max(p.get(e["tipo"], 0.0), 1e-12))
+            for e, p in zip(ejemplos, probabilidades[temperatura])
+        )
+
+    return min(TEMPERATURAS, key=_log_loss)
+
+
+def _exactitud(aciertos: list[bool]) -> str:
+    if not aciertos:
+        return "-"
+    return f"{sum(aciertos) / len(aciertos):.1%} ({sum(aciertos)}/{len(aciertos)})"
+
+
+def _microsegundos(clasificar, cartas: list[dict], repeticiones: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        clasificar(cartas)
+    return (time.perf_counter() - inicio) / (repeticiones * len(cartas)) * 1e6
+
+
+def evaluar(
+    ejemplos: list[dict], k: int, semilla: int, umbral: float
+) -> tuple[dict, float]:
+    """Compare le classifieur n-grammes (validation croisée) aux mots-clés ;
+    retourne le rapport et la température calibrée."""
+    probabilidades = validacion_cruzada(ejemplos, k, semilla)
+    temperatura = calibrar_temperatura(ejemplos, probabilidades)
+    predicciones = [
+        max(p.items(), key=lambda tc: tc[1]) for p in probabilidades[temperatura]
+    ]
+    palabras = [llm.clasificar_por_palabras(e["carta"]) for e in ejemplos]
+    reales = [i for i, e in enumerate(ejemplos) if e["origen"] == "logs"]
+    confiadas = [i for i, (_, c) in enumerate(predicciones) if c >= umbral]
+
+    def _aciertos(indices, tipos):
+        return [tipos[i] == ejemplos[i]["tipo"] for i in indices]
+
+    todos = range(len(ejemplos))
+    ngramas = [t for t, _ in predicciones]
+    recall = {
+        tipo: (
+            _exactitud(
+                _aciertos([i for i in todos if ejemplos[i]["tipo"] == tipo], ngramas)
+            ),
+            _exactitud(
+                _aciertos([i for i in todos if ejemplos[i]["tipo"] == tipo], palabras)
+            ),
+        )
+        for tipo in sorted({e["tipo"] for e in ejemplos})
+    }
+
+    cartas = [e["carta"] for e in ejemplos]
+    modelo = ClasificadorIntencion.entrenar(
+        [(e["carta"], e["tipo"]) for e in ejemplos], temperatura=temperatura
+    )
+    repeticiones = max(1, 20000 // len(cartas))
+    return {
+        "ejemplos": len(ejemplos),
+        "temperatura": temperatura,
+        "por_origen": dict(Counter(e["origen"] for e in ejemplos)),
+        "exactitud_ngramas": _exactitud(_aciertos(todos, ngramas)),
+        "exactitud_palabras": _exactitud(_aciertos(todos, palabras)),
+        "exactitud_ngramas_logs": _exactitud(_aciertos(reales, ngramas)),
+        "exactitud_palabras_logs": _exactitud(_aciertos(reales, palabras)),
+        "recall_ngramas_palabras": recall,
+        "inciertas": f"{1 - len(confiadas) / len(ejemplos):.1%}",
+        "exactitud_ngramas_confiadas": _exactitud(_aciertos(confiadas, ngramas)),
+        "us_por_carta_ngramas": round(
+            _microsegundos(modelo.clasificar_lote, cartas, repeticiones), 2
+        ),
+        "us_por_carta_palabras": round(
+            _microsegundos(
+                lambda cs: [llm.clasificar_por_palabras(c) for c in cs],
+                cartas,
+                repeticiones,
+            ),
+            2,
+        ),
+        "errores_ngramas": [
+            {
+                "asunto": ejemplos[i]["carta"].get("asunto"),
+                "tipo": ejemplos[i]["tipo"],
+                "prediccion": ngramas[i],
+                "confianza": round(predicciones[i][1], 3),
+            }
+            for i in todos
+            if ngramas[i] != ejemplos[i]["tipo"]
+        ],
+    }, temperatura
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Entraîne et évalue le classifieur d'intention des cartas."
+    )
+    parser.add_argument(
+        "fuentes", nargs="+", help="JSONL étiquetés, logs texte ou JSONL de grabar"
+    )
+    parser.add_argument("--pliegues", type=int, default=5, help="Plis de validation")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument(
+        "--umbral",
+        type=float,
+        default=INTENCIONES_CONFIANZA_MIN,
+        help="Seuil de confiance rapporté",
+    )
+    parser.add_argument(
+        "--salida", default=INTENCIONES_MODELO, help="Fichier du modèle entraîné"
+    )
+    parser.add_argument(
+        "--sin-guardar", action="store_true", help="Évaluer sans écrire le modèle"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    ejemplos = cargar_corpus(args.fuentes)
+    informe, temperatura = evaluar(ejemplos, args.pliegues, args.semilla, args.umbral)
+    print(json.dumps(informe, indent=2, ensure_ascii=False))
+    if not args.sin_guardar:
+        modelo = ClasificadorIntencion.entrenar(
+            [(e["carta"], e["tipo"]) for e in ejemplos], temperatura=temperatura
+        )
+        modelo.guardar(args.salida)
+        print(
+            f"Modèle écrit dans {args.salida} "
+            f"({len(modelo.log_verosimilitud)} caractéristiques)."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+intenciones.py — Classifieur d'intention des cartas (n-grammes, Bayes naïf).
+
+Remplace le balayage de mots-clés de llm.clasificar_por_palabras, dont les
+listes se recouvrent (« intercambio » est à la fois une confirmation et une
+proposition ; « 'acepto el trato' » cité dans une proposition en fait une
+confirmation). Le modèle est un Bayes naïf multinomial sur les mots et
+bigrammes de l'asunto et du cuerpo (présence), en pur Python : il est
+entraîné hors ligne par entrenar_intenciones.py et chargé depuis un fichier
+JSON. Les notifications système ne passent pas par le modèle : llm.py les
+reconnaît à leur remi.
+
+La confiance renvoyée est la probabilité a posteriori du type retenu,
+adoucie par une température calibrée à l'entraînement (un Bayes naïf brut
+est sûr de lui même quand il se trompe) ; en dessous de INTENCIONES_CONFIANZA_MIN, llm.py présente au LLM les contextes
+des types plausibles au lieu d'imposer un type peut-être faux.
+"""
+
+import itertools
+import json
+import logging
+import math
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+TIPOS = ("sistema", "confirmacion", "propuesta", "general")
+
+_CITA = re.compile(r"'[^']*'|\"[^\"]*\"|«[^»]*»")
+_TOKEN = re.compile(r"<cita>|[a-zñ]+|\d+|[{#?>]")
+
+
+def _normalizar(texto: str) -> str:
+    """Minuscules et suppression des accents (« Envié » → « envie »)."""
+    if texto.isascii():
+        return texto.lower()
+    sin_acentos = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in sin_acentos if not unicodedata.combining(c)).lower()
+
+
+def _tokens(texto: str) -> list[str]:
+    """Mots normalisés ; nombres → « 0 », texte cité → « <cita> » (une
+    proposition qui cite « 'acepto el trato' » n'est pas une acceptation)."""
+    texto = _CITA.sub(" <cita> ", _normalizar(texto))
+    return ["0" if t.isdigit() else t for t in _TOKEN.findall(texto)]
+
+
+def caracteristicas(carta: dict) -> set[str]:
+    """Mots et bigrammes de l'asunto (préfixés « a: ») et du cuerpo."""
+    asunto = _tokens(carta.get("asunto") or "")
+    cuerpo = _tokens(carta.get("cuerpo") or "")
+    rasgos = {f"a:{t}" for t in asunto}
+    rasgos.update(f"a:{a}_{b}" for a, b in itertools.pairwise(asunto))
+    rasgos.update(cuerpo)
+    rasgos.update(f"{a}_{b}" for a, b in itertools.pairwise(cuerpo))
+    return rasgos
+
+
+class ClasificadorIntencion:
+    """Bayes naïf multinomial : log-probabilités a priori par type et
+    log-vraisemblances par caractéristique (une par type, dans l'ordre de
+    `tipos`). Les caractéristiques inconnues du modèle sont ignorées ; les
+    scores sont divisés par `temperatura` avant normalisation.
+    """
+
+    def __init__(
+        self,
+        tipos: tuple[str, ...],
+        log_prior: list[float],
+        log_verosimilitud: dict[str, list[float]],
+        temperatura: float = 1.0,
+    ) -> None:
+        self.tipos = tuple(tipos)
+        self.log_prior = log_prior
+        self.log_verosimilitud = log_verosimilitud
+        self.temperatura = temperatura
+
+    @classmethod
+    def entrenar(
+        cls,
+        ejemplos: list[tuple[dict, str]],
+        alfa: float = 0.5,
+        temperatura: float = 1.0,
+    ) -> "ClasificadorIntencion":
+        """Estime le modèle sur des paires (carta, tipo), lissage de Laplace `alfa`.
+
+        Raises:
+            ValueError: Si aucun exemple n'est fourni ou si un tipo est inconnu.
+        """
+        if not ejemplos:
+            raise ValueError("Aucun exemple d'entraînement.")
+        presentes = {tipo for _, tipo in ejemplos}
+        if presentes - set(TIPOS):
+            raise ValueError(f"Tipos inconnus : {sorted(presentes - set(TIPOS))}")
+        tipos = tuple(t for t in TIPOS if t in presentes)
+        indice = {t: i for i, t in enumerate(tipos)}
+        documentos = [0] * len(tipos)
+        conteos: dict[str, list[int]] = {}
+        for carta, tipo in ejemplos:
+            i = indice[tipo]
+            documentos[i] += 1
+            for rasgo in caracteristicas(carta):
+                conteos.setdefault(rasgo, [0] * len(tipos))[i] += 1
+        totales = [sum(c[i] for c in conteos.values()) for i in range(len(tipos))]
+        denominadores = [t + alfa * len(conteos) for t in totales]
+        log_prior = [math.log(d / len(ejemplos)) for d in documentos]
+        log_verosimilitud = {
+            rasgo: [
+                round(math.log((c[i] + alfa) / denominadores[i]), 4)
+                for i in range(len(tipos))
+            ]
+            for rasgo, c in conteos.items()
+        }
+        return cls(tipos, log_prior, log_verosimilitud, temperatura)
+
+    def probabilidades(self, carta: dict) -> dict[str, float]:
+        """Probabilités a posteriori de chaque type pour la carta."""
+        obtener = self.log_verosimilitud.get
+        filas = [f for f in map(obtener, caracteristicas(carta)) if f is not None]
+        puntuaciones = [sum(columna) for columna in zip(self.log_prior, *filas)]
+        maximo = max(puntuaciones)
+        exp = [math.exp((p - maximo) / self.temperatura) for p in puntuaciones]
+        total = sum(exp)
+        return {tipo: e / total for tipo, e in zip(self.tipos, exp)}
+
+    def clasificar(self, carta: dict) -> tuple[str, float]:
+        """Type le plus probable et sa probabilité (confiance)."""
+        probabilidades = self.probabilidades(carta)
+        tipo = max(probabilidades, key=probabilidades.get)
+        return tipo, probabilidades[tipo]
+
+    def clasificar_lote(self, cartas: list[dict]) -> list[tuple[str, float]]:
+        """Classe un lot de cartas (un buzón), dans l'ordre."""
+        return [self.clasificar(carta) for carta in cartas]
+
+    def guardar(self, ruta: str) -> None:
+        """Écrit le modèle en JSON."""
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "tipos": self.tipos,
+                    "log_prior": self.log_prior,
+                    "log_verosimilitud": self.log_verosimilitud,
+                    "temperatura": self.temperatura,
+                },
+                f,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "ClasificadorIntencion":
+        """Lit un modèle écrit par guardar.
+
+        Raises:
+            OSError: Fichier illisible.
+            ValueError: Contenu invalide.
+        """
+        with open(ruta, encoding="utf-8") as f:
+            datos = json.load(f)
+        try:
+            return cls(
+                tuple(datos["tipos"]),
+                datos["log_prior"],
+                datos["log_verosimilitud"],
+                datos.get("temperatura", 1.0),
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Modèle d'intention invalide : {e}") from e
+
+
+def cargar_modelo(ruta: str | None) -> ClasificadorIntencion | None:
+    """Charge le modèle de `ruta`, ou None (repli sur les mots-clés) s'il est
+    absent ou illisible."""
+    if not ruta:
+        return None
+    try:
+        modelo = ClasificadorIntencion.cargar(ruta)
+    except FileNotFoundError:
+        logger.warning("Modèle d'intention %s absent : mots-clés.", ruta)
+        return None
+    except (OSError, ValueError) as e:
+        logger.error("Modèle d'intention %s illisible (%s) : mots-clés.", ruta, e)
+        return None
+    logger.info(
+        "Modèle d'intention chargé : %d caractéristiques.",
+        len(modelo.log_verosimilitud),
+    )
+    return modelo
@@ -4,16 +4,60 @@ llm.py — Couche IA moderne : prompt engineering et interface Ollama.
 Ce module construit les prompts envoyés au LLM et parse ses réponses JSON.
 Il adapte le prompt au type de carta détecté et à l'état courant de l'agent,
 afin de tirer le meilleur parti des capacités (et limites) du modèle utilisé.
+
+Les appels à Ollama sont asynchrones (httpx) : l'agent passe son propre
+httpx.AsyncClient pour garder la connexion ouverte d'une carta à l'autre.
+Dans un processus qui héberge plusieurs slots, toutes les requêtes passent
+par une ColaLLM unique, qui borne le nombre de générations simultanées
+pour l'ensemble des slots (un seul Ollama les sert toutes), sert les
+confirmations avant les propositions et les annonces générales, et
+abandonne les requêtes qui ont attendu au-delà de leur échéance.
+
+La réponse d'Ollama est contrainte par le schéma JSON des décisions
+(option `format`) puis validée en modèle typé (decisiones.py) ; une
+réponse invalide est renvoyée une fois au modèle avec l'erreur avant de
+se replier sur « esperar ».
 """
 
+import asyncio
+import contextvars
+import functools
+import itertools
 import json
 import logging
 import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 
-import requests
+import httpx
+from pydantic import ValidationError
 
-from config import OLLAMA_URL, MODEL, ButlerState
+import decisiones
+import intenciones
+import metricas
+import trazas
 from agent import calcular_faltan_sobran
+from config import (
+    INTENCIONES_CONFIANZA_MIN,
+    INTENCIONES_MODELO,
+    LLM_CACHE_SIZE,
+    LLM_CACHE_TTL,
+    LLM_CONCURRENCIA,
+    LLM_GRABACION,
+    LLM_PLAZOS,
+    LLM_REPARACIONES,
+    MODEL,
+    OLLAMA_FORMATO,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_MAX_TOKENS,
+    OLLAMA_STOP,
+    OLLAMA_STREAM,
+    OLLAMA_URL,
+    ButlerState,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -65,8 +109,10 @@ _CONTEXTO_POR_TIPO: dict[str, str] = {
 }
 
 
-def _clasificar_carta(carta: dict) -> str:
-    """Classifie une carta pour sélectionner la stratégie de prompt adaptée.
+def clasificar_por_palabras(carta: dict) -> str:
+    """Classification par mots-clés, repli quand le modèle d'intention
+    (intenciones.py) n'est pas disponible, et référence de
+    entrenar_intenciones.py.
 
     Args:
         carta: La carta reçue avec ses champs remi, asunto, cuerpo.
@@ -86,31 +132,105 @@ def _clasificar_carta(carta: dict) -> str:
     return "general"
 
 
-# ── Construction du prompt ─────────────────────────────────────────────────────
+_modelo_intencion = intenciones.cargar_modelo(INTENCIONES_MODELO)
 
 
-def construir_prompt_nueva_carta(
-    estado: ButlerState,
-    carta: dict,
-    en_cooldown: bool = False,
-) -> str:
-    """Construit le prompt LLM adapté à l'état actuel et au type de carta.
+@functools.lru_cache(maxsize=1024)
+def _probabilidades(remi: str, asunto: str, cuerpo: str) -> tuple:
+    """Types possibles et leur probabilité, du plus au moins probable.
 
-    Pré-calcule FALTAN/SOBRAN pour réduire la charge cognitive du LLM.
-    Adapte les instructions selon le type de carta détecté (sistema, confirmacion,
-    propuesta, general) et inclut un avertissement cooldown si nécessaire.
+    Mémoïsé : une même carta est classée à chaque étape (tri du lot,
+    clé de cache, prompt, file LLM).
+    """
+    carta = {"remi": remi, "asunto": asunto, "cuerpo": cuerpo}
+    if remi.lower() == "sistema" or _modelo_intencion is None:
+        return ((clasificar_por_palabras(carta), 1.0),)
+    probabilidades = _modelo_intencion.probabilidades(carta)
+    return tuple(sorted(probabilidades.items(), key=lambda p: -p[1]))
+
+
+def clasificar_intencion(carta: dict) -> tuple[str, float]:
+    """Type de la carta et confiance (probabilité a posteriori, 1.0 pour
+    les notifications système et la classification par mots-clés)."""
+    return _probabilidades(
+        carta.get("remi") or "", carta.get("asunto") or "", carta.get("cuerpo") or ""
+    )[0]
+
+
+def clasificar_carta(carta: dict) -> str:
+    """Classifie une carta pour sélectionner la stratégie de prompt adaptée.
 
     Args:
-        estado:      État actuel de l'agent.
-        carta:       La carta reçue à traiter.
-        en_cooldown: Si True, le LLM doit éviter d'accepter immédiatement.
+        carta: La carta reçue avec ses champs remi, asunto, cuerpo.
 
     Returns:
-        Prompt complet prêt à envoyer à Ollama.
+        Type de carta : 'sistema', 'confirmacion', 'propuesta', ou 'general'.
     """
+    return clasificar_intencion(carta)[0]
+
+
+def carta_incierta(carta: dict) -> bool:
+    """Vrai si la confiance du classifieur est sous INTENCIONES_CONFIANZA_MIN."""
+    return clasificar_intencion(carta)[1] < INTENCIONES_CONFIANZA_MIN
+
+
+def tipos_plausibles(carta: dict) -> list[str]:
+    """Le type de la carta, ou ses deux types les plus probables quand la
+    classification est incertaine (le LLM tranche avec les deux contextes)."""
+    probables = _probabilidades(
+        carta.get("remi") or "", carta.get("asunto") or "", carta.get("cuerpo") or ""
+    )
+    if probables[0][1] >= INTENCIONES_CONFIANZA_MIN:
+        return [probables[0][0]]
+    return [tipo for tipo, _ in probables[:2]]
+
+
+# Ordre de service des cartas (file LLM, lots du polling) : la plus urgente d'abord
+PRIORIDAD_TIPO = {"confirmacion": 0, "propuesta": 1, "general": 2, "sistema": 3}
+
+# Motifs des décisions produites sans le LLM, à ne pas mettre en cache
+_MOTIVOS_SIN_LLM = {"json_invalido", "plazo_vencido"}
+
+
+# ── Construction du prompt ─────────────────────────────────────────────────────
+
+# Préfixe système STATIQUE : identique pour toutes les cartas, il est envoyé
+# en premier message de /api/chat pour qu'Ollama réutilise son état KV d'une
+# carta à l'autre. Tout ce qui dépend de l'état ou de la carta va dans le
+# suffixe dynamique construit par construir_prompt_nueva_carta.
+PROMPT_SISTEMA = """Eres un agente autónomo en un sistema de intercambio de recursos.
+Tu misión: alcanzar tu objetivo consiguiendo los recursos que te faltan mediante negociación.
+En cada mensaje recibirás tu estado actual (Recursos, Objetivo, FALTAN, SOBRAN) y una carta recibida.
+
+## Reglas absolutas
+- Solo puedes dar recursos de SOBRAN
+- Nunca ofrezcas recursos de FALTAN
+- El oro es moneda universal (nadie lo necesita como objetivo)
+- Si se indica MODO ESPERA ACTIVO: NO aceptes todavía; responde con 'ofrecer' si el trato es interesante.
+
+## Reglas de decisión (por orden de prioridad)
+1. Carta de Sistema → esperar
+2. Confirmación de intercambio → aceptar (enviar lo prometido, indicado en la carta)
+3. Oferta de ≥2 oro por recursos de SOBRAN → aceptar
+4. Cualquier trato donde das SOBRAN y recibes algo → aceptar (todo recurso es re-intercambiable)
+5. Remitente menciona tener recursos de FALTAN → ofrecer con propuesta concreta
+6. Solo pide sin ofrecer nada → esperar
+7. NUNCA envíes recursos de FALTAN
+
+## Formato de respuesta (JSON estricto, sin texto adicional)
+"dest" es siempre el remitente de la carta.
+{"accion":"esperar"}
+{"accion":"ofrecer","dest":"<remitente>","asunto":"...","cuerpo":"Te propongo: te doy N de [SOBRAN] a cambio de M de [recurso].","envio":{"[SOBRAN]":N},"recibir":{"[recurso]":M}}
+{"accion":"aceptar","dest":"<remitente>","envio":{"recurso":cantidad},"recibir":{"recurso":cantidad}}
+
+Ejemplo aceptar confirmación: {"accion":"aceptar","dest":"<remitente>","envio":{"arroz":1},"recibir":{"madera":1}}
+
+Devuelve SOLO el JSON."""
+
+
+def _bloque_estado(estado: ButlerState, en_cooldown: bool) -> str:
+    """Section « Estado actual » du prompt (et avertissement de cooldown)."""
     faltan, sobran = calcular_faltan_sobran(estado.Recursos, estado.Objetivo)
-    tipo = _clasificar_carta(carta)
-    remi = carta.get("remi", "?")
 
     aviso_cooldown = (
         (
@@ -124,81 +244,853 @@ def construir_prompt_nueva_carta(
     faltan_str = ", ".join(f"{v} de {k}" for k, v in faltan.items()) or "ninguno"
     sobran_str = ", ".join(f"{v} de {k}" for k, v in sobran.items()) or "ninguno"
 
-    return f"""Eres un agente autónomo llamado "{estado.Alias}" en un sistema de intercambio de recursos.
-Tu misión: alcanzar tu objetivo consiguiendo los recursos que te faltan mediante negociación.
-
-## Estado actual
+    return f"""## Estado actual (eres "{estado.Alias}")
 - Recursos: {json.dumps(estado.Recursos)}
 - Objetivo: {json.dumps(estado.Objetivo)}
 - FALTAN (necesitas conseguir): {faltan_str}
-- SOBRAN (puedes ceder): {sobran_str}
+- SOBRAN (puedes ceder): {sobran_str} → {json.dumps(sobran)}
+{aviso_cooldown}"""
 
-## Reglas absolutas
-- Solo puedes dar recursos de SOBRAN: {json.dumps(sobran)}
-- Nunca ofrezcas recursos de FALTAN
-- El oro es moneda universal (nadie lo necesita como objetivo)
-{aviso_cooldown}
-## Carta recibida (tipo: {tipo})
+
+_AVISO_INCIERTO = (
+    "El tipo de esta carta no es seguro: decide por su contenido cuál de estos "
+    "contextos aplica.\n"
+)
+
+
+def _describir_tipos(tipos: list[str]) -> str:
+    """« tipo: X », ou « tipo incierto: X o Y » (classification incertaine)."""
+    if len(tipos) == 1:
+        return f"tipo: {tipos[0]}"
+    return f"tipo incierto: {' o '.join(tipos)}"
+
+
+def _contexto(tipos: list[str]) -> str:
+    """Contextes des types donnés, sans doublons, du plus urgent au moins urgent."""
+    return "\n".join(
+        _CONTEXTO_POR_TIPO[tipo] for tipo in sorted(set(tipos), key=PRIORIDAD_TIPO.get)
+    )
+
+
+def construir_prompt_nueva_carta(
+    estado: ButlerState,
+    carta: dict,
+    en_cooldown: bool = False,
+) -> str:
+    """Construit la partie dynamique du prompt : état actuel et carta reçue.
+
+    Pré-calcule FALTAN/SOBRAN pour réduire la charge cognitive du LLM.
+    Adapte les instructions selon le type de carta détecté (sistema, confirmacion,
+    propuesta, general) et inclut un avertissement cooldown si nécessaire. Si
+    la classification est incertaine, les contextes des deux types les plus
+    probables sont donnés et le LLM tranche.
+    Les règles et le format de réponse, communs à toutes les cartas, sont dans
+    PROMPT_SISTEMA et ne sont pas répétés ici.
+
+    Args:
+        estado:      État actuel de l'agent.
+        carta:       La carta reçue à traiter.
+        en_cooldown: Si True, le LLM doit éviter d'accepter immédiatement.
+
+    Returns:
+        Message utilisateur à envoyer à Ollama après PROMPT_SISTEMA.
+    """
+    tipos = tipos_plausibles(carta)
+    remi = carta.get("remi", "?")
+
+    return f"""{_bloque_estado(estado, en_cooldown)}
+## Carta recibida ({_describir_tipos(tipos)})
 - De: {remi}
 - Asunto: {carta.get("asunto", "")}
 - Cuerpo: {carta.get("cuerpo", "")}
 
 ## Contexto para este tipo de carta
-{_CONTEXTO_POR_TIPO[tipo]}
+{_AVISO_INCIERTO if len(tipos) > 1 else ""}{_contexto(tipos)}
 
-## Reglas de decisión (por orden de prioridad)
-1. Carta de Sistema → esperar
-2. Confirmación de intercambio → aceptar (enviar lo prometido, indicado en la carta)
-3. Oferta de ≥2 oro por recursos de SOBRAN → aceptar
-4. Cualquier trato donde das SOBRAN y recibes algo → aceptar (todo recurso es re-intercambiable)
-5. Remitente menciona tener recursos de FALTAN → ofrecer con propuesta concreta
-6. Solo pide sin ofrecer nada → esperar
-7. NUNCA envíes recursos de FALTAN
+Responde con el JSON de tu decisión (dest: "{remi}")."""
 
-## Formato de respuesta (JSON estricto, sin texto adicional)
-{{"accion":"esperar"}}
-{{"accion":"ofrecer","dest":"{remi}","asunto":"...","cuerpo":"Te propongo: te doy N de [SOBRAN] a cambio de M de [recurso]."}}
-{{"accion":"aceptar","dest":"{remi}","envio":{{"recurso":cantidad}},"recibir":{{"recurso":cantidad}}}}
 
-Ejemplo aceptar confirmación: {{"accion":"aceptar","dest":"{remi}","envio":{{"arroz":1}},"recibir":{{"madera":1}}}}
+def construir_prompt_conversacion(
+    estado: ButlerState,
+    cartas: list[dict],
+    en_cooldown: bool = False,
+) -> str:
+    """Partie dynamique du prompt pour plusieurs cartas d'un même expéditeur.
 
-Devuelve SOLO el JSON."""
+    Les cartas sont présentées comme une conversation, de la plus ancienne
+    à la plus récente, pour que le LLM décide sur leur dernier état (une
+    confirmation remplace la proposition qui la précède) au lieu de répondre
+    à chacune isolément. La réponse attendue est une liste de décisions :
+    {"decisiones": [<décision>, ...]}, exécutées dans l'ordre.
+
+    Args:
+        estado:      État actuel de l'agent.
+        cartas:      Cartas du même remitente, triées par fecha.
+        en_cooldown: Si True, le LLM doit éviter d'accepter immédiatement.
+
+    Returns:
+        Message utilisateur à envoyer à Ollama après PROMPT_SISTEMA.
+    """
+    remi = cartas[0].get("remi", "?")
+    tipos = [tipos_plausibles(c) for c in cartas]
+    mensajes = "\n".join(
+        f"""### Carta {i} ({_describir_tipos(plausibles)})
+- Asunto: {carta.get("asunto", "")}
+- Cuerpo: {carta.get("cuerpo", "")}"""
+        for i, (carta, plausibles) in enumerate(zip(cartas, tipos), start=1)
+    )
+    contexto = _contexto([tipo for plausibles in tipos for tipo in plausibles])
+
+    return f"""{_bloque_estado(estado, en_cooldown)}
+## Conversación con {remi} ({len(cartas)} cartas nuevas, de la más antigua a la más reciente)
+{mensajes}
+
+## Contexto para estos tipos de carta
+{contexto}
+
+Las cartas forman una sola conversación: decide según su estado más reciente
+(una confirmación posterior sustituye a la propuesta anterior) y no respondas
+dos veces al mismo trato.
+Responde con UN solo JSON: {{"decisiones": [<decisión>, ...]}}, con las
+decisiones en el orden en que deben ejecutarse (dest: "{remi}").
+Si no hay nada que hacer: {{"decisiones": [{{"accion":"esperar"}}]}}."""
 
 
 # ── Consultation Ollama ────────────────────────────────────────────────────────
 
 
-def consultar_ollama(prompt: str) -> dict:
-    """Envoie le prompt à Ollama et parse la décision JSON.
+class ExtractorJSON:
+    """Détecteur incrémental du premier objet JSON complet dans un flux de tokens.
+
+    Suit la profondeur des accolades en ignorant celles qui apparaissent dans
+    les chaînes (guillemets et échappements compris). Dès qu'un objet
+    équilibré est fermé et qu'il se parse, il est retourné ; un objet
+    équilibré mais invalide est abandonné et la recherche reprend après lui.
+    Contrairement à une regex, les objets imbriqués (envio/recibir) sont gérés.
+    """
+
+    def __init__(self) -> None:
+        self._buffer: list[str] = []
+        self._profundidad = 0
+        self._en_cadena = False
+        self._escape = False
+
+    def alimentar(self, fragmento: str) -> dict | None:
+        """Ajoute un fragment de texte ; retourne l'objet dès qu'il est complet."""
+        for c in fragmento:
+            if self._profundidad == 0:
+                if c != "{":
+                    continue
+                self._buffer = []
+            self._buffer.append(c)
+            if self._en_cadena:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._en_cadena = False
+            elif c == '"':
+                self._en_cadena = True
+            elif c == "{":
+                self._profundidad += 1
+            elif c == "}":
+                self._profundidad -= 1
+                if self._profundidad == 0:
+                    try:
+                        objeto = json.loads("".join(self._buffer))
+                    except json.JSONDecodeError:
+                        continue
+                    if isinstance(objeto, dict):
+                        return objeto
+        return None
+
 
-    Tente d'abord un json.loads direct. En cas d'échec (texte autour du JSON,
-    markdown code blocks, etc.), extrait le premier objet JSON via regex.
-    Retourne {"accion": "esperar"} en cas d'échec total (fallback sûr).
+def extraer_objeto_json(texto: str) -> dict | None:
+    """Retourne le premier objet JSON valide contenu dans `texto`, ou None."""
+    return ExtractorJSON().alimentar(texto)
+
+
+_estadisticas_ollama = {
+    "llamadas": 0,
+    "cortadas": 0,
+    "primer_token_s": 0.0,
+    "prompt_eval_count": 0,
+    "prompt_eval_s": 0.0,
+    "eval_count": 0,
+    "eval_s": 0.0,
+    "respuestas": 0,
+    "reparadas": 0,
+    "invalidas": 0,
+    "desperdiciadas": 0,
+}
+_lock_ollama = threading.Lock()
+
+
+def _registrar_metadatos(
+    primer_token: float | None, final: dict | None, trozos: int = 0
+) -> None:
+    """Cumule et journalise les métadonnées de génération d'un appel Ollama.
+
+    `final` est le dernier message d'Ollama (done=true) avec prompt_eval_count,
+    prompt_eval_duration, eval_count et eval_duration (en ns). Il manque quand
+    la génération a été coupée après le JSON : seul le délai du premier token
+    (≈ évaluation du prompt) est alors disponible, et les tokens générés sont
+    estimés par le nombre de `trozos` reçus (un token par morceau streamé).
+    """
+    if final is None:
+        metricas.ollama_tokens_total.inc(trozos, tipo="generados")
+    else:
+        metricas.ollama_tokens_total.inc(
+            final.get("prompt_eval_count", 0), tipo="prompt"
+        )
+        metricas.ollama_tokens_total.inc(final.get("eval_count", 0), tipo="generados")
+    with _lock_ollama:
+        st = _estadisticas_ollama
+        st["llamadas"] += 1
+        st["primer_token_s"] += primer_token or 0.0
+        if final is None:
+            st["cortadas"] += 1
+        else:
+            st["prompt_eval_count"] += final.get("prompt_eval_count", 0)
+            st["prompt_eval_s"] += final.get("prompt_eval_duration", 0) / 1e9
+            st["eval_count"] += final.get("eval_count", 0)
+            st["eval_s"] += final.get("eval_duration", 0) / 1e9
+    if final is None:
+        logger.info(
+            "Ollama: primer token en %.0f ms (generación cortada tras el JSON)",
+            1000 * (primer_token or 0.0),
+        )
+    else:
+        logger.info(
+            "Ollama: prompt_eval %d tok / %.0f ms, eval %d tok / %.0f ms",
+            final.get("prompt_eval_count", 0),
+            final.get("prompt_eval_duration", 0) / 1e6,
+            final.get("eval_count", 0),
+            final.get("eval_duration", 0) / 1e6,
+        )
+
+
+def estadisticas_ollama() -> dict:
+    """Totaux cumulés des métadonnées de génération (tokens et durées), et
+    taux de décisions invalides (repli sur « esperar » après la relance) et
+    d'appels gaspillés (génération dont la sortie n'a pas été validée)."""
+    with _lock_ollama:
+        st = dict(_estadisticas_ollama)
+    st["tasa_invalidas"] = (
+        round(st["invalidas"] / st["respuestas"], 3) if st["respuestas"] else 0.0
+    )
+    st["tasa_desperdiciadas"] = (
+        round(st["desperdiciadas"] / st["llamadas"], 3) if st["llamadas"] else 0.0
+    )
+    return st
+
+
+def _registrar_validacion(resultado: str, desperdiciadas: int) -> None:
+    """Cumule le résultat de la validation d'une décision (valida, reparada
+    ou invalida) et les générations gaspillées pour l'obtenir."""
+    metricas.llm_respuestas_total.inc(resultado=resultado)
+    metricas.ollama_llamadas_desperdiciadas_total.inc(desperdiciadas)
+    with _lock_ollama:
+        st = _estadisticas_ollama
+        st["respuestas"] += 1
+        st["reparadas"] += resultado == "reparada"
+        st["invalidas"] += resultado == "invalida"
+        st["desperdiciadas"] += desperdiciadas
+
+
+@asynccontextmanager
+async def _cliente_http(http: httpx.AsyncClient | None):
+    """Le client fourni, ou un client temporaire fermé en sortie."""
+    if http is not None:
+        yield http
+        return
+    async with httpx.AsyncClient() as temporal:
+        yield temporal
+
+
+async def _generar(
+    mensajes: list[dict], http: httpx.AsyncClient, esquema: dict
+) -> tuple[dict | None, str]:
+    """Interroge Ollama (/api/chat) et retourne (objet JSON, texte brut reçu).
+
+    Le préfixe système est envoyé comme premier message : s'il est identique
+    d'un appel à l'autre, Ollama réutilise le cache KV du préfixe et n'évalue
+    que la suite. `keep_alive` garde le modèle (et ce cache) en mémoire entre
+    deux cartas. En mode OLLAMA_FORMATO, `esquema` est passé dans `format` :
+    la génération est contrainte à un objet JSON conforme.
+
+    En mode OLLAMA_STREAM, lit les tokens au fil de l'eau et ferme la
+    connexion dès qu'un objet JSON complet est lu : Ollama interrompt alors
+    la génération, au lieu de laisser le modèle bavarder après l'accolade
+    fermante. Sinon, attend la réponse complète (stream=False).
+    """
+    payload = {
+        "model": MODEL,
+        "messages": mensajes,
+        "stream": OLLAMA_STREAM,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {"num_predict": OLLAMA_MAX_TOKENS, "stop": OLLAMA_STOP},
+    }
+    if OLLAMA_FORMATO:
+        payload["format"] = esquema
+    inicio = time.perf_counter()
+    if not OLLAMA_STREAM:
+        r = await http.post(OLLAMA_URL, json=payload, timeout=120)
+        r.raise_for_status()
+        response = r.json()
+        texto = response.get("message", {}).get("content", "").strip()
+        _registrar_metadatos(None, response)
+        return extraer_objeto_json(texto), texto
+
+    extractor = ExtractorJSON()
+    partes: list[str] = []
+    decision = None
+    primer_token = None
+    final = None
+    async with http.stream("POST", OLLAMA_URL, json=payload, timeout=120) as r:
+        r.raise_for_status()
+        async for linea in r.aiter_lines():
+            if not linea:
+                continue
+            trozo = json.loads(linea)
+            if trozo.get("done"):
+                final = trozo
+                break
+            contenido = trozo.get("message", {}).get("content", "")
+            if primer_token is None:
+                primer_token = time.perf_counter() - inicio
+            partes.append(contenido)
+            decision = extractor.alimentar(contenido)
+            if decision is not None:
+                logger.debug(
+                    "Ollama: JSON completo en %.2fs, generación cortada.",
+                    time.perf_counter() - inicio,
+                )
+                break
+    _registrar_metadatos(primer_token, final, len(partes))
+    return decision, "".join(partes).strip()
+
+
+PROMPT_REPARACION = """Tu respuesta no es una decisión válida: {error}.
+Corrígela y devuelve SOLO el JSON con el formato indicado."""
+
+
+def _validar_respuesta(objeto: dict | None, varias: bool) -> dict:
+    """Valide l'objet lu (decisiones.py) et le renvoie sous forme normalisée.
+
+    Raises:
+        ValueError: Aucun objet JSON lu, ou décision invalide (ValidationError).
+    """
+    if objeto is None:
+        raise ValueError("no contiene ningún objeto JSON")
+    if varias:
+        lista = decisiones.validar_lista(objeto)
+        return {"decisiones": [decisiones.como_dict(d) for d in lista]}
+    return decisiones.como_dict(decisiones.validar(objeto))
+
+
+async def consultar_ollama(
+    prompt: str,
+    sistema: str = PROMPT_SISTEMA,
+    http: httpx.AsyncClient | None = None,
+    varias: bool = False,
+) -> dict:
+    """Envoie le prompt à Ollama et valide la décision JSON.
+
+    La réponse est lue en streaming et coupée dès le premier objet JSON
+    complet (voir _generar), puis validée contre le modèle typé des
+    décisions. Une réponse invalide (pas de JSON, action inconnue, champ
+    manquant, quantité non entière...) est renvoyée au modèle avec l'erreur,
+    au plus LLM_REPARACIONES fois, dans la même conversation (le préfixe
+    reste en cache). Retourne {"accion": "esperar", "motivo": "json_invalido"}
+    si aucune réponse n'est valide (fallback sûr).
 
     Args:
-        prompt: Le prompt complet à envoyer au modèle.
+        prompt:  La partie dynamique du prompt (construir_prompt_nueva_carta).
+        sistema: Le préfixe statique, réutilisé d'un appel à l'autre.
+        http:    Client HTTP à réutiliser (client temporaire si None).
+        varias:  Si True, une liste {"decisiones": [...]} est attendue
+                 (construir_prompt_conversacion).
 
     Returns:
-        Dictionnaire JSON représentant la décision du LLM.
+        La décision validée (ou {"decisiones": [...]}), sous forme de dict.
     """
     logger.debug("Consultando Ollama...")
-    response = requests.post(
-        OLLAMA_URL,
-        json={"model": MODEL, "prompt": prompt, "stream": False},
-        timeout=120,
-    ).json()
+    esquema = decisiones.ESQUEMA_DECISIONES if varias else decisiones.ESQUEMA_DECISION
+    mensajes = [
+        {"role": "system", "content": sistema},
+        {"role": "user", "content": prompt},
+    ]
+    with metricas.ollama_segundos.medir():
+        async with _cliente_http(http) as cliente:
+            for intento in range(LLM_REPARACIONES + 1):
+                objeto, texto = await _generar(mensajes, cliente, esquema)
+                logger.info("Ollama → %s", texto)
+                try:
+                    resultado = _validar_respuesta(objeto, varias)
+                except ValueError as e:
+                    error = (
+                        decisiones.resumir_errores(e)
+                        if isinstance(e, ValidationError)
+                        else str(e)
+                    )
+                    logger.warning("Decisión inválida del LLM: %s", error)
+                    mensajes = mensajes[:2] + [
+                        {"role": "assistant", "content": texto},
+                        {
+                            "role": "user",
+                            "content": PROMPT_REPARACION.format(error=error),
+                        },
+                    ]
+                    continue
+                _registrar_validacion("valida" if intento == 0 else "reparada", intento)
+                return resultado
 
-    texto = response.get("response", "").strip()
-    logger.info("Ollama → %s", texto)
+    logger.warning("JSON inválido del LLM. Fallback a esperar.")
+    _registrar_validacion("invalida", LLM_REPARACIONES + 1)
+    return {"accion": "esperar", "motivo": "json_invalido"}
 
-    try:
-        return json.loads(texto)
-    except json.JSONDecodeError:
-        match = re.search(r"\{[^{}]+\}", texto)
-        if match:
+
+# ── File d'attente partagée ────────────────────────────────────────────────────
+
+
+@dataclass
+class _Solicitud:
+    """Une requête en attente dans la ColaLLM."""
+
+    prompt: str
+    sistema: str
+    tipo: str
+    varias: bool  # réponse {"decisiones": [...]} attendue (conversation)
+    encolada: float  # time.monotonic() à la mise en file
+    plazo: float | None  # échéance (monotonic) au-delà de laquelle elle est abandonnée
+    contexto: contextvars.Context
+    futuro: asyncio.Future = field(repr=False)
+
+
+class ColaLLM:
+    """File de priorité unique des requêtes vers Ollama, partagée par tous les slots.
+
+    Au plus `concurrencia` requêtes sont servies à la fois. La suivante est
+    la plus prioritaire selon le type de carta (PRIORIDAD_TIPO :
+    confirmacion > propuesta > general > sistema), puis la plus ancienne :
+    une confirmation, qui signifie souvent que l'autre a déjà envoyé sa part,
+    passe devant les annonces générales. Chaque requête a une échéance
+    (LLM_PLAZOS selon son type) : prise en charge trop tard, elle est
+    abandonnée et reçoit {"accion": "esperar", "motivo": "plazo_vencido"}
+    sans appel à Ollama. Chaque requête est exécutée dans le contexte
+    (span, slot) de la tâche qui l'a soumise. Les tâches de service
+    démarrent au premier appel à consultar().
+
+    Args:
+        concurrencia: Requêtes Ollama simultanées (LLM_CONCURRENCIA).
+        http:         Client HTTP vers Ollama (créé si None ; fermé par cerrar()).
+        plazos:       Attente maximale (s) par type de carta (None : sans limite).
+    """
+
+    def __init__(
+        self,
+        concurrencia: int = LLM_CONCURRENCIA,
+        http: httpx.AsyncClient | None = None,
+        plazos: dict[str, float | None] = LLM_PLAZOS,
+    ) -> None:
+        self.concurrencia = max(1, concurrencia)
+        self.http = http or httpx.AsyncClient()
+        self.plazos = plazos
+        self._cola: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._secuencia = itertools.count()
+        self._servidores: list[asyncio.Task] = []
+        self._en_espera: dict[str, int] = {}
+        self._esperas: deque[float] = deque(maxlen=500)
+        self.servidas = 0
+        self.vencidas = 0
+
+    @property
+    def en_espera(self) -> int:
+        """Requêtes soumises qui n'ont pas encore été prises en charge."""
+        return self._cola.qsize()
+
+    def estadisticas(self) -> dict:
+        """Profondeur de la file par type, requêtes servies/abandonnées et
+        attente (médiane, maximum) des dernières requêtes prises en charge."""
+        esperas = sorted(self._esperas)
+        return {
+            "en_espera": {t: n for t, n in self._en_espera.items() if n},
+            "servidas": self.servidas,
+            "vencidas": self.vencidas,
+            "espera_p50_s": esperas[len(esperas) // 2] if esperas else 0.0,
+            "espera_max_s": esperas[-1] if esperas else 0.0,
+        }
+
+    async def consultar(
+        self,
+        prompt: str,
+        sistema: str = PROMPT_SISTEMA,
+        tipo: str = "general",
+        varias: bool = False,
+    ) -> dict:
+        """Met la requête en file et attend la décision (voir consultar_ollama).
+
+        Args:
+            prompt:  La partie dynamique du prompt.
+            sistema: Le préfixe statique.
+            tipo:    Type de carta (clasificar_carta), qui fixe priorité et échéance.
+            varias:  Liste de décisions attendue (voir consultar_ollama).
+        """
+        if not self._servidores:
+            self._servidores = [
+                asyncio.create_task(self._servir(), name=f"llm-{i}")
+                for i in range(self.concurrencia)
+            ]
+        ahora = time.monotonic()
+        plazo = self.plazos.get(tipo)
+        solicitud = _Solicitud(
+            prompt,
+            sistema,
+            tipo,
+            varias,
+            ahora,
+            ahora + plazo if plazo is not None else None,
+            contextvars.copy_context(),
+            asyncio.get_running_loop().create_future(),
+        )
+        self._contar(tipo, 1)
+        self._cola.put_nowait(
+            (
+                PRIORIDAD_TIPO.get(tipo, len(PRIORIDAD_TIPO)),
+                next(self._secuencia),
+                solicitud,
+            )
+        )
+        return await solicitud.futuro
+
+    def _contar(self, tipo: str, delta: int) -> None:
+        self._en_espera[tipo] = self._en_espera.get(tipo, 0) + delta
+        metricas.llm_cola_profundidad.sumar(delta, tipo=tipo)
+
+    async def _servir(self) -> None:
+        while True:
+            *_, solicitud = await self._cola.get()
+            self._contar(solicitud.tipo, -1)
+            futuro = solicitud.futuro
+            if futuro.done():  # demandeur annulé pendant l'attente
+                continue
+            ahora = time.monotonic()
+            espera = ahora - solicitud.encolada
+            self._esperas.append(espera)
+            metricas.llm_cola_espera_segundos.observar(espera, tipo=solicitud.tipo)
+            if solicitud.plazo is not None and ahora > solicitud.plazo:
+                self.vencidas += 1
+                metricas.cartas_descartadas_total.inc(motivo="plazo_vencido")
+                logger.info(
+                    "File LLM : carta %s abandonnée après %.1fs d'attente.",
+                    solicitud.tipo,
+                    espera,
+                )
+                futuro.set_result({"accion": "esperar", "motivo": "plazo_vencido"})
+                continue
+            self.servidas += 1
+            tarea = asyncio.create_task(
+                consultar_ollama(
+                    solicitud.prompt, solicitud.sistema, self.http, solicitud.varias
+                ),
+                context=solicitud.contexto,
+            )
+            # Un demandeur annulé (arrêt de son slot) interrompt sa génération
+            futuro.add_done_callback(lambda f, t=tarea: f.cancelled() and t.cancel())
             try:
-                return json.loads(match.group())
-            except json.JSONDecodeError:
-                pass
-        logger.warning("JSON inválido del LLM. Fallback a esperar.")
-        return {"accion": "esperar"}
+                await asyncio.wait([tarea])
+            except asyncio.CancelledError:
+                tarea.cancel()
+                futuro.cancel()
+                raise
+            if futuro.done():
+                continue
+            if tarea.cancelled():
+                futuro.cancel()
+            elif tarea.exception() is not None:
+                futuro.set_exception(tarea.exception())
+            else:
+                futuro.set_result(tarea.result())
+
+    async def cerrar(self) -> None:
+        """Arrête les tâches de service, annule les requêtes en attente et
+        ferme le client HTTP."""
+        for servidor in self._servidores:
+            servidor.cancel()
+        await asyncio.gather(*self._servidores, return_exceptions=True)
+        self._servidores = []
+        while not self._cola.empty():
+            *_, solicitud = self._cola.get_nowait()
+            self._contar(solicitud.tipo, -1)
+            solicitud.futuro.cancel()
+        await self.http.aclose()
+
+
+# ── Cache des décisions ────────────────────────────────────────────────────────
+
+_ESPACIOS = re.compile(r"\s+")
+_MARCADOR_REMI = "<remi>"
+
+
+def _patron_remi(remi: str) -> re.Pattern:
+    """Nom de l'expéditeur en mot entier, sans tenir compte de la casse."""
+    return re.compile(rf"\b{re.escape(remi)}\b", re.IGNORECASE)
+
+
+def _normalizar_texto(texto: str, remi: str) -> str:
+    """Minuscules, espaces compactés et nom de l'expéditeur remplacé par <remi>."""
+    texto = _ESPACIOS.sub(" ", texto).strip().lower()
+    if not remi:
+        return texto
+    return _patron_remi(remi).sub(_MARCADOR_REMI, texto)
+
+
+def _abstraer_remi(decision: dict, remi: str) -> dict:
+    """Remplace le nom de `remi` par <remi> dans les valeurs texte d'une
+    décision, avec le même motif que la clé (_normalizar_texto)."""
+    if not remi:
+        return dict(decision)
+    patron = _patron_remi(remi)
+    return {
+        k: patron.sub(_MARCADOR_REMI, v) if isinstance(v, str) else v
+        for k, v in decision.items()
+    }
+
+
+def _concretar_remi(decision: dict, remi: str) -> dict:
+    """Remplace <remi> par le nom de `remi` dans une décision en cache."""
+    return {
+        k: v.replace(_MARCADOR_REMI, remi) if isinstance(v, str) else v
+        for k, v in decision.items()
+    }
+
+
+class CacheDecisiones:
+    """Cache LRU + TTL des décisions LLM, clé = contexte de négociation normalisé.
+
+    Clé : (type de carta, asunto+cuerpo normalisés, FALTAN, SOBRAN, cooldown).
+    L'expéditeur est abstrait (<remi>) pour que la même proposition reçue de
+    plusieurs agents partage une entrée ; la décision restituée est
+    réécrite pour le destinataire courant. Le cache est vidé dès que le
+    snapshot FALTAN/SOBRAN change (les décisions dépendent des ressources).
+
+    Args:
+        capacidad: Nombre maximal d'entrées (éviction LRU au-delà).
+        ttl:       Durée de vie d'une entrée en secondes.
+    """
+
+    def __init__(self, capacidad: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._entradas: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+        self._snapshot: tuple | None = None
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    @staticmethod
+    def _snapshot_de(estado: ButlerState) -> tuple:
+        faltan, sobran = calcular_faltan_sobran(estado.Recursos, estado.Objetivo)
+        return tuple(sorted(faltan.items())), tuple(sorted(sobran.items()))
+
+    def clave(self, estado: ButlerState, carta: dict, en_cooldown: bool) -> tuple:
+        """Construit la clé de cache d'une carta dans l'état courant."""
+        remi = carta.get("remi") or ""
+        texto = f"{carta.get('asunto', '')} | {carta.get('cuerpo', '')}"
+        return (
+            clasificar_carta(carta),
+            _normalizar_texto(texto, remi),
+            *self._snapshot_de(estado),
+            en_cooldown,
+        )
+
+    def _sincronizar(self, estado: ButlerState) -> None:
+        """Vide le cache si FALTAN/SOBRAN ont changé depuis le dernier accès."""
+        snapshot = self._snapshot_de(estado)
+        if snapshot != self._snapshot:
+            if self._entradas:
+                self.invalidaciones += 1
+                logger.debug("Cache LLM invalidé (ressources modifiées).")
+            self._entradas.clear()
+            self._snapshot = snapshot
+
+    def obtener(self, clave: tuple, estado: ButlerState, remi: str) -> dict | None:
+        """Retourne la décision en cache pour `remi`, ou None (absente/expirée)."""
+        with self._lock:
+            self._sincronizar(estado)
+            entrada = self._entradas.get(clave)
+            if entrada is None or time.monotonic() - entrada[0] > self.ttl:
+                if entrada is not None:
+                    del self._entradas[clave]
+                    self.expulsiones += 1
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+        return _concretar_remi(entrada[1], remi)
+
+    def guardar(
+        self, clave: tuple, estado: ButlerState, remi: str, decision: dict
+    ) -> None:
+        """Mémorise une décision (sauf fallback JSON invalide ou délai expiré)."""
+        if decision.get("motivo") in _MOTIVOS_SIN_LLM:
+            return
+        with self._lock:
+            self._sincronizar(estado)
+            self._entradas[clave] = (
+                time.monotonic(),
+                _abstraer_remi(decision, remi),
+            )
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+                self.expulsiones += 1
+
+    def estadisticas(self) -> dict:
+        """Compteurs aciertos/fallos/expulsiones/invalidaciones et taille courante."""
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_acierto": self.aciertos / consultas if consultas else 0.0,
+                "expulsiones": self.expulsiones,
+                "invalidaciones": self.invalidaciones,
+                "tamano": len(self._entradas),
+            }
+
+
+# ── Enregistrement pour rejeu (replay.py) ──────────────────────────────────────
+
+_lock_grabacion = threading.Lock()
+
+
+def grabar_decision(
+    estado: ButlerState,
+    carta: dict,
+    en_cooldown: bool,
+    decision: dict,
+    latencia: float,
+    ruta: str | None = None,
+) -> None:
+    """Ajoute une décision LLM au fichier JSONL d'enregistrement.
+
+    Chaque ligne {"estado", "carta", "en_cooldown", "decision", "latencia",
+    "modelo"} est un cas rejouable par replay.py, la décision servant de
+    référence.
+
+    Args:
+        ruta: Fichier de destination (LLM_GRABACION si None ; rien si vide).
+    """
+    ruta = ruta or LLM_GRABACION
+    if not ruta:
+        return
+    linea = json.dumps(
+        {
+            "estado": estado.model_dump(exclude={"Buzon"}),
+            "carta": carta,
+            "en_cooldown": en_cooldown,
+            "decision": decision,
+            "latencia": round(latencia, 3),
+            "modelo": MODEL,
+        },
+        ensure_ascii=False,
+    )
+    try:
+        with _lock_grabacion, open(ruta, "a", encoding="utf-8") as f:
+            f.write(linea + "\n")
+    except OSError as e:
+        logger.error("Erreur enregistrement décision LLM: %s", e)
+
+
+async def decidir_carta(
+    estado: ButlerState,
+    carta: dict,
+    en_cooldown: bool = False,
+    cola: ColaLLM | None = None,
+    cache: CacheDecisiones | None = None,
+) -> dict:
+    """Décision LLM pour une carta, servie depuis le cache quand c'est possible.
+
+    Args:
+        estado:      État actuel de l'agent.
+        carta:       La carta reçue à traiter.
+        en_cooldown: Si True, le LLM doit éviter d'accepter immédiatement.
+        cola:        File d'attente vers Ollama (client temporaire si None).
+        cache:       Cache des décisions du slot (pas de cache si None).
+
+    Returns:
+        Dictionnaire JSON représentant la décision (du cache ou d'Ollama).
+    """
+    remi = carta.get("remi") or ""
+    with trazas.span("llm") as span_llm:
+        tipo = clasificar_carta(carta)
+        span_llm.anotar(tipo=tipo)
+        clave = cache.clave(estado, carta, en_cooldown) if cache else None
+        decision = cache.obtener(clave, estado, remi) if cache else None
+        if decision is not None:
+            span_llm.anotar(cache=True)
+            logger.info("Cache LLM → %s", decision)
+            return decision
+        with trazas.span("prompt"):
+            prompt = construir_prompt_nueva_carta(
+                estado, carta, en_cooldown=en_cooldown
+            )
+        inicio = time.perf_counter()
+        with trazas.span("ollama"):
+            if cola is not None:
+                decision = await cola.consultar(prompt, tipo=tipo)
+            else:
+                decision = await consultar_ollama(prompt)
+        if decision.get("motivo") == "plazo_vencido":
+            span_llm.anotar(vencida=True)
+            return decision
+        grabar_decision(
+            estado, carta, en_cooldown, decision, time.perf_counter() - inicio
+        )
+        if cache is not None:
+            cache.guardar(clave, estado, remi, decision)
+        return decision
+
+
+async def decidir_conversacion(
+    estado: ButlerState,
+    cartas: list[dict],
+    en_cooldown: bool = False,
+    cola: ColaLLM | None = None,
+) -> list[dict]:
+    """Décisions LLM pour plusieurs cartas d'un même expéditeur, en UN appel.
+
+    Les cartas sont décidées ensemble (construir_prompt_conversacion), sur le
+    même état, ce qui évite un appel par carta et des décisions
+    contradictoires. Ni cache ni enregistrement pour replay.py : la clé et
+    les cas rejouables portent sur une seule carta.
+
+    Args:
+        estado:      État actuel de l'agent.
+        cartas:      Cartas du même remitente, triées par fecha.
+        en_cooldown: Si True, le LLM doit éviter d'accepter immédiatement.
+        cola:        File d'attente vers Ollama (client temporaire si None).
+
+    Returns:
+        Décisions à exécuter dans l'ordre (au plus une par carta).
+    """
+    with trazas.span("llm", cartas=len(cartas)) as span_llm:
+        tipos = [clasificar_carta(c) for c in cartas]
+        tipo = min(tipos, key=PRIORIDAD_TIPO.get)
+        span_llm.anotar(tipo=tipo)
+        with trazas.span("prompt"):
+            prompt = construir_prompt_conversacion(estado, cartas, en_cooldown)
+        with trazas.span("ollama"):
+            if cola is not None:
+                respuesta = await cola.consultar(prompt, tipo=tipo, varias=True)
+            else:
+                respuesta = await consultar_ollama(prompt, varias=True)
+        if "decisiones" not in respuesta:  # repli : plazo_vencido ou json_invalido
+            span_llm.anotar(vencida=respuesta.get("motivo") == "plazo_vencido")
+            return [respuesta]
+        return respuesta["decisiones"][: len(cartas)]
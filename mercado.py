@@ -0,0 +1,229 @@
+"""
+mercado.py — Carnet d'ordres du marché, alimenté par les cartas reçues.
+
+Les autres agents annoncent ce qu'ils cherchent et ce qu'ils cèdent
+(« Necesito: ... Ofrezco a cambio: ... », en texte ou en JSON) et leurs
+propositions disent la même chose (« te doy X a cambio de Y »). Le carnet
+garde, par agent, ses demandes et ses offres avec quantités et date de
+dernière annonce, indexées par ressource → {agent: quantité}.
+
+Les broadcasts (agent.py) s'en servent pour n'envoyer une offre qu'aux
+agents qui ont annoncé pouvoir la satisfaire ; les agents inconnus ou dont
+l'annonce date de plus de MERCADO_TTL reçoivent toutes les offres, comme
+avant. Chaque slot (AgenteRuntime) tient son propre carnet, alimenté par les
+cartas de son buzón.
+"""
+
+import json
+import re
+import threading
+import time
+import unicodedata
+
+from config import MERCADO_TTL
+
+_CANTIDAD = re.compile(r"(\d+)\s+(?:de\s+)?([a-z_]+)")
+# « necesito » en tête d'annonce, pas « 1 madera que necesito por ... »
+_NECESITO = re.compile(r"(?<!que )\bnecesito\b:?")
+_OFREZCO = re.compile(r"\b(?:ofrezco|te ofrezco|te doy)\b(?:\s+a cambio)?:?")
+_PROPUESTA = re.compile(r"te doy ([^\n]+?) a cambio de ([^\n.]+)")
+
+
+def _normalizar(texto: str) -> str:
+    sin_acentos = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in sin_acentos if not unicodedata.combining(c)).lower()
+
+
+def _parsear_segmento(segmento: str) -> dict:
+    """{ressource: quantité} d'un objet JSON ou d'une liste « 2 de tela, 1 queso »."""
+    segmento = segmento.strip()
+    if segmento.startswith("{"):
+        try:
+            datos = json.loads(segmento[: segmento.find("}") + 1])
+        except json.JSONDecodeError:
+            return {}
+        return {k: v for k, v in datos.items() if isinstance(v, int) and v > 0}
+    cantidades: dict[str, int] = {}
+    for cant, rec in _CANTIDAD.findall(re.split(r"[.\n]", segmento, maxsplit=1)[0]):
+        if int(cant) > 0:
+            cantidades[rec] = cantidades.get(rec, 0) + int(cant)
+    return cantidades
+
+
+def parsear_anuncio(texto: str) -> tuple[dict, dict] | None:
+    """Extrait (necesita, ofrece) d'une annonce « Necesito ... Ofrezco ... ».
+
+    Returns:
+        Les deux dictionnaires {ressource: quantité}, ou None si le texte
+        n'est pas une annonce chiffrée.
+    """
+    texto = _normalizar(texto)
+    necesito = _NECESITO.search(texto)
+    if not necesito:
+        return None
+    ofrezco = _OFREZCO.search(texto, necesito.end())
+    fin = ofrezco.start() if ofrezco else len(texto)
+    necesita = _parsear_segmento(texto[necesito.end() : fin])
+    ofrece = _parsear_segmento(texto[ofrezco.end() :]) if ofrezco else {}
+    if not (necesita or ofrece):
+        return None
+    return necesita, ofrece
+
+
+class LibroOrdenes:
+    """Demandes et offres annoncées par les autres agents, thread-safe.
+
+    Une annonce complète remplace l'entrée de l'agent ; une proposition ne
+    fait que compléter les ressources qu'elle cite. Une entrée plus vieille
+    que `ttl` est ignorée (l'agent redevient inconnu) puis purgée.
+
+    Args:
+        ttl: Fraîcheur (s) d'une entrée.
+    """
+
+    def __init__(self, ttl: float = MERCADO_TTL) -> None:
+        self.ttl = ttl
+        self._entradas: dict[str, dict] = {}  # alias → {"necesita", "ofrece", "visto"}
+        self._ofertas: dict[str, dict[str, int]] = {}  # ressource → {alias: cant}
+        self._demandas: dict[str, dict[str, int]] = {}  # ressource → {alias: cant}
+        self._lock = threading.Lock()
+
+    # ── Alimentation ───────────────────────────────────────────────────────────
+
+    def _desindexar(self, alias: str) -> None:
+        entrada = self._entradas.pop(alias, None)
+        if entrada is None:
+            return
+        for indice, lado in ((self._ofertas, "ofrece"), (self._demandas, "necesita")):
+            for rec in entrada[lado]:
+                agentes = indice.get(rec, {})
+                agentes.pop(alias, None)
+                if not agentes:
+                    indice.pop(rec, None)
+
+    def actualizar(
+        self, alias: str, necesita: dict, ofrece: dict, reemplazar: bool = True
+    ) -> None:
+        """Enregistre ce qu'un agent cherche et cède.
+
+        Args:
+            reemplazar: True pour une annonce complète ; False pour fusionner
+                        avec l'entrée existante (proposition ponctuelle).
+        """
+        with self._lock:
+            anterior = self._entradas.get(alias)
+            if not reemplazar and anterior and self._fresca(anterior):
+                necesita = {**anterior["necesita"], **necesita}
+                ofrece = {**anterior["ofrece"], **ofrece}
+            self._desindexar(alias)
+            self._entradas[alias] = {
+                "necesita": dict(necesita),
+                "ofrece": dict(ofrece),
+                "visto": time.time(),
+            }
+            for rec, cant in ofrece.items():
+                self._ofertas.setdefault(rec, {})[alias] = cant
+            for rec, cant in necesita.items():
+                self._demandas.setdefault(rec, {})[alias] = cant
+
+    def registrar_carta(self, carta: dict) -> bool:
+        """Met à jour le carnet avec une carta reçue (annonce ou propositions).
+
+        Returns:
+            True si la carta a apporté des informations de marché.
+        """
+        remi = carta.get("remi") or ""
+        if not remi or remi.lower() == "sistema":
+            return False
+        texto = f"{carta.get('asunto', '')}\n{carta.get('cuerpo', '')}"
+        anuncio = parsear_anuncio(texto)
+        if anuncio:
+            self.actualizar(remi, *anuncio)
+            return True
+        necesita: dict[str, int] = {}
+        ofrece: dict[str, int] = {}
+        for da, pide in _PROPUESTA.findall(_normalizar(texto)):
+            for rec, cant in _parsear_segmento(da).items():
+                ofrece[rec] = max(ofrece.get(rec, 0), cant)
+            for rec, cant in _parsear_segmento(pide).items():
+                necesita[rec] = max(necesita.get(rec, 0), cant)
+        if not (necesita or ofrece):
+            return False
+        self.actualizar(remi, necesita, ofrece, reemplazar=False)
+        return True
+
+    # ── Consultation ───────────────────────────────────────────────────────────
+
+    def _fresca(self, entrada: dict) -> bool:
+        return time.time() - entrada["visto"] < self.ttl
+
+    def _entrada(self, alias: str) -> dict | None:
+        """Entrée fraîche de l'agent (la purge si elle a expiré). Sous verrou."""
+        entrada = self._entradas.get(alias)
+        if entrada is not None and not self._fresca(entrada):
+            self._desindexar(alias)
+            return None
+        return entrada
+
+    def _proveedores(self, recursos: dict) -> set[str]:
+        """Agents qui cèdent au moins une de ces ressources (index). Sous verrou."""
+        return {
+            a
+            for rec in recursos
+            for a, cant in self._ofertas.get(rec, {}).items()
+            if cant > 0
+        }
+
+    def puede_dar(self, alias: str, recursos: dict) -> bool | None:
+        """L'agent a-t-il annoncé céder au moins une de ces ressources ?
+
+        Un fournisseur partiel d'un lot (menu) reste un destinataire : il peut
+        accepter en complétant avec d'autres, ou contre-proposer.
+
+        Returns:
+            True / False pour un agent connu, None pour un agent inconnu.
+        """
+        with self._lock:
+            if self._entrada(alias) is None:
+                return None
+            return alias in self._proveedores(recursos)
+
+    def destinatarios(self, recibir: dict, otros: list[str]) -> list[str]:
+        """Agents de `otros` à qui proposer une offre dont on attend `recibir` :
+        ceux qui ont annoncé céder une de ces ressources (index par ressource),
+        plus tous les agents inconnus."""
+        with self._lock:
+            proveedores = self._proveedores(recibir)
+            return [a for a in otros if a in proveedores or self._entrada(a) is None]
+
+    def ofertas(self, recurso: str) -> dict[str, int]:
+        """{alias: quantité} des agents (annonces fraîches) qui cèdent `recurso`."""
+        with self._lock:
+            return {
+                a: c
+                for a, c in self._ofertas.get(recurso, {}).items()
+                if self._fresca(self._entradas[a])
+            }
+
+    def demandas(self, recurso: str) -> dict[str, int]:
+        """{alias: quantité} des agents (annonces fraîches) qui cherchent `recurso`."""
+        with self._lock:
+            return {
+                a: c
+                for a, c in self._demandas.get(recurso, {}).items()
+                if self._fresca(self._entradas[a])
+            }
+
+    def instantanea(self) -> dict:
+        """Copie des entrées fraîches : {alias: {"necesita", "ofrece", "edad_s"}}."""
+        ahora = time.time()
+        with self._lock:
+            return {
+                alias: {
+                    "necesita": dict(e["necesita"]),
+                    "ofrece": dict(e["ofrece"]),
+                    "edad_s": round(ahora - e["visto"], 1),
+                }
+                for alias, e in self._entradas.items()
+                if self._fresca(e)
+            }
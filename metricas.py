@@ -0,0 +1,332 @@
+"""
+metricas.py — Métriques en mémoire au format d'exposition Prometheus.
+
+Compteurs, jauges et histogrammes minimalistes, thread-safe, sans dépendance ni
+service externe : les modules instrumentés incrémentent les métriques
+déclarées ici, et l'endpoint /metrics de app.py sert exponer().
+
+Les métriques couvrent chaque étape du traitement, pour distinguer une
+lenteur de Butler, d'Ollama ou des broadcasts :
+- butler_obtener_estado_segundos  : latence de /info
+- butler_cache_total{endpoint,resultado} : lectures de /info et /gente servies
+  par le cache de butler.py (acierto, compartida, sin_cambios) ou lues (leida)
+- poll_ciclo_segundos, poll_cartas_nuevas : durée d'un cycle, cartas détectées
+- cartas_clasificadas_total{tipo,confianza} : types de clasificar_carta (toutes
+  les cartas traitées) ; confianza=baja sous INTENCIONES_CONFIANZA_MIN
+- ollama_segundos, ollama_tokens_total{tipo} : latence et tokens de consultar_ollama
+- decisiones_total{accion,origen} : décisions prises (règles ou LLM)
+- envios_bloqueados_total          : envois refusés par validar_envio / les réservations
+- broadcast_segundos, broadcast_cartas_total{tipo,resultado} (dont evitada :
+  cartas épargnées par le carnet d'ordres de mercado.py)
+- llm_cola_profundidad{tipo}, llm_cola_espera_segundos{tipo} : file LLM partagée
+- cartas_descartadas_total{motivo} : cartas superadas ou dont le délai a expiré
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Bornes par défaut, en secondes (de 5 ms à 1 min)
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _etiquetas(
+    nombres: tuple[str, ...], valores: tuple[str, ...], extra: str = ""
+) -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _numero(valor: float) -> str:
+    if valor == math.inf:
+        return "+Inf"
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class Contador:
+    """Compteur monotone, éventuellement étiqueté.
+
+    Args:
+        nombre:    Nom de la métrique (suffixe _total recommandé).
+        ayuda:     Description (ligne # HELP).
+        etiquetas: Noms des étiquettes, passées en kwargs à inc().
+    """
+
+    tipo = "counter"
+
+    def __init__(
+        self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()
+    ) -> None:
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor: float = 1, **etiquetas: str) -> None:
+        clave = tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def valor(self, **etiquetas: str) -> float:
+        clave = tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+        with self._lock:
+            return self._valores.get(clave, 0)
+
+    def exponer(self) -> list[str]:
+        with self._lock:
+            valores = sorted(self._valores.items())
+        return [
+            f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(v)}"
+            for clave, v in valores
+        ]
+
+
+class Indicador:
+    """Jauge (valeur qui monte et descend), éventuellement étiquetée.
+
+    Args:
+        nombre:    Nom de la métrique.
+        ayuda:     Description (ligne # HELP).
+        etiquetas: Noms des étiquettes, passées en kwargs à sumar().
+    """
+
+    tipo = "gauge"
+
+    def __init__(
+        self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()
+    ) -> None:
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, valor: float, **etiquetas: str) -> None:
+        """Ajoute `valor` (négatif pour décrémenter)."""
+        clave = tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def valor(self, **etiquetas: str) -> float:
+        clave = tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+        with self._lock:
+            return self._valores.get(clave, 0)
+
+    def exponer(self) -> list[str]:
+        with self._lock:
+            valores = sorted(self._valores.items())
+        return [
+            f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(v)}"
+            for clave, v in valores
+        ]
+
+
+class Histograma:
+    """Histogramme cumulatif (buckets, _sum, _count), éventuellement étiqueté.
+
+    Args:
+        nombre:    Nom de la métrique.
+        ayuda:     Description (ligne # HELP).
+        buckets:   Bornes supérieures croissantes (+Inf ajouté automatiquement).
+        etiquetas: Noms des étiquettes, passées en kwargs à observar().
+    """
+
+    tipo = "histogram"
+
+    def __init__(
+        self,
+        nombre: str,
+        ayuda: str,
+        buckets: tuple[float, ...] = BUCKETS_SEGUNDOS,
+        etiquetas: tuple[str, ...] = (),
+    ) -> None:
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.etiquetas = etiquetas
+        # clave → ([compte par bucket], somme, compte)
+        self._series: dict[tuple[str, ...], tuple[list[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, **etiquetas: str) -> None:
+        clave = tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+        with self._lock:
+            cuentas, suma, total = self._series.get(
+                clave, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    cuentas[i] += 1
+                    break
+            self._series[clave] = (cuentas, suma + valor, total + 1)
+
+    @contextmanager
+    def medir(self, **etiquetas: str):
+        """Observe la durée (s) du bloc `with`, y compris s'il lève une exception."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def exponer(self) -> list[str]:
+        with self._lock:
+            series = sorted(
+                (k, (list(c), s, t)) for k, (c, s, t) in self._series.items()
+            )
+        lineas = []
+        for clave, (cuentas, suma, total) in series:
+            acumulado = 0
+            for limite, cuenta in zip(self.buckets, cuentas):
+                acumulado += cuenta
+                le = _etiquetas(self.etiquetas, clave, f'le="{_numero(limite)}"')
+                lineas.append(f"{self.nombre}_bucket{le} {acumulado}")
+            etiquetas = _etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {total}")
+        return lineas
+
+
+class Registro:
+    """Ensemble de métriques exposées ensemble par /metrics."""
+
+    def __init__(self) -> None:
+        self._metricas: list[Contador | Indicador | Histograma] = []
+
+    def registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def exponer(self) -> str:
+        """Texte au format d'exposition Prometheus 0.0.4."""
+        lineas = []
+        for m in self._metricas:
+            lineas.append(f"# HELP {m.nombre} {m.ayuda}")
+            lineas.append(f"# TYPE {m.nombre} {m.tipo}")
+            lineas.extend(m.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+# ── Métriques de l'agent ───────────────────────────────────────────────────────
+
+butler_obtener_estado_segundos = registro.registrar(
+    Histograma("butler_obtener_estado_segundos", "Latence de GET /info vers Butler.")
+)
+butler_cache_total = registro.registrar(
+    Contador(
+        "butler_cache_total",
+        "Lectures Butler par résultat du cache : acierto (fenêtre/TTL), compartida "
+        "(requête en cours), sin_cambios (contenu identique, non re-parsé), leida.",
+        ("endpoint", "resultado"),
+    )
+)
+poll_ciclo_segundos = registro.registrar(
+    Histograma(
+        "poll_ciclo_segundos", "Durée d'un cycle de polling (détection et traitement)."
+    )
+)
+poll_cartas_nuevas = registro.registrar(
+    Histograma(
+        "poll_cartas_nuevas",
+        "Nouvelles cartas détectées par cycle de polling.",
+        buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+    )
+)
+cartas_clasificadas_total = registro.registrar(
+    Contador(
+        "cartas_clasificadas_total",
+        "Cartas traitées (règles ou LLM), par type de clasificar_carta "
+        "et confiance du classifieur (alta/baja).",
+        ("tipo", "confianza"),
+    )
+)
+ollama_segundos = registro.registrar(
+    Histograma("ollama_segundos", "Latence de consultar_ollama (appel Ollama complet).")
+)
+ollama_tokens_total = registro.registrar(
+    Contador(
+        "ollama_tokens_total",
+        "Tokens évalués (prompt) et générés (generados) par Ollama.",
+        ("tipo",),
+    )
+)
+decisiones_total = registro.registrar(
+    Contador(
+        "decisiones_total",
+        "Décisions prises, par action et par origine (reglas ou llm).",
+        ("accion", "origen"),
+    )
+)
+envios_bloqueados_total = registro.registrar(
+    Contador(
+        "envios_bloqueados_total",
+        "Acceptations dont l'envoi a été refusé (SOBRAN insuffisant ou déjà réservé).",
+    )
+)
+broadcast_segundos = registro.registrar(
+    Histograma("broadcast_segundos", "Durée d'un cycle complet de broadcast.")
+)
+broadcast_cartas_total = registro.registrar(
+    Contador(
+        "broadcast_cartas_total",
+        "Cartas de broadcast, par type et résultat (enviada/fallida, ou evitada : "
+        "non envoyée, le carnet d'ordres montrant que le destinataire ne peut pas "
+        "satisfaire l'offre).",
+        ("tipo", "resultado"),
+    )
+)
+llm_cola_profundidad = registro.registrar(
+    Indicador(
+        "llm_cola_profundidad",
+        "Requêtes en attente dans la file LLM partagée, par type de carta.",
+        ("tipo",),
+    )
+)
+llm_cola_espera_segundos = registro.registrar(
+    Histograma(
+        "llm_cola_espera_segundos",
+        "Attente dans la file LLM avant l'appel à Ollama, par type de carta.",
+        etiquetas=("tipo",),
+    )
+)
+cartas_descartadas_total = registro.registrar(
+    Contador(
+        "cartas_descartadas_total",
+        "Cartas non soumises au LLM : superada (carta générale plus récente du "
+        "même expéditeur) ou plazo_vencido (délai de la file LLM expiré).",
+        ("motivo",),
+    )
+)
+llm_respuestas_total = registro.registrar(
+    Contador(
+        "llm_respuestas_total",
+        "Décisions demandées au LLM, par résultat de la validation : valida, "
+        "reparada (valide après relance avec l'erreur) ou invalida (repli esperar).",
+        ("resultado",),
+    )
+)
+negociaciones_liquidadas_total = registro.registrar(
+    Contador(
+        "negociaciones_liquidadas_total",
+        "Confirmations réglées sans LLM par la mémoire des négociations : aceptada "
+        "(paquete reçu, notre part envoyée), paquete_pendiente, ya_pagado, "
+        "desconocida (aucune offre ouverte : rien n'est payé).",
+        ("resultado",),
+    )
+)
+ollama_llamadas_desperdiciadas_total = registro.registrar(
+    Contador(
+        "ollama_llamadas_desperdiciadas_total",
+        "Générations Ollama dont la sortie n'a pas passé la validation.",
+    )
+)
@@ -0,0 +1,519 @@
+"""
+negociaciones.py — Mémoire persistante des négociations (IA classique : état SQLite).
+
+Chaque offre envoyée (broadcasts 1:1, oro et menu, contre-offres et
+acceptations de agent.ejecutar_decision) est enregistrée par contrepartie et
+par termes : ce que nous donnons (envio) et ce que nous recevons (recibir).
+Quand une confirmation arrive (« Acepto #v-n », « Intercambio aceptado. Te
+envié: {...} »), elle est rapprochée de l'offre correspondante et réglée
+sans LLM :
+
+    ofrecida ──confirmation──▶ confirmada ──paquete reçu──▶ cobrada ──envoi──▶ cerrada
+        │                                                       │
+        └──(nous payons d'abord : aceptar)──▶ enviada ──paquete reçu──▶ cerrada
+                                                                └──SOBRAN épuisé──▶ bloqueada
+
+Le paquete annoncé est vérifié contre Recursos : observar() compare les
+Recursos de chaque poll aux précédents (en rajoutant nos propres envois) et
+enregistre chaque arrivée avec l'instant où elle a été constatée. Butler ne
+dit pas qui a envoyé un paquete : une arrivée n'est donc imputée à une offre
+que si elle a été constatée dans sa fenêtre — depuis l'ouverture de l'offre,
+depuis sa confirmation si elle attend le paquete, depuis notre envoi si
+nous avons payé d'abord. Une offre confirmée est réglée dès que son paquete
+arrive (liquidables), sans attendre d'autre carta. Un cadeau antérieur à
+l'offre ne la règle pas, et un expéditeur qui annonce un envoi jamais fait
+ne reçoit rien ; en revanche, un paquete d'un tiers aux mêmes ressources
+reçu dans la fenêtre ne se distingue pas de celui de la contrepartie.
+
+Le tout vit dans une base SQLite par slot (NEGOCIACIONES_DB), indexée par
+contrepartie et état, et survit aux redémarrages.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import metricas
+from config import NEGOCIACIONES_DB, NEGOCIACIONES_TTL
+
+logger = logging.getLogger(__name__)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS ofertas (
+    id          INTEGER PRIMARY KEY,
+    contraparte TEXT    NOT NULL,
+    envio       TEXT    NOT NULL,  -- JSON canonique : ce que nous donnons
+    recibir     TEXT    NOT NULL,  -- JSON canonique : ce que nous recevons
+    estado      TEXT    NOT NULL,
+    origen      TEXT    NOT NULL,  -- menú, 1:1, oro, ofrecer, aceptar
+    referencia  TEXT,              -- code « #v-n » d'une ligne de menu
+    cierres     INTEGER NOT NULL DEFAULT 0,
+    creada      REAL    NOT NULL,
+    actualizada REAL    NOT NULL,
+    desde       REAL    NOT NULL DEFAULT 0,  -- début de la fenêtre d'imputation
+    UNIQUE (contraparte, envio, recibir)
+);
+CREATE INDEX IF NOT EXISTS ofertas_contraparte_estado
+    ON ofertas (contraparte, estado, actualizada);
+CREATE INDEX IF NOT EXISTS ofertas_estado ON ofertas (estado, actualizada);
+CREATE TABLE IF NOT EXISTS recursos (
+    recurso  TEXT PRIMARY KEY,
+    cantidad INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recepciones (
+    id        INTEGER PRIMARY KEY,
+    recurso   TEXT    NOT NULL,
+    unidades  INTEGER NOT NULL,  -- unités pas encore imputées
+    observada REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recepciones_recurso ON recepciones (recurso, observada);
+DROP TABLE IF EXISTS llegadas;  -- ancien solde commun, sans date
+"""
+
+# États où une offre attend encore quelque chose (de nous ou de l'autre)
+_ABIERTAS = ("ofrecida", "confirmada", "enviada")
+
+
+def ruta_negociaciones(slot: str) -> str:
+    """Base SQLite du slot (gabarit NEGOCIACIONES_DB)."""
+    return NEGOCIACIONES_DB.format(slot=slot)
+
+
+def _canonico(recursos: dict) -> str:
+    return json.dumps(recursos, sort_keys=True)
+
+
+@dataclass
+class Liquidacion:
+    """Décision issue d'une offre connue ; `oferta` est à clore après exécution."""
+
+    oferta: int
+    decision: dict
+
+
+class Negociaciones:
+    """Offres envoyées par un slot et leur règlement déterministe.
+
+    Toutes les méthodes sont synchrones et brèves (requêtes indexées, une
+    transaction chacune) : elles sont appelées depuis la boucle de l'agent.
+
+    Args:
+        ruta: Fichier SQLite du slot (ruta_negociaciones ; None : base en
+              mémoire, sans persistance).
+        ttl:  Durée (s) sans nouvelle au-delà de laquelle une offre ouverte caduque.
+    """
+
+    def __init__(
+        self,
+        ruta: str | None,
+        ttl: float = NEGOCIACIONES_TTL,
+    ) -> None:
+        self.ruta = ruta
+        self.ttl = ttl
+        self._conexion = sqlite3.connect(ruta or ":memory:", check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.executescript(_ESQUEMA)
+        columnas = {c[1] for c in self._conexion.execute("PRAGMA table_info(ofertas)")}
+        if "desde" not in columnas:  # base créée sans fenêtre d'imputation
+            self._conexion.execute(
+                "ALTER TABLE ofertas ADD COLUMN desde REAL NOT NULL DEFAULT 0"
+            )
+        # nos envois depuis le dernier observar() : (début, fin) monotones, envio
+        self._salidas: list[tuple[float, float, dict]] = []
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        """Ferme la connexion SQLite."""
+        with self._lock:
+            self._conexion.close()
+
+    # ── Enregistrement des offres ──────────────────────────────────────────────
+
+    def registrar_ofertas(self, ofertas: list[dict], origen: str) -> None:
+        """Enregistre (ou rafraîchit) des offres envoyées.
+
+        Une offre déjà connue pour la même contrepartie et les mêmes termes
+        est rafraîchie ; close ou caduque, elle est rouverte. Une offre en
+        cours de règlement garde son état.
+
+        Args:
+            ofertas: Offres {"dest", "envio", "recibir"[, "referencia"]}.
+            origen:  Broadcast ou décision qui les a envoyées.
+        """
+        ahora = time.time()
+        filas = [
+            (
+                o["dest"],
+                _canonico(o["envio"]),
+                _canonico(o["recibir"]),
+                origen,
+                o.get("referencia"),
+                ahora,
+            )
+            for o in ofertas
+            if o["envio"] and o["recibir"]
+        ]
+        if not filas:
+            return
+        with self._lock, self._conexion:
+            self._conexion.executemany(
+                """
+                INSERT INTO ofertas (contraparte, envio, recibir, estado, origen,
+                                     referencia, creada, actualizada, desde)
+                VALUES (?1, ?2, ?3, 'ofrecida', ?4, ?5, ?6, ?6, ?6)
+                ON CONFLICT (contraparte, envio, recibir) DO UPDATE SET
+                    estado = CASE WHEN estado IN ('cerrada', 'caducada', 'bloqueada')
+                                  THEN 'ofrecida' ELSE estado END,
+                    desde = CASE WHEN estado IN ('cerrada', 'caducada', 'bloqueada')
+                                 THEN excluded.desde ELSE desde END,
+                    origen = excluded.origen,
+                    referencia = excluded.referencia,
+                    actualizada = excluded.actualizada
+                """,
+                filas,
+            )
+
+    def registrar_envio(
+        self, dest: str, envio: dict, recibir: dict, inicio: float | None = None
+    ) -> None:
+        """Enregistre un paquete que nous avons envoyé : s'il était la première
+        moitié d'un échange (`recibir` non vide), l'offre passe « enviada » et
+        attend le paquete de l'autre.
+
+        `inicio` est l'instant (time.monotonic) où l'envoi a commencé ; à défaut,
+        l'envoi est daté de son enregistrement.
+        """
+        ahora = time.time()
+        fin = time.monotonic()
+        with self._lock, self._conexion:
+            self._salidas.append((fin if inicio is None else inicio, fin, envio))
+            if not recibir:
+                return
+            self._conexion.execute(
+                """
+                INSERT INTO ofertas (contraparte, envio, recibir, estado, origen,
+                                     creada, actualizada, desde)
+                VALUES (?1, ?2, ?3, 'enviada', 'aceptar', ?4, ?4, ?4)
+                ON CONFLICT (contraparte, envio, recibir) DO UPDATE SET
+                    estado = 'enviada',
+                    actualizada = excluded.actualizada,
+                    desde = excluded.desde
+                """,
+                (dest, _canonico(envio), _canonico(recibir), ahora),
+            )
+
+    # ── Recursos observés ──────────────────────────────────────────────────────
+
+    def observar(
+        self, recursos: dict, lectura: tuple[float, float] | None = None
+    ) -> None:
+        """Enregistre les unités arrivées depuis le poll précédent et fait
+        caduquer les offres restées sans nouvelle au-delà du TTL (ainsi que
+        les arrivées plus anciennes que le TTL, jamais imputées).
+
+        `lectura` borne (time.monotonic) la requête qui a produit `recursos`.
+        Une baisse due à nos envois terminés avant la lecture est compensée ;
+        un envoi commencé après reste en attente du poll suivant. Un envoi à
+        cheval sur la lecture a pu être vu ou non : il n'est compensé ni
+        maintenant ni plus tard, ce qui ne peut que masquer une arrivée, jamais
+        en inventer une. Sans `lectura`, tous les envois sont tenus pour vus.
+        """
+        ahora = time.time()
+        with self._lock, self._conexion:
+            previos = dict(
+                self._conexion.execute("SELECT recurso, cantidad FROM recursos")
+            )
+            vistas: dict[str, int] = {}
+            pendientes = []
+            for salida in self._salidas:
+                inicio, fin, envio = salida
+                if lectura is not None and inicio > lectura[1]:
+                    pendientes.append(salida)
+                elif lectura is None or fin < lectura[0]:
+                    for rec, cant in envio.items():
+                        vistas[rec] = vistas.get(rec, 0) + cant
+            self._salidas = pendientes
+            if previos != recursos or vistas:
+                if previos:
+                    for rec in recursos.keys() | previos.keys():
+                        llegada = (
+                            recursos.get(rec, 0)
+                            - previos.get(rec, 0)
+                            + vistas.get(rec, 0)
+                        )
+                        if llegada > 0:
+                            self._conexion.execute(
+                                """
+                                INSERT INTO recepciones (recurso, unidades, observada)
+                                VALUES (?, ?, ?)
+                                """,
+                                (rec, llegada, ahora),
+                            )
+                self._conexion.execute("DELETE FROM recursos")
+                self._conexion.executemany(
+                    "INSERT INTO recursos (recurso, cantidad) VALUES (?, ?)",
+                    recursos.items(),
+                )
+            caducadas = self._conexion.execute(
+                f"""
+                UPDATE ofertas SET estado = 'caducada'
+                WHERE estado IN {_ABIERTAS + ("cobrada",)} AND actualizada < ?
+                """,
+                (ahora - self.ttl,),
+            ).rowcount
+            self._conexion.execute(
+                "DELETE FROM recepciones WHERE unidades = 0 OR observada < ?",
+                (ahora - self.ttl,),
+            )
+        if caducadas:
+            logger.info("%d oferta(s) caducada(s) sin respuesta.", caducadas)
+
+    def _llegadas(self, desde: float = 0.0) -> dict[str, int]:
+        """Unités non imputées par ressource, constatées depuis `desde`."""
+        return dict(
+            self._conexion.execute(
+                """
+                SELECT recurso, SUM(unidades) FROM recepciones
+                WHERE observada >= ? AND unidades > 0 GROUP BY recurso
+                """,
+                (desde,),
+            )
+        )
+
+    def _imputar(self, recibir: dict, desde: float) -> bool:
+        """Impute `recibir` aux arrivées constatées depuis `desde` (les plus
+        anciennes d'abord) si elles le couvrent."""
+        llegadas = self._llegadas(desde)
+        if any(llegadas.get(rec, 0) < cant for rec, cant in recibir.items()):
+            return False
+        for rec, cant in recibir.items():
+            for recepcion, unidades in self._conexion.execute(
+                """
+                SELECT id, unidades FROM recepciones
+                WHERE recurso = ? AND observada >= ? AND unidades > 0
+                ORDER BY observada, id
+                """,
+                (rec, desde),
+            ).fetchall():
+                tomadas = min(cant, unidades)
+                self._conexion.execute(
+                    "UPDATE recepciones SET unidades = unidades - ? WHERE id = ?",
+                    (tomadas, recepcion),
+                )
+                cant -= tomadas
+                if not cant:
+                    break
+        return True
+
+    def _cambiar(self, oferta: int, estado: str) -> None:
+        """Change l'état d'une offre ; une offre qui se met à attendre un
+        paquete (confirmada, enviada) ouvre sa fenêtre d'imputation."""
+        ahora = time.time()
+        self._conexion.execute(
+            """
+            UPDATE ofertas SET estado = ?1,
+                cierres = cierres + (?1 = 'cerrada'),
+                desde = CASE WHEN ?1 IN ('confirmada', 'enviada') AND estado != ?1
+                             THEN ?2 ELSE desde END,
+                actualizada = ?2
+            WHERE id = ?3
+            """,
+            (estado, ahora, oferta),
+        )
+
+    # ── Règlement ──────────────────────────────────────────────────────────────
+
+    def liquidar(
+        self, remi: str, recibido: dict, pedido: dict | None = None
+    ) -> Liquidacion | None:
+        """Rapproche une confirmation de `remi` d'une offre ouverte et la règle.
+
+        Args:
+            remi:     Expéditeur de la carta.
+            recibido: Ce que remi dit nous envoyer ({} : acceptation sans termes).
+            pedido:   Ce que remi attend de nous, s'il le dit.
+
+        Returns:
+            None si aucune offre ne correspond (règles puis LLM décident) ;
+            sinon 'aceptar' (paquete reçu : nous envoyons notre part),
+            'esperar' motivo paquete_pendiente (réglée à l'arrivée du paquete,
+            voir liquidables) ou motivo ya_pagado (nous avions payé d'abord).
+        """
+        with self._lock, self._conexion:
+            candidatas = [
+                (oferta, json.loads(envio), json.loads(recibir), estado, desde)
+                for oferta, envio, recibir, estado, desde in self._conexion.execute(
+                    f"""
+                    SELECT id, envio, recibir, estado, desde FROM ofertas
+                    WHERE contraparte = ? AND estado IN {_ABIERTAS}
+                    ORDER BY actualizada DESC
+                    """,
+                    (remi,),
+                )
+            ]
+            elegida = self._elegir(candidatas, recibido, pedido or {})
+            if elegida is None:
+                return None
+            oferta, envio, recibir, estado, desde = elegida
+            if estado == "enviada":
+                if self._imputar(recibir, desde):
+                    self._cambiar(oferta, "cerrada")
+                resultado = "ya_pagado"
+                decision = {"accion": "esperar", "motivo": resultado}
+            elif self._imputar(recibir, desde):
+                self._cambiar(oferta, "cobrada")
+                resultado = "aceptada"
+                decision = {
+                    "accion": "aceptar",
+                    "dest": remi,
+                    "envio": envio,
+                    "recibir": recibir,
+                }
+            else:
+                self._cambiar(oferta, "confirmada")
+                resultado = "paquete_pendiente"
+                decision = {"accion": "esperar", "motivo": resultado}
+        metricas.negociaciones_liquidadas_total.inc(resultado=resultado)
+        logger.info(
+            "Negociación #%d con '%s' (%s → %s): %s",
+            oferta,
+            remi,
+            envio,
+            recibir,
+            resultado,
+        )
+        return Liquidacion(oferta, decision)
+
+    def _elegir(
+        self, candidatas: list[tuple], recibido: dict, pedido: dict
+    ) -> tuple | None:
+        """L'offre que la confirmation désigne (la plus récente en cas d'égalité).
+
+        Avec des termes des deux côtés, seule une offre aux mêmes termes
+        convient (d'autres termes sont une contre-proposition, laissée aux
+        règles et au LLM). Avec seulement l'envoi annoncé : même recibir,
+        sinon un recibir couvert. Sans termes : l'unique offre ouverte, ou
+        l'unique dont le paquete est arrivé.
+        """
+        if pedido:
+            return next(
+                (c for c in candidatas if c[1] == pedido and c[2] == recibido), None
+            )
+        if recibido:
+            exactas = [c for c in candidatas if c[2] == recibido]
+            cubiertas = [
+                c
+                for c in candidatas
+                if all(recibido.get(r, 0) >= n for r, n in c[2].items())
+            ]
+            return (exactas or cubiertas or [None])[0]
+        if len(candidatas) == 1:
+            return candidatas[0]
+        cubiertas = []
+        for c in candidatas:
+            llegadas = self._llegadas(c[4])
+            if all(llegadas.get(r, 0) >= n for r, n in c[2].items()):
+                cubiertas.append(c)
+        return cubiertas[0] if len(cubiertas) == 1 else None
+
+    def liquidables(self) -> list[Liquidacion]:
+        """Règle les offres dont le paquete est arrivé dans leur fenêtre.
+
+        Les offres que nous avions payées d'abord (« enviada ») sont closes
+        en premier, pour que leur paquete ne soit pas imputé à une autre ;
+        puis chaque offre confirmée et couverte donne une décision 'aceptar'.
+        Les offres « cobrada » dont l'envoi a échoué sont reproposées.
+        """
+        liquidaciones = []
+        with self._lock, self._conexion:
+            filas = self._conexion.execute(
+                """
+                SELECT id, contraparte, envio, recibir, estado, desde FROM ofertas
+                WHERE estado IN ('enviada', 'confirmada', 'cobrada')
+                ORDER BY estado = 'confirmada', actualizada
+                """
+            ).fetchall()
+            for oferta, dest, envio, recibir, estado, desde in filas:
+                if estado == "cobrada":
+                    pass
+                elif not self._imputar(json.loads(recibir), desde):
+                    continue
+                elif estado == "enviada":
+                    self._cambiar(oferta, "cerrada")
+                    continue
+                else:
+                    self._cambiar(oferta, "cobrada")
+                    metricas.negociaciones_liquidadas_total.inc(resultado="aceptada")
+                liquidaciones.append(
+                    Liquidacion(
+                        oferta,
+                        {
+                            "accion": "aceptar",
+                            "dest": dest,
+                            "envio": json.loads(envio),
+                            "recibir": json.loads(recibir),
+                        },
+                    )
+                )
+        return liquidaciones
+
+    def cerrar(self, oferta: int, resultado: dict) -> None:
+        """Clôt une offre réglée selon le résultat de ejecutar_decision :
+        cerrada si notre part est partie, bloqueada si SOBRAN ne la couvre
+        plus ; inchangée (réessayée au poll suivant) si l'envoi a échoué."""
+        estado = {
+            "aceptado_y_enviado": "cerrada",
+            "envio_bloqueado": "bloqueada",
+        }.get(resultado.get("estado"))
+        if estado is None:
+            return
+        if estado == "bloqueada":
+            logger.warning(
+                "Negociación #%d: paquete recibido pero ya no podemos pagar.", oferta
+            )
+        with self._lock, self._conexion:
+            self._cambiar(oferta, estado)
+
+    # ── Consultation ───────────────────────────────────────────────────────────
+
+    def instantanea(self, limite: int = 50) -> dict:
+        """Offres par état, solde des llegadas non imputées et dernières offres
+        en cours de règlement."""
+        with self._lock:
+            por_estado = dict(
+                self._conexion.execute(
+                    "SELECT estado, COUNT(*) FROM ofertas GROUP BY estado"
+                )
+            )
+            cierres = self._conexion.execute(
+                "SELECT COALESCE(SUM(cierres), 0) FROM ofertas"
+            ).fetchone()[0]
+            en_curso = [
+                {
+                    "id": oferta,
+                    "contraparte": dest,
+                    "envio": json.loads(envio),
+                    "recibir": json.loads(recibir),
+                    "estado": estado,
+                    "origen": origen,
+                }
+                for oferta, dest, envio, recibir, estado, origen in self._conexion.execute(
+                    """
+                    SELECT id, contraparte, envio, recibir, estado, origen FROM ofertas
+                    WHERE estado IN ('confirmada', 'enviada', 'cobrada')
+                    ORDER BY actualizada DESC LIMIT ?
+                    """,
+                    (limite,),
+                )
+            ]
+            llegadas = {r: n for r, n in self._llegadas().items() if n}
+        return {
+            "por_estado": por_estado,
+            "cerradas": cierres,
+            "llegadas_sin_imputar": llegadas,
+            "en_curso": en_curso,
+        }
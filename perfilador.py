@@ -0,0 +1,86 @@
+"""
+perfilador.py — Profileur par échantillonnage des threads de l'agent.
+
+Sans dépendance et sans instrumenter le code : un thread relève à
+intervalle régulier la pile des threads ciblés (sys._current_frames) et
+compte, pour chaque fonction, les échantillons où elle est en tête de pile
+(temps propre) ou simplement présente (temps cumulé). Les piles complètes
+sont aussi agrégées au format « collapsed » (une ligne par pile, frames
+séparées par « ; ») lisible par les outils de flamegraph.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _etiqueta(frame) -> str:
+    codigo = frame.f_code
+    return f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}:{frame.f_lineno}"
+
+
+def _funcion(frame) -> str:
+    codigo = frame.f_code
+    return f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}"
+
+
+def perfilar(
+    hilos: list[threading.Thread] | None = None,
+    segundos: float = 10.0,
+    intervalo: float = 0.005,
+    top: int = 25,
+) -> dict:
+    """Échantillonne les threads ciblés pendant `segundos` et retourne le rapport.
+
+    Args:
+        hilos:     Threads à échantillonner.
+        segundos:  Durée de l'échantillonnage.
+        intervalo: Période d'échantillonnage (s).
+        top:       Nombre de fonctions et de piles retournées.
+
+    Returns:
+        {"segundos", "muestras", "por_hilo", "propio", "acumulado", "pilas"} :
+        les listes sont triées par nombre d'échantillons décroissant, avec
+        leur part du total.
+    """
+    ids = {h.ident for h in hilos or [] if h.ident is not None}
+    propio: Counter[str] = Counter()
+    acumulado: Counter[str] = Counter()
+    pilas: Counter[str] = Counter()
+    por_hilo: Counter[str] = Counter()
+    muestras = 0
+    yo = threading.get_ident()
+    fin = time.perf_counter() + segundos
+    while time.perf_counter() < fin:
+        nombres = {h.ident: h.name for h in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            nombre = nombres.get(ident, "")
+            if ident == yo or ident not in ids:
+                continue
+            pila = []
+            while frame is not None:
+                pila.append(frame)
+                frame = frame.f_back
+            muestras += 1
+            por_hilo[nombre.split("_")[0]] += 1
+            propio[_etiqueta(pila[0])] += 1
+            acumulado.update({_funcion(f) for f in pila})
+            pilas[";".join(_funcion(f) for f in reversed(pila))] += 1
+        time.sleep(intervalo)
+
+    def _tabla(contador: Counter) -> list[dict]:
+        return [
+            {"nombre": k, "muestras": v, "porcentaje": round(100 * v / muestras, 1)}
+            for k, v in contador.most_common(top)
+        ]
+
+    return {
+        "segundos": segundos,
+        "muestras": muestras,
+        "por_hilo": dict(por_hilo),
+        "propio": _tabla(propio) if muestras else [],
+        "acumulado": _tabla(acumulado) if muestras else [],
+        "pilas": [f"{k} {v}" for k, v in pilas.most_common(top)],
+    }
@@ -0,0 +1,210 @@
+"""
+planificador.py — Planificateur d'échanges en chaîne entre plusieurs agents.
+
+Un échange bilatéral échoue quand l'agent qui a ce qu'il nous faut veut
+quelque chose que nous n'avons pas. Le planificateur construit le graphe
+besoins/offres à partir des annonces du carnet d'ordres (mercado.py) et de
+notre FALTAN/SOBRAN, puis cherche pour chaque ressource manquante la chaîne
+la plus courte :
+
+    nous ← A1 ← A2 ← ... ← Ak ← nous
+
+où chaque agent cède au précédent une ressource que celui-ci a annoncé
+chercher, et où nous bouclons en donnant à Ak une ressource qu'il cherche
+(cycle) ou, à défaut, 3 oro par unité (l'oro sert de pont). Chaque étape est
+un paquete : la chaîne la plus courte est celle qui atteint l'objectif avec
+le moins de paquetes. À longueur égale, un cycle sans oro est préféré. Les
+échanges bilatéraux (2 paquetes), déjà couverts par les offres 1:1, oro et
+menu, ne sont pas retenus.
+
+Recherche en largeur depuis les fournisseurs de la ressource, chaque agent
+n'étant visité qu'une fois : O(agents + arcs) par chaîne trouvée, grâce aux
+index ressource → agents. Les quantités engagées par une chaîne sont
+déduites avant de chercher la suivante.
+"""
+
+from dataclasses import dataclass, field
+
+from config import CADENAS_MAX_PARTICIPANTES
+
+
+@dataclass
+class Paso:
+    """Un paquete de la chaîne : `de` envoie `recursos` à `para`."""
+
+    de: str
+    para: str
+    recursos: dict
+
+
+@dataclass
+class Plan:
+    """Chaîne d'échanges qui nous apporte `cantidad` unités de `recurso`.
+
+    Les pasos sont dans l'ordre du flux : notre envoi d'abord, la livraison
+    de `recurso` en dernier.
+    """
+
+    recurso: str
+    cantidad: int
+    pasos: list[Paso] = field(default_factory=list)
+
+    @property
+    def paquetes(self) -> int:
+        return len(self.pasos)
+
+    @property
+    def proveedor(self) -> str:
+        """L'agent qui nous livre `recurso`."""
+        return self.pasos[-1].de
+
+    @property
+    def participantes(self) -> list[str]:
+        """Les autres agents de la chaîne, dans l'ordre du flux."""
+        return [p.de for p in self.pasos[1:]]
+
+    def firma(self) -> tuple:
+        """Identité du plan (mêmes agents, mêmes ressources), pour les doublons."""
+        return tuple(
+            (p.de, p.para, tuple(sorted(p.recursos.items()))) for p in self.pasos
+        )
+
+
+def _indexar(anuncios: dict) -> dict[str, set[str]]:
+    """ressource → agents qui la cèdent."""
+    oferentes: dict[str, set[str]] = {}
+    for alias, anuncio in anuncios.items():
+        for rec, cant in anuncio["ofrece"].items():
+            if cant > 0:
+                oferentes.setdefault(rec, set()).add(alias)
+    return oferentes
+
+
+def _buscar(
+    recurso: str,
+    cantidad: int,
+    alias: str,
+    sobran: dict,
+    ofertas: dict,
+    necesidades: dict,
+    oferentes: dict,
+    max_participantes: int,
+    min_paquetes: int,
+) -> Plan | None:
+    """Chaîne la plus courte, d'au moins `min_paquetes` paquetes, qui nous
+    apporte jusqu'à `cantidad` de `recurso`."""
+    # Un chemin : ((agent, ressource qu'il cède au précédent), ...), quantité
+    frontera = [
+        (((a, recurso),), min(cantidad, ofertas[a][recurso]))
+        for a in sorted(oferentes.get(recurso, ()))
+        if a != alias and ofertas[a].get(recurso, 0) > 0
+    ]
+    visitados = {camino[0][0] for camino, _ in frontera}
+    oro = sobran.get("oro", 0)
+    mercancias = {k: v for k, v in sobran.items() if k != "oro" and v > 0}
+
+    for _ in range(max_participantes):
+        con_oro = None
+        siguiente = []
+        for camino, q in frontera:
+            ultimo = camino[-1][0]
+            necesita = necesidades.get(ultimo, {})
+            # Bouclage par une ressource que nous avons et qu'il cherche
+            cerrable = len(camino) + 1 >= min_paquetes
+            cierres = {
+                rec: min(q, cant, necesita[rec])
+                for rec, cant in mercancias.items()
+                if cerrable and necesita.get(rec, 0) > 0
+            }
+            if cierres:
+                rec = max(cierres, key=cierres.get)
+                return _construir(
+                    recurso, alias, camino, cierres[rec], {rec: cierres[rec]}
+                )
+            if con_oro is None and cerrable and oro >= 3:
+                con_oro = (camino, min(q, oro // 3))
+            for rec, cant in necesita.items():
+                if cant <= 0:
+                    continue
+                for otro in sorted(oferentes.get(rec, ())):
+                    disponible = ofertas[otro].get(rec, 0)
+                    if otro == alias or otro in visitados or disponible <= 0:
+                        continue
+                    visitados.add(otro)
+                    siguiente.append(
+                        (camino + ((otro, rec),), min(q, disponible, cant))
+                    )
+        if con_oro is not None:
+            camino, q = con_oro
+            return _construir(recurso, alias, camino, q, {"oro": 3 * q})
+        frontera = siguiente
+        if not frontera:
+            break
+    return None
+
+
+def _construir(recurso: str, alias: str, camino: tuple, q: int, cierre: dict) -> Plan:
+    """Plan du chemin (A1, ..., Ak) bouclé par notre envoi `cierre` à Ak."""
+    pasos = [Paso(alias, camino[-1][0], cierre)]
+    for i in range(len(camino) - 1, -1, -1):
+        de, rec = camino[i]
+        para = camino[i - 1][0] if i > 0 else alias
+        pasos.append(Paso(de, para, {rec: q}))
+    return Plan(recurso, q, pasos)
+
+
+def planificar(
+    alias: str,
+    faltan: dict,
+    sobran: dict,
+    anuncios: dict,
+    max_participantes: int = CADENAS_MAX_PARTICIPANTES,
+    min_paquetes: int = 3,
+) -> list[Plan]:
+    """Plans (cycles et chaînes) qui couvrent au mieux notre FALTAN.
+
+    Args:
+        alias:             Notre alias.
+        faltan, sobran:    Résultat de calcular_faltan_sobran.
+        anuncios:          {alias: {"necesita": {...}, "ofrece": {...}}}, par
+                           ex. LibroOrdenes.instantanea().
+        max_participantes: Nombre maximal d'autres agents dans une chaîne.
+        min_paquetes:      Longueur minimale d'un plan (3 : pas de bilatéral).
+
+    Returns:
+        Plans triés par nombre de paquetes ; chaque ressource, offre et
+        besoin n'y est engagé qu'une fois.
+    """
+    anuncios = {a: e for a, e in anuncios.items() if a != alias}
+    ofertas = {a: dict(e["ofrece"]) for a, e in anuncios.items()}
+    necesidades = {a: dict(e["necesita"]) for a, e in anuncios.items()}
+    oferentes = _indexar(anuncios)
+    sobran = {k: v for k, v in sobran.items() if v > 0}
+
+    planes = []
+    for recurso, cantidad in sorted(faltan.items()):
+        while cantidad > 0 and max_participantes > 0:
+            plan = _buscar(
+                recurso,
+                cantidad,
+                alias,
+                sobran,
+                ofertas,
+                necesidades,
+                oferentes,
+                max_participantes,
+                min_paquetes,
+            )
+            if plan is None or plan.cantidad <= 0:
+                break
+            for paso in plan.pasos:
+                origen = sobran if paso.de == alias else ofertas[paso.de]
+                for rec, cant in paso.recursos.items():
+                    origen[rec] -= cant
+                if paso.para != alias:
+                    for rec, cant in paso.recursos.items():
+                        if rec in necesidades[paso.para]:
+                            necesidades[paso.para][rec] -= cant
+            planes.append(plan)
+            cantidad -= plan.cantidad
+    return sorted(planes, key=lambda p: p.paquetes)
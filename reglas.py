@@ -0,0 +1,381 @@
+"""
+reglas.py — Moteur de décision déterministe (IA classique : fast-path avant le LLM).
+
+La plupart des cartas reçues suivent quelques gabarits connus (« te doy 1 de X
+a cambio de 1 de Y », « Compro 1 de X por 3 de oro », « Te envié: {...} »,
+« Acepto #v-n », « Acepto cadena #n »). Ce module les analyse par expressions régulières, décide
+directement contre FALTAN/SOBRAN et ne laisse passer au LLM que les cartas
+qu'il n'a pas su interpréter.
+
+Les décisions produites ont exactement le format de celles du LLM
+(accion/dest/envio/recibir/asunto/cuerpo) et passent par le même
+agent.ejecutar_decision, donc par le même filet validar_envio.
+"""
+
+import json
+import logging
+import re
+import threading
+import unicodedata
+
+from agent import calcular_faltan_sobran, validar_envio
+from config import ButlerState
+
+logger = logging.getLogger(__name__)
+
+
+# ── Analyse des gabarits ───────────────────────────────────────────────────────
+
+# Une liste de quantités : « 1 de piedra y 2 de queso », « 3 oro », « 1 tela ».
+_CANTIDAD = re.compile(r"(\d+)\s+(?:de\s+)?([a-z_]+)")
+_JSON_PLANO = r"(\{[^{}]*\})"
+
+# Gabarits de proposition : (regex, groupe de ce que l'expéditeur OFFRE, groupe
+# de ce qu'il DEMANDE). Les plus spécifiques d'abord.
+_PLANTILLAS_PROPUESTA: list[tuple[re.Pattern, str, str]] = [
+    (
+        re.compile(r"yo te doy (?P<a>[^.\n]+?) y tu me das (?P<b>[^.\n]+)"),
+        "a",
+        "b",
+    ),
+    (
+        re.compile(
+            r"intercambiar (?P<b>[^.\n]+?) que necesito por (?P<a>[^.\n]+?) que te ofrezco"
+        ),
+        "a",
+        "b",
+    ),
+    (
+        re.compile(r"\bmi (?P<a>\d+ [^.\n]+?) por tu (?P<b>\d+ [^.\n]+)"),
+        "a",
+        "b",
+    ),
+    (
+        re.compile(r"te doy (?P<a>[^.\n]+?) a cambio de (?P<b>[^.\n]+)"),
+        "a",
+        "b",
+    ),
+    (
+        re.compile(r"compro (?P<b>[^.\n]+?) (?:a cambio de|por) (?P<a>[^.\n]+)"),
+        "a",
+        "b",
+    ),
+    (
+        re.compile(r"necesito (?P<b>[^.\n]+?)\.?\s*a cambio te ofrezco (?P<a>[^.\n]+)"),
+        "a",
+        "b",
+    ),
+    (
+        re.compile(r"podria cambiar (?P<a>[^.\n]+?) por (?P<b>[^.\n]+)"),
+        "a",
+        "b",
+    ),
+]
+_CONFIRMACION_ENVIO = re.compile(r"te envie:?\s*" + _JSON_PLANO)
+_CONFIRMACION_ESPERA = re.compile(r"espero recibir:?\s*" + _JSON_PLANO)
+# Note ajoutée par expandir_referencias_menu, lue sur le texte brut (le JSON
+# garde sa casse et ses accents)
+_REFERENCIA_MENU = re.compile(
+    r"referencia a tu oferta #\d+-\d+: t[uú] env[ií]as "
+    + _JSON_PLANO
+    + r" y recibes "
+    + _JSON_PLANO,
+    re.IGNORECASE,
+)
+# Note ajoutée par expandir_referencias_cadena, lue sur le texte brut (alias)
+_REFERENCIA_CADENA = re.compile(
+    r"referencia a tu cadena #(\d+): tu envias "
+    + _JSON_PLANO
+    + r" a (\S+) y recibes "
+    + _JSON_PLANO,
+    re.IGNORECASE,
+)
+_CADENA = re.compile(r"\bcadena #\d+")
+_ACEPTACION = re.compile(r"\b(acepto|aceptamos|trato hecho|de acuerdo|confirmo)\b")
+_CITAS = re.compile(r"'[^']*'|\"[^\"]*\"|«[^»]*»")
+
+
+def _normalizar(texto: str) -> str:
+    """Minuscules et suppression des accents (« Envié » → « envie »)."""
+    sin_acentos = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in sin_acentos if not unicodedata.combining(c)).lower()
+
+
+def _parsear_cantidades(fragmento: str) -> dict:
+    """Extrait {ressource: quantité} d'un fragment comme « 1 de piedra y 2 queso »."""
+    cantidades: dict[str, int] = {}
+    for cant, rec in _CANTIDAD.findall(fragmento):
+        cantidades[rec] = cantidades.get(rec, 0) + int(cant)
+    return cantidades
+
+
+def _parsear_json(fragmento: str) -> dict:
+    """Parse un objet JSON plat {ressource: quantité} ; {} s'il est invalide."""
+    try:
+        datos = json.loads(fragmento)
+    except json.JSONDecodeError:
+        return {}
+    return {k: v for k, v in datos.items() if isinstance(v, int) and v > 0}
+
+
+def _sumar(a: dict, b: dict) -> dict:
+    return {k: a.get(k, 0) + b.get(k, 0) for k in a.keys() | b.keys()}
+
+
+def parsear_carta(carta: dict) -> dict | None:
+    """Reconnaît le gabarit d'une carta et en extrait les termes de l'échange.
+
+    Les termes sont exprimés du point de vue de l'expéditeur :
+    - 'ofrece' : ce qu'il nous donne (ou nous a déjà envoyé)
+    - 'pide'   : ce qu'il attend de nous
+
+    Args:
+        carta: La carta reçue (remi, asunto, cuerpo).
+
+    Returns:
+        {"tipo": "sistema"} pour une notification système,
+        {"tipo": "cadena"} pour une carta sur une chaîne qui ne demande rien,
+        {"tipo": "confirmacion"|"propuesta", "ofrece": {...}, "pide": {...}}
+        pour un gabarit reconnu (plus "dest" et le numéro de "cadena" quand
+        notre part va au dernier maillon d'une de nos chaînes), ou None si la
+        carta n'est pas interprétable.
+    """
+    if (carta.get("remi") or "").lower() == "sistema":
+        return {"tipo": "sistema"}
+
+    texto = _normalizar(f"{carta.get('asunto', '')}\n{carta.get('cuerpo', '')}")
+
+    # Acceptation d'une de nos chaînes par son fournisseur (note ajoutée par
+    # expandir_referencias_cadena) : notre part va au dernier maillon.
+    cadena = _REFERENCIA_CADENA.search(carta.get("cuerpo", ""))
+    if cadena:
+        pide, ofrece = _parsear_json(cadena.group(2)), _parsear_json(cadena.group(4))
+        if pide and ofrece and _ACEPTACION.search(_CITAS.sub("", texto)):
+            return {
+                "tipo": "confirmacion",
+                "ofrece": ofrece,
+                "pide": pide,
+                "dest": cadena.group(3),
+                "cadena": int(cadena.group(1)),
+            }
+        return None
+    # Acceptation d'un autre maillon, ou chaîne proposée par un autre agent
+    if _CADENA.search(texto):
+        return {"tipo": "cadena"}
+
+    # Acceptation d'une ligne de nos menus (termes ajoutés par expandir_referencias_menu)
+    referencias = _REFERENCIA_MENU.findall(carta.get("cuerpo", ""))
+    if referencias and _ACEPTACION.search(_CITAS.sub("", texto)):
+        pide, ofrece = {}, {}
+        for envio, recibir in referencias:
+            pide = _sumar(pide, _parsear_json(envio))
+            ofrece = _sumar(ofrece, _parsear_json(recibir))
+        if pide and ofrece:
+            return {"tipo": "confirmacion", "ofrece": ofrece, "pide": pide}
+        return None
+
+    # Confirmation d'envoi : « Te envié: {...}. Espero recibir: {...} »
+    envio = _CONFIRMACION_ENVIO.search(texto)
+    if envio:
+        espera = _CONFIRMACION_ESPERA.search(texto)
+        ofrece = _parsear_json(envio.group(1))
+        pide = _parsear_json(espera.group(1)) if espera else {}
+        if ofrece and pide:
+            return {"tipo": "confirmacion", "ofrece": ofrece, "pide": pide}
+        return None  # on ne sait pas ce qui a été promis : au LLM de juger
+
+    # Une acceptation hors citation accompagnée d'un gabarit de proposition est
+    # ambiguë (l'expéditeur cite peut-être NOTRE offre) : au LLM de juger.
+    if _ACEPTACION.search(_CITAS.sub("", texto)):
+        return None
+
+    for patron, grupo_ofrece, grupo_pide in _PLANTILLAS_PROPUESTA:
+        m = patron.search(texto)
+        if m:
+            ofrece = _parsear_cantidades(m.group(grupo_ofrece))
+            pide = _parsear_cantidades(m.group(grupo_pide))
+            if ofrece and pide:
+                return {"tipo": "propuesta", "ofrece": ofrece, "pide": pide}
+    return None
+
+
+def terminos_confirmacion(carta: dict) -> tuple[dict, dict] | None:
+    """Termes d'une confirmation : ce que l'expéditeur dit nous envoyer et
+    ce qu'il attend de nous.
+
+    Returns:
+        (recibido, pedido) : termes d'une ligne de menu citée ou de « Te
+        envié: {...}. Espero recibir: {...} » ; pedido vaut {} quand seul
+        l'envoi est annoncé, et les deux valent {} pour une acceptation sans
+        termes (« Intercambio aceptado », « Acepto »). None si la carta
+        n'est pas une confirmation (ou confirme une chaîne, réglée par
+        RegistroCadenas).
+    """
+    terminos = parsear_carta(carta)
+    if terminos is not None:
+        if terminos["tipo"] != "confirmacion" or "dest" in terminos:
+            return None
+        return terminos["ofrece"], terminos["pide"]
+    texto = _normalizar(f"{carta.get('asunto', '')}\n{carta.get('cuerpo', '')}")
+    if _CADENA.search(texto):
+        return None
+    envio = _CONFIRMACION_ENVIO.search(texto)
+    if envio:
+        recibido = _parsear_json(envio.group(1))
+        return (recibido, {}) if recibido else None
+    if "intercambio aceptado" in texto or _ACEPTACION.search(_CITAS.sub("", texto)):
+        return {}, {}
+    return None
+
+
+# ── Moteur de décision ─────────────────────────────────────────────────────────
+
+
+def _formatear(recursos: dict) -> str:
+    return " y ".join(f"{v} de {k}" for k, v in recursos.items())
+
+
+def _contrapropuesta(faltan: dict, sobran: dict, ofrece: dict) -> dict | None:
+    """Contre-offre pour les ressources de FALTAN proposées par l'expéditeur.
+
+    Paie en oro (3 par unité) si possible, sinon 1:1 avec le plus gros SOBRAN.
+    """
+    interesa = {
+        rec: min(cant, faltan[rec]) for rec, cant in ofrece.items() if rec in faltan
+    }
+    if not interesa:
+        return None
+    unidades = sum(interesa.values())
+    if sobran.get("oro", 0) >= 3 * unidades:
+        dar = {"oro": 3 * unidades}
+    else:
+        candidatos = {k: v for k, v in sobran.items() if k != "oro" and v >= unidades}
+        if not candidatos:
+            return None
+        dar = {max(candidatos, key=candidatos.get): unidades}
+    return {"dar": dar, "recibir": interesa}
+
+
+def decidir(
+    estado: ButlerState, tipo_y_terminos: dict, remi: str, en_cooldown: bool
+) -> dict:
+    """Applique les règles de décision du prompt LLM à des termes déjà extraits.
+
+    Mêmes priorités que construir_prompt_nueva_carta :
+    1. Sistema (ou chaîne sans part à envoyer) → esperar
+    2. Acceptation d'une de nos chaînes dont notre part est dans SOBRAN →
+       aceptar ; toute autre confirmation → esperar (les confirmations de
+       nos offres sont réglées avant, par negociaciones.py, une fois le
+       paquete reçu : une confirmation seule ne prouve aucun envoi)
+    3/4. Proposition qui demande du SOBRAN et donne quelque chose → aceptar
+         (en cooldown : 'ofrecer' reprenant les mêmes termes)
+    5. Proposition qui offre du FALTAN mais demande autre chose → ofrecer
+    6. Sinon → esperar
+
+    Args:
+        estado:          État courant de l'agent.
+        tipo_y_terminos: Résultat de parsear_carta (non None).
+        remi:            Expéditeur de la carta.
+        en_cooldown:     Si True, ne pas accepter une nouvelle proposition.
+
+    Returns:
+        Décision au format LLM.
+    """
+    if tipo_y_terminos["tipo"] in ("sistema", "cadena"):
+        return {"accion": "esperar"}
+
+    faltan, sobran = calcular_faltan_sobran(estado.Recursos, estado.Objetivo)
+    ofrece, pide = tipo_y_terminos["ofrece"], tipo_y_terminos["pide"]
+    envio_posible = validar_envio(pide, estado)
+    cubre_pedido = envio_posible == pide
+
+    if tipo_y_terminos["tipo"] == "confirmacion":
+        if "dest" not in tipo_y_terminos:
+            return {"accion": "esperar", "motivo": "confirmacion_desconocida"}
+        if cubre_pedido:
+            return {
+                "accion": "aceptar",
+                "dest": tipo_y_terminos["dest"],
+                "envio": pide,
+                "recibir": ofrece,
+                "cadena": tipo_y_terminos["cadena"],
+            }
+        return {"accion": "esperar"}
+
+    if cubre_pedido and not en_cooldown:
+        return {"accion": "aceptar", "dest": remi, "envio": pide, "recibir": ofrece}
+    if cubre_pedido:
+        contra = {"dar": pide, "recibir": ofrece}
+    else:
+        contra = _contrapropuesta(faltan, sobran, ofrece)
+    if contra:
+        return {
+            "accion": "ofrecer",
+            "dest": remi,
+            "asunto": "Propuesta de intercambio",
+            "cuerpo": (
+                f"Te propongo: te doy {_formatear(contra['dar'])} "
+                f"a cambio de {_formatear(contra['recibir'])}."
+            ),
+            "envio": contra["dar"],
+            "recibir": contra["recibir"],
+        }
+    return {"accion": "esperar"}
+
+
+# ── Point d'entrée et statistiques ─────────────────────────────────────────────
+
+
+class EstadisticasReglas:
+    """Taux de résolution du fast-path d'un slot (un registre par runtime)."""
+
+    def __init__(self) -> None:
+        self.cartas = 0
+        self.resueltas = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, resuelta: bool) -> None:
+        with self._lock:
+            self.cartas += 1
+            self.resueltas += resuelta
+
+    def estadisticas(self) -> dict:
+        """Taux de résolution du fast-path et nombre d'appels LLM évités."""
+        with self._lock:
+            cartas, resueltas = self.cartas, self.resueltas
+        return {
+            "cartas": cartas,
+            "llamadas_llm_evitadas": resueltas,
+            "llamadas_llm": cartas - resueltas,
+            "tasa_acierto": resueltas / cartas if cartas else 0.0,
+        }
+
+
+def decidir_carta(
+    estado: ButlerState,
+    carta: dict,
+    en_cooldown: bool = False,
+    estadisticas: EstadisticasReglas | None = None,
+) -> dict | None:
+    """Tente de décider une carta sans LLM.
+
+    Args:
+        estado:       État courant de l'agent.
+        carta:        La carta reçue.
+        en_cooldown:  Si True, ne pas accepter immédiatement une proposition.
+        estadisticas: Registre du slot où compter la carta (aucun si None).
+
+    Returns:
+        La décision au format LLM, ou None si la carta doit passer par le LLM.
+    """
+    terminos = parsear_carta(carta)
+    decision = (
+        decidir(estado, terminos, carta.get("remi", ""), en_cooldown)
+        if terminos
+        else None
+    )
+    if estadisticas is not None:
+        estadisticas.registrar(decision is not None)
+    if decision is not None:
+        logger.info("Fast-path (%s) → %s", terminos["tipo"], decision)
+    return decision
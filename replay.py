@@ -0,0 +1,294 @@
+"""
+replay.py — Rejeu de décisions LLM enregistrées (latence et qualité).
+
+Rejoue des paires (état, carta) enregistrées à travers
+construir_prompt_nueva_carta + consultar_ollama, contre le vrai Ollama ou
+contre le faux Ollama du simulateur (latence configurable), et rapporte :
+
+- les latences de décision p50 / p95 / p99 ;
+- le taux de repli « JSON invalide » ;
+- l'accord avec une décision de référence (celle enregistrée, ou celle
+  d'un rejeu précédent sauvegardé avec --salida).
+
+Sources de cas acceptées :
+- les JSONL produits par llm.grabar_decision (FDI_PLN__LLM_GRABACION) ou
+  par --salida ;
+- les anciens logs texte de logs/ : blocs « NUEVA CARTA » du polling (avec
+  la DECISIÓN prise) et buzón des appels /generate (sans référence).
+  Ces logs n'enregistrent l'état qu'aux appels /generate : chaque carta du
+  polling est rejouée avec le dernier état enregistré avant elle.
+
+Usage :
+    python replay.py logs/*.log --modelo qwen2.5-coder:1.5b
+    python replay.py grabacion.jsonl --mock-latencia 0.3 --salida rejeu.jsonl
+"""
+
+import argparse
+import ast
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import Counter
+
+import httpx
+
+import llm
+from config import ButlerState
+
+logger = logging.getLogger(__name__)
+
+
+# ── Chargement des cas ─────────────────────────────────────────────────────────
+
+_LLAMADA_GENERATE = re.compile(
+    r"^ALIAS: (?P<alias>[^\n]*)\nRECURSOS: (?P<recursos>\{[^\n]*\})\n"
+    r"OBJETIVO: (?P<objetivo>\{[^\n]*\})\n"
+    r"BUZON: (?P<buzon>\{.*?\n\})\n",
+    re.MULTILINE | re.DOTALL,
+)
+_NUEVA_CARTA = re.compile(
+    r"^====== NUEVA CARTA \[[^\]]*\] ======\n"
+    r"DE: (?P<remi>[^\n]*?) \| ASUNTO: (?P<asunto>[^\n]*)\n"
+    r"CUERPO: (?P<cuerpo>.*?)\n\n===== CONSULTANDO OLLAMA =====\n"
+    r".*?^DECISIÓN: (?P<decision>\{[^\n]*\})$",
+    re.MULTILINE | re.DOTALL,
+)
+
+
+def _casos_log(
+    texto: str, estado: ButlerState | None
+) -> tuple[list[dict], ButlerState | None]:
+    """Extrait les cas d'un log texte, dans l'ordre, en suivant le dernier état vu."""
+    eventos = [(m.start(), "generate", m) for m in _LLAMADA_GENERATE.finditer(texto)]
+    eventos += [(m.start(), "carta", m) for m in _NUEVA_CARTA.finditer(texto)]
+    casos = []
+    for _, tipo, m in sorted(eventos, key=lambda e: e[0]):
+        if tipo == "generate":
+            buzon = json.loads(m.group("buzon"))
+            estado = ButlerState(
+                Alias=m.group("alias"),
+                Recursos=ast.literal_eval(m.group("recursos")),
+                Objetivo=ast.literal_eval(m.group("objetivo")),
+            )
+            casos += [
+                {
+                    "estado": estado,
+                    "carta": carta,
+                    "en_cooldown": False,
+                    "referencia": None,
+                }
+                for carta in buzon.values()
+                if carta.get("remi") != "Sistema"
+            ]
+        elif estado is not None:
+            carta = {k: m.group(k) for k in ("remi", "asunto", "cuerpo")}
+            casos.append(
+                {
+                    "estado": estado,
+                    "carta": {**carta, "dest": estado.Alias},
+                    "en_cooldown": False,
+                    "referencia": ast.literal_eval(m.group("decision")),
+                }
+            )
+    return casos, estado
+
+
+def _casos_jsonl(texto: str) -> list[dict]:
+    casos = []
+    for linea in texto.splitlines():
+        if not linea.strip():
+            continue
+        datos = json.loads(linea)
+        casos.append(
+            {
+                "estado": ButlerState(**datos["estado"]),
+                "carta": datos["carta"],
+                "en_cooldown": datos.get("en_cooldown", False),
+                "referencia": datos.get("decision"),
+            }
+        )
+    return casos
+
+
+def cargar_casos(rutas: list[str]) -> list[dict]:
+    """Charge les cas {"estado", "carta", "en_cooldown", "referencia"} des fichiers.
+
+    Les fichiers .jsonl sont lus ligne à ligne ; les autres sont traités comme
+    des logs texte, dans l'ordre donné (l'état se propage d'un log au suivant).
+    """
+    casos: list[dict] = []
+    estado = None
+    for ruta in rutas:
+        with open(ruta, encoding="utf-8") as f:
+            texto = f.read()
+        if ruta.endswith(".jsonl"):
+            casos += _casos_jsonl(texto)
+        else:
+            nuevos, estado = _casos_log(texto, estado)
+            casos += nuevos
+    return casos
+
+
+def cargar_referencias(ruta: str) -> list[dict]:
+    """Décisions d'un rejeu précédent (fichier --salida), dans l'ordre des cas."""
+    with open(ruta, encoding="utf-8") as f:
+        return [json.loads(linea)["decision"] for linea in f if linea.strip()]
+
+
+# ── Rejeu et mesures ───────────────────────────────────────────────────────────
+
+
+def percentil(valores: list[float], p: float) -> float:
+    """Percentile par rang le plus proche (valores déjà trié, non vide)."""
+    rango = max(0, min(len(valores) - 1, round(p / 100 * len(valores) + 0.5) - 1))
+    return valores[rango]
+
+
+def misma_decision(a: dict, b: dict) -> bool:
+    """Deux décisions concordent : même action, même destinataire, mêmes termes."""
+    if a.get("accion") != b.get("accion"):
+        return False
+    if a.get("accion") == "esperar":
+        return True
+    if a.get("dest") != b.get("dest"):
+        return False
+    if a.get("accion") == "aceptar":
+        return a.get("envio") == b.get("envio")
+    return True
+
+
+def rejugar(casos: list[dict], sistema: str = llm.PROMPT_SISTEMA) -> list[dict]:
+    """Rejoue chaque cas contre le LLM configuré (llm.OLLAMA_URL / llm.MODEL).
+
+    Le cache de décisions est contourné : chaque cas est un appel LLM. Les
+    cas sont joués l'un après l'autre sur une même connexion.
+
+    Returns:
+        Pour chaque cas : {"decision", "latencia", "referencia"}.
+    """
+    return asyncio.run(_rejugar(casos, sistema))
+
+
+async def _rejugar(casos: list[dict], sistema: str) -> list[dict]:
+    resultados = []
+    async with httpx.AsyncClient() as http:
+        for i, caso in enumerate(casos, start=1):
+            resultados.append(await _rejugar_caso(http, caso, sistema, i, len(casos)))
+    return resultados
+
+
+async def _rejugar_caso(
+    http: httpx.AsyncClient, caso: dict, sistema: str, i: int, total: int
+) -> dict:
+    prompt = llm.construir_prompt_nueva_carta(
+        caso["estado"], caso["carta"], en_cooldown=caso["en_cooldown"]
+    )
+    inicio = time.perf_counter()
+    try:
+        decision = await llm.consultar_ollama(prompt, sistema, http)
+    except httpx.HTTPError as e:
+        logger.error("Cas %d : erreur LLM %s", i, e)
+        decision = {"accion": "esperar", "motivo": "error"}
+    latencia = time.perf_counter() - inicio
+    logger.info("Cas %d/%d : %.2fs → %s", i, total, latencia, decision)
+    return {
+        "decision": decision,
+        "latencia": latencia,
+        "referencia": caso["referencia"],
+    }
+
+
+def resumir(resultados: list[dict]) -> dict:
+    """Latences p50/p95/p99, taux de JSON invalide et accord avec la référence."""
+    if not resultados:
+        return {"casos": 0}
+    latencias = sorted(r["latencia"] for r in resultados)
+    con_referencia = [r for r in resultados if r["referencia"] is not None]
+    acuerdos = sum(
+        misma_decision(r["decision"], r["referencia"]) for r in con_referencia
+    )
+    invalidos = sum(r["decision"].get("motivo") == "json_invalido" for r in resultados)
+    return {
+        "casos": len(resultados),
+        "latencia_p50_s": round(percentil(latencias, 50), 3),
+        "latencia_p95_s": round(percentil(latencias, 95), 3),
+        "latencia_p99_s": round(percentil(latencias, 99), 3),
+        "tasa_json_invalido": round(invalidos / len(resultados), 3),
+        "con_referencia": len(con_referencia),
+        "tasa_acuerdo": round(acuerdos / len(con_referencia), 3)
+        if con_referencia
+        else None,
+        "acciones": dict(Counter(r["decision"].get("accion") for r in resultados)),
+        "ollama": llm.estadisticas_ollama(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("fuentes", nargs="+", help="logs texte ou JSONL de cas")
+    parser.add_argument("--modelo", help=f"modèle Ollama (défaut : {llm.MODEL})")
+    parser.add_argument("--url", help=f"URL /api/chat (défaut : {llm.OLLAMA_URL})")
+    parser.add_argument(
+        "--mock-latencia",
+        type=float,
+        help="rejoue contre le faux Ollama du simulateur avec cette latence (s)",
+    )
+    parser.add_argument("--sistema", help="fichier remplaçant le prompt système")
+    parser.add_argument("--referencia", help="JSONL --salida d'un rejeu de référence")
+    parser.add_argument("--salida", help="écrit les décisions rejouées (JSONL)")
+    parser.add_argument("--limite", type=int, help="nombre maximal de cas")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    casos = cargar_casos(args.fuentes)[: args.limite]
+    if args.referencia:
+        for caso, referencia in zip(casos, cargar_referencias(args.referencia)):
+            caso["referencia"] = referencia
+    if args.modelo:
+        llm.MODEL = args.modelo
+    if args.url:
+        llm.OLLAMA_URL = args.url
+    sistema = llm.PROMPT_SISTEMA
+    if args.sistema:
+        with open(args.sistema, encoding="utf-8") as f:
+            sistema = f.read()
+
+    servidor = None
+    if args.mock_latencia is not None:
+        from simulador import MundoSimulado, ServidorSimulado
+
+        servidor = ServidorSimulado(MundoSimulado(), args.mock_latencia)
+        llm.OLLAMA_URL = f"{servidor.iniciar()}/api/chat"
+    try:
+        resultados = rejugar(casos, sistema)
+    finally:
+        if servidor is not None:
+            servidor.detener()
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            for caso, r in zip(casos, resultados):
+                f.write(
+                    json.dumps(
+                        {
+                            "estado": caso["estado"].model_dump(exclude={"Buzon"}),
+                            "carta": caso["carta"],
+                            "en_cooldown": caso["en_cooldown"],
+                            "decision": r["decision"],
+                            "latencia": round(r["latencia"], 3),
+                            "modelo": llm.MODEL,
+                        },
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                )
+    resumen = resumir(resultados)
+    resumen["modelo"] = llm.MODEL if args.mock_latencia is None else "mock"
+    print(json.dumps(resumen, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
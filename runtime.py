@@ -0,0 +1,851 @@
+"""
+runtime.py — Exécution asynchrone de l'agent : polling, traitement des cartas, broadcasts.
+
+Tout tourne dans une seule boucle d'événements, celle de FastAPI :
+- une tâche de polling (AgenteRuntime.bucle) attend la prochaine échéance
+  ou un réveil de /notify, détecte les nouvelles cartas et les traite ;
+- les cartas d'un lot sont décidées en tâches concurrentes (une par
+  expéditeur), les broadcasts envoient leurs cartas de même ;
+- les endpoints appellent les mêmes coroutines (broadcast manuel...).
+
+Butler et Ollama sont interrogés par des clients httpx asynchrones : une
+attente réseau ne bloque que la tâche concernée. L'état mutable de l'agent
+(cooldown, buzón, latences, carnet d'ordres, menus et chaînes proposés,
+mémoire des négociations, cache LLM) appartient à l'instance AgenteRuntime et n'est modifié que
+depuis la boucle ; les broadcasts sont sérialisés par un asyncio.Lock, si
+bien qu'un broadcast manuel ne s'entrelace plus avec le périodique ou le
+re-broadcast post-acceptation.
+
+Multi-slot : un Anfitrion héberge un AgenteRuntime par slot (AGENTE_SLOTS)
+dans la même boucle. Les slots ne partagent aucun état de négociation, mais
+partagent le pool de connexions vers Butler et la file des requêtes LLM
+(llm.ColaLLM), qui borne la charge envoyée à Ollama pour tout le processus.
+
+Arrêt structuré : detener() annule la tâche de polling, ce qui annule les
+tâches filles (TaskGroup) en cours, puis ferme les clients HTTP. Une carta
+interrompue n'est pas marquée traitée : elle reste pendiente dans le
+checkpoint du buzón et sera reprise au redémarrage.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import httpx
+
+import agent
+import butler
+import buzon
+import llm
+import mercado
+import metricas
+import reglas
+import trazas
+from butler import ButlerClient
+from config import (
+    ACCEPT_COOLDOWN,
+    AGENTE_SLOTS,
+    BROADCAST_INTERVAL,
+    BROADCAST_MODO,
+    BUTLER_BASE_URL,
+    BUTLER_POOL_SIZE,
+    CARTAS_MAX_WORKERS,
+    LLM_AGRUPAR,
+    POLL_BACKOFF,
+    POLL_INTERVAL_MAX,
+    POLL_INTERVAL_MIN,
+)
+from negociaciones import Liquidacion, Negociaciones, ruta_negociaciones
+
+logger = logging.getLogger(__name__)
+
+
+def _urgencia(cartas: list[tuple[str, dict]]) -> tuple:
+    """Clé de tri d'un groupe : priorité de sa carta la plus urgente, puis fecha."""
+    if not cartas:
+        return (len(llm.PRIORIDAD_TIPO), "")
+    return (
+        min(
+            llm.PRIORIDAD_TIPO.get(llm.clasificar_carta(c), len(llm.PRIORIDAD_TIPO))
+            for _, c in cartas
+        ),
+        cartas[0][1].get("fecha") or "",
+    )
+
+
+class AgenteRuntime:
+    """Un agent (slot) en cours d'exécution : ses clients, son buzón, sa
+    mémoire de négociation et sa boucle de polling.
+
+    Args:
+        cliente:         Client Butler (fermé par detener()).
+        sincronizador:   Synchroniseur du buzón (checkpoint du slot si None).
+        cola:            File des requêtes LLM, partagée entre slots (créée si
+                         None ; seule une file créée ici est fermée par detener()).
+        accept_cooldown: Attente (s) avant d'accepter après un broadcast d'offres.
+        libro:           Carnet d'ordres (vide, MERCADO_TTL, si None).
+        agrupar:         Un appel LLM par expéditeur et par lot (LLM_AGRUPAR) ;
+                         False : un appel par carta.
+        negociaciones:   Mémoire des négociations (base SQLite du slot si None).
+    """
+
+    def __init__(
+        self,
+        cliente: ButlerClient,
+        sincronizador: buzon.SincronizadorBuzon | None = None,
+        cola: llm.ColaLLM | None = None,
+        accept_cooldown: float = ACCEPT_COOLDOWN,
+        libro: mercado.LibroOrdenes | None = None,
+        agrupar: bool = LLM_AGRUPAR,
+        negociaciones: Negociaciones | None = None,
+    ) -> None:
+        self.cliente = cliente
+        self.slot = cliente.slot
+        self.sincronizador = sincronizador or buzon.SincronizadorBuzon(
+            buzon.ruta_checkpoint(self.slot)
+        )
+        self._cola_propia = cola is None
+        self.cola = cola or llm.ColaLLM()
+        self.accept_cooldown = accept_cooldown
+        self.libro = libro or mercado.LibroOrdenes()
+        self.menus = agent.RegistroMenus()
+        self.cadenas = agent.RegistroCadenas()
+        self.cache = llm.CacheDecisiones()
+        self.estadisticas_reglas = reglas.EstadisticasReglas()
+        self.negociaciones = negociaciones or Negociaciones(
+            ruta_negociaciones(self.slot)
+        )
+        self.agrupar = agrupar
+        self.cooldown_hasta: float = 0.0  # Timestamp : n'accepte pas avant cette heure
+        self.despertar = asyncio.Event()  # Levé par /notify : poll immédiat du buzón
+        self.latencias: deque[tuple[float, float]] = deque(
+            maxlen=500
+        )  # (depuis fecha, depuis détection)
+        self.hilo: threading.Thread | None = None  # Thread de la boucle (perfilador)
+        self._tarea: asyncio.Task | None = None
+        self._lock_broadcast = asyncio.Lock()
+
+    # ── Cycle de vie ───────────────────────────────────────────────────────────
+
+    @property
+    def activo(self) -> bool:
+        """La tâche de polling tourne-t-elle ?"""
+        return self._tarea is not None and not self._tarea.done()
+
+    def iniciar(self) -> None:
+        """Lance la tâche de polling dans la boucle courante."""
+        self.hilo = threading.current_thread()
+        self._tarea = asyncio.create_task(self.bucle(), name=f"polling-{self.slot}")
+
+    async def detener(self) -> None:
+        """Annule la tâche de polling (et ses tâches filles), puis ferme les clients."""
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        await self.cerrar()
+
+    async def cerrar(self) -> None:
+        """Ferme le client Butler et la file LLM (sauf s'ils sont partagés),
+        puis la base des négociations."""
+        await self.cliente.close()
+        self.negociaciones.close()
+        if self._cola_propia:
+            await self.cola.cerrar()
+
+    # ── Broadcasts ─────────────────────────────────────────────────────────────
+
+    async def broadcast_completo(self) -> agent.ResumenEnvio:
+        """Exécute le cycle complet de broadcast : général + offres 1:1 et achats oro.
+
+        En mode BROADCAST_MODO="menu", les offres 1:1 et oro sont regroupées en
+        une seule carta menu par agent ; en mode "detallado", une carta par offre.
+        Les chaînes à plusieurs agents du planificateur sont proposées ensuite.
+
+        Récupère l'état et la liste des agents UNE SEULE FOIS, puis délègue
+        aux fonctions de broadcast dans agent.py. Met à jour le cooldown
+        après le broadcast 1:1 pour éviter les sur-engagements de ressources.
+        Un seul broadcast à la fois : un appel concurrent attend la fin du
+        précédent.
+
+        Returns:
+            ResumenEnvio cumulé des broadcasts (cartas envoyées / échouées).
+        """
+        c = self.cliente
+        trazas.slot_actual.set(self.slot)
+        async with self._lock_broadcast:
+            with metricas.broadcast_segundos.medir(), trazas.span("broadcast"):
+                estado = await c.obtener_estado()
+                otros = await c.obtener_otros_agentes(estado.Alias)
+
+                resumen = await agent.hacer_broadcast_general(estado, otros, c)
+                if BROADCAST_MODO == "menu":
+                    resumen.agregar(
+                        await agent.hacer_broadcast_menu(
+                            estado, otros, c, self.menus, self.libro, self.negociaciones
+                        )
+                    )
+                    self.cooldown_hasta = time.time() + self.accept_cooldown
+                else:
+                    resumen.agregar(
+                        await agent.hacer_broadcast_propuestas_1a1(
+                            estado, otros, c, self.libro, self.negociaciones
+                        )
+                    )
+                    self.cooldown_hasta = time.time() + self.accept_cooldown
+                    resumen.agregar(
+                        await agent.hacer_broadcast_compras_con_oro(
+                            estado, otros, c, self.libro, self.negociaciones
+                        )
+                    )
+                resumen.agregar(
+                    await agent.hacer_broadcast_cadenas(
+                        estado, otros, c, self.cadenas, self.libro
+                    )
+                )
+
+        logger.info(
+            "Broadcast completo a %d agentes: %d cartas enviadas, %d fallidas.",
+            len(otros),
+            resumen.enviadas,
+            resumen.fallidas,
+        )
+        return resumen
+
+    # ── Traitement des cartas ──────────────────────────────────────────────────
+
+    async def procesar_carta(
+        self,
+        estado,
+        carta: dict,
+        reservas: agent.LibroReservas | None = None,
+        detectada: float | None = None,
+    ) -> dict:
+        """Traite une seule carta : règles (ou prompt → LLM) → décision → exécution.
+
+        Tout le traitement est tracé dans un span « carta » (voir trazas.py).
+
+        Une confirmation d'une de nos offres est réglée par la mémoire des
+        négociations (negociaciones.py) ; le moteur de règles (reglas.py)
+        décide les autres cartas aux gabarits connus ; seules les cartas
+        qu'il ne sait pas interpréter passent par le LLM, dont les décisions
+        sont mises en cache (cache du slot).
+
+        Args:
+            estado:    État déjà récupéré par le poll (pas de re-fetch HTTP).
+            carta:     La carta à traiter.
+            reservas:  Registre des envois engagés par les cartas traitées en
+                       parallèle sur le même état (voir procesar_lote).
+            detectada: Timestamp de détection de la carta, pour mesurer la latence.
+
+        Returns:
+            Le résultat de agent.ejecutar_decision.
+        """
+        with trazas.span(
+            "carta",
+            remi=carta.get("remi"),
+            asunto=carta.get("asunto"),
+            carta_id=carta.get("id"),
+        ) as span_carta:
+            carta, en_cooldown = self._preparar(carta)
+            decision, origen, oferta = self._decidir_sin_llm(estado, carta, en_cooldown)
+            if decision is None:
+                decision = await llm.decidir_carta(
+                    estado, carta, en_cooldown, cola=self.cola, cache=self.cache
+                )
+                origen = "llm"
+            self._registrar_latencia(carta, detectada)
+            resultado = await self._ejecutar(estado, decision, origen, reservas, oferta)
+
+            span_carta.anotar(
+                origen=origen,
+                accion=decision.get("accion"),
+                estado=resultado.get("estado"),
+            )
+            return resultado
+
+    async def procesar_conversacion(
+        self,
+        estado,
+        cartas: list[dict],
+        reservas: agent.LibroReservas | None = None,
+        detectada: float | None = None,
+    ) -> list[dict]:
+        """Traite ensemble les nouvelles cartas d'un même expéditeur.
+
+        Chaque carta passe d'abord par la mémoire des négociations et les
+        règles ; celles qu'elles ne savent pas décider sont soumises ensemble
+        au LLM (llm.decidir_conversacion) :
+        un seul appel pour tout l'échange, sur le même état, au lieu d'un
+        appel par carta qui répondrait à chacune isolément. Une carta seule
+        suit le chemin de procesar_carta (cache LLM compris).
+
+        Comme dans la boucle carta par carta, une erreur n'abandonne que la
+        carta ou la décision concernée ; si l'appel groupé échoue, les cartas
+        restantes sont décidées une par une (llm.decidir_carta).
+
+        Args:
+            estado:    État déjà récupéré par le poll.
+            cartas:    Cartas du même remitente, triées par fecha.
+            reservas:  Registre des envois engagés par les cartas du lot.
+            detectada: Timestamp de détection des cartas, pour mesurer la latence.
+
+        Returns:
+            Les résultats de agent.ejecutar_decision, dans l'ordre d'exécution.
+        """
+        if len(cartas) == 1:
+            return [await self.procesar_carta(estado, cartas[0], reservas, detectada)]
+        resultados = []
+        restantes = []
+        en_cooldown = False
+        for carta in cartas:
+            with trazas.span(
+                "carta",
+                remi=carta.get("remi"),
+                asunto=carta.get("asunto"),
+                carta_id=carta.get("id"),
+            ) as span_carta:
+                try:
+                    carta, en_cooldown = self._preparar(carta)
+                    decision, origen, oferta = self._decidir_sin_llm(
+                        estado, carta, en_cooldown
+                    )
+                    if decision is None:
+                        span_carta.anotar(origen="conversacion")
+                        restantes.append(carta)
+                        continue
+                    self._registrar_latencia(carta, detectada)
+                    resultado = await self._ejecutar(
+                        estado, decision, origen, reservas, oferta
+                    )
+                except Exception as e:  # noqa: BLE001 — une carta en erreur n'arrête pas la conversation
+                    logger.error(
+                        "Erreur traitement carta de %s: %s", carta.get("remi"), e
+                    )
+                    continue
+                span_carta.anotar(
+                    origen=origen,
+                    accion=decision.get("accion"),
+                    estado=resultado.get("estado"),
+                )
+                resultados.append(resultado)
+        if not restantes:
+            return resultados
+
+        remi = cartas[0].get("remi")
+        with trazas.span(
+            "conversacion", remi=remi, cartas=len(restantes)
+        ) as span_conversacion:
+            decisiones = None
+            if len(restantes) > 1:
+                logger.info(
+                    "  Conversación con '%s': %d cartas, una sola consulta LLM.",
+                    remi,
+                    len(restantes),
+                )
+                try:
+                    decisiones = await llm.decidir_conversacion(
+                        estado, restantes, en_cooldown, cola=self.cola
+                    )
+                except Exception as e:  # noqa: BLE001 — repli carta par carta ci-dessous
+                    logger.error(
+                        "Erreur consultation groupée de %s: %s ; repli carta par carta.",
+                        remi,
+                        e,
+                    )
+            if decisiones is None:
+                decisiones = []
+                for carta in restantes:
+                    try:
+                        decisiones.append(
+                            await llm.decidir_carta(
+                                estado,
+                                carta,
+                                en_cooldown,
+                                cola=self.cola,
+                                cache=self.cache,
+                            )
+                        )
+                    except Exception as e:  # noqa: BLE001 — une carta en erreur n'arrête pas la conversation
+                        logger.error("Erreur traitement carta de %s: %s", remi, e)
+            for carta in restantes:
+                self._registrar_latencia(carta, detectada)
+            for decision in decisiones:
+                try:
+                    resultados.append(
+                        await self._ejecutar(estado, decision, "llm", reservas)
+                    )
+                except Exception as e:  # noqa: BLE001 — les décisions suivantes s'exécutent
+                    logger.error("Erreur exécution décision pour %s: %s", remi, e)
+            span_conversacion.anotar(acciones=[d.get("accion") for d in decisiones])
+        return resultados
+
+    def _decidir_sin_llm(
+        self, estado, carta: dict, en_cooldown: bool
+    ) -> tuple[dict | None, str, int | None]:
+        """Décision sans LLM : confirmation d'une offre connue (mémoire des
+        négociations, cooldown sans objet), sinon moteur de règles. Une
+        confirmation qui ne correspond à aucune offre ouverte n'est pas
+        payée (esperar) : ni les règles ni le LLM ne la voient.
+
+        Returns:
+            (décision ou None, origine, offre à clore après exécution ou None)
+        """
+        terminos = reglas.terminos_confirmacion(carta)
+        liquidacion = None
+        if terminos is not None:
+            with trazas.span("negociacion"):
+                liquidacion = self.negociaciones.liquidar(
+                    carta.get("remi") or "", *terminos
+                )
+        if liquidacion is not None:
+            return liquidacion.decision, "negociacion", liquidacion.oferta
+        if terminos is not None:
+            # Confirmation d'une offre que nous n'avons pas faite (ou déjà
+            # réglée) : rien n'est payé sur la seule parole de l'expéditeur.
+            metricas.negociaciones_liquidadas_total.inc(resultado="desconocida")
+            logger.info(
+                "Confirmación de '%s' sin oferta conocida: esperar.", carta.get("remi")
+            )
+            return (
+                {"accion": "esperar", "motivo": "confirmacion_desconocida"},
+                "negociacion",
+                None,
+            )
+        with trazas.span("reglas"):
+            decision = reglas.decidir_carta(
+                estado,
+                carta,
+                en_cooldown=en_cooldown,
+                estadisticas=self.estadisticas_reglas,
+            )
+        return decision, "reglas", None
+
+    def _preparar(self, carta: dict) -> tuple[dict, bool]:
+        """Alimente le carnet d'ordres, explicite les références (menus,
+        chaînes), compte la carta par type (avant le partage fast-path / LLM)
+        et la journalise.
+
+        Returns:
+            (carta complétée, en_cooldown)
+        """
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        self.libro.registrar_carta(carta)  # annonces et offres du remitente
+        carta = agent.expandir_referencias_menu(carta, self.menus)
+        carta = agent.expandir_referencias_cadena(carta, self.cadenas)
+        metricas.cartas_clasificadas_total.inc(
+            tipo=llm.clasificar_carta(carta),
+            confianza="baja" if llm.carta_incierta(carta) else "alta",
+        )
+        en_cooldown = time.time() < self.cooldown_hasta
+
+        logger.info(
+            "[%s] CARTA de '%s' | %s",
+            timestamp,
+            carta.get("remi"),
+            carta.get("asunto"),
+        )
+        logger.info("  Cuerpo: %s", str(carta.get("cuerpo", ""))[:120])
+        if en_cooldown:
+            logger.info(
+                "  [cooldown] %ds restantes",
+                int(self.cooldown_hasta - time.time()),
+            )
+        return carta, en_cooldown
+
+    async def _ejecutar(
+        self,
+        estado,
+        decision: dict,
+        origen: str,
+        reservas: agent.LibroReservas | None,
+        oferta: int | None = None,
+    ) -> dict:
+        """Compte et exécute une décision (agent.ejecutar_decision), puis clôt
+        l'offre qu'elle règle le cas échéant (mémoire des négociations) et la
+        chaîne acceptée dont notre part est partie."""
+        metricas.decisiones_total.inc(accion=decision.get("accion"), origen=origen)
+        stats = self.estadisticas_reglas.estadisticas()
+        logger.debug(
+            "  Fast-path: %d/%d cartas (%.0f%%), %d llamadas LLM evitadas",
+            stats["llamadas_llm_evitadas"],
+            stats["cartas"],
+            100 * stats["tasa_acierto"],
+            stats["llamadas_llm_evitadas"],
+        )
+        cache = self.cache.estadisticas()
+        logger.debug(
+            "  Cache LLM: %d aciertos / %d fallos (%.0f%%), %d entradas",
+            cache["aciertos"],
+            cache["fallos"],
+            100 * cache["tasa_acierto"],
+            cache["tamano"],
+        )
+        resultado = await agent.ejecutar_decision(
+            decision,
+            estado.Alias or "agente",
+            estado,
+            self.cliente,
+            reservas,
+            self.negociaciones,
+        )
+        if oferta is not None:
+            self.negociaciones.cerrar(oferta, resultado)
+        if resultado.get("estado") == "aceptado_y_enviado" and "cadena" in decision:
+            self.cadenas.completar(decision["cadena"])
+        logger.info("  → %s", resultado)
+        return resultado
+
+    def _registrar_latencia(self, carta: dict, detectada: float | None) -> None:
+        """Mesure et journalise la latence arrivée → décision d'une carta.
+
+        Deux mesures : depuis la `fecha` Butler de la carta (inclut le délai de
+        polling, mais dépend de l'accord des horloges) et depuis sa détection
+        par le polling (temps de décision pur).
+        """
+        ahora = time.time()
+        try:
+            llegada = datetime.fromisoformat(carta["fecha"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            llegada = detectada or ahora
+        desde_llegada = ahora - llegada
+        desde_deteccion = ahora - (detectada or ahora)
+        self.latencias.append((desde_llegada, desde_deteccion))
+        logger.info(
+            "  Latencia: %.1fs desde llegada, %.1fs desde detección",
+            desde_llegada,
+            desde_deteccion,
+        )
+
+    def resumen_latencias(self) -> dict:
+        """Médiane et maximum des dernières latences arrivée/détection → décision."""
+        muestras = list(self.latencias)
+        if not muestras:
+            return {"muestras": 0}
+        llegada = sorted(m[0] for m in muestras)
+        deteccion = sorted(m[1] for m in muestras)
+        return {
+            "muestras": len(muestras),
+            "llegada_p50": llegada[len(llegada) // 2],
+            "llegada_max": llegada[-1],
+            "deteccion_p50": deteccion[len(deteccion) // 2],
+            "deteccion_max": deteccion[-1],
+        }
+
+    async def procesar_lote(
+        self,
+        estado,
+        nuevas: dict[str, dict],
+        liquidaciones: list[Liquidacion] | None = None,
+    ) -> list[dict]:
+        """Traite un lot de nouvelles cartas en parallèle, dans l'ordre par expéditeur.
+
+        Les `liquidaciones` (offres confirmées dont le paquete vient
+        d'arriver, ou dont notre envoi avait échoué, voir
+        Negociaciones.liquidables) sont exécutées d'abord, sur les mêmes
+        réservations.
+
+        Les cartas sont regroupées par remitente (triées par fecha) : chaque
+        groupe est traité séquentiellement par une tâche, au plus
+        CARTAS_MAX_WORKERS groupes à la fois. Les appels LLM de plusieurs
+        expéditeurs se recouvrent donc, tandis qu'un même expéditeur voit ses
+        cartas traitées dans l'ordre. Un LibroReservas partagé empêche les
+        acceptations simultanées de promettre deux fois le même SOBRAN.
+
+        Avec `agrupar`, les cartas d'un expéditeur que les règles ne décident
+        pas sont soumises en un seul appel LLM (procesar_conversacion).
+
+        Les groupes démarrent par ordre de priorité de leur carta la plus
+        urgente (llm.PRIORIDAD_TIPO) : un expéditeur qui confirme un échange
+        passe devant ceux qui n'envoient que des annonces. Une carta générale
+        suivie dans le lot d'une autre carta générale du même expéditeur est
+        superada : elle est marquée traitée sans décision.
+
+        Si au moins une décision 'aceptar' a abouti, déclenche UN re-broadcast
+        pour mettre à jour les propositions avec les ressources post-échange.
+
+        Args:
+            estado:        État récupéré par le poll (snapshot commun au lot).
+            nuevas:        Cartas à traiter, {id: carta}.
+            liquidaciones: Règlements en attente de notre part.
+
+        Returns:
+            Les résultats de ejecutar_decision, dans l'ordre de traitement par groupe.
+        """
+        reservas = agent.LibroReservas()
+        detectada = time.time()
+        previos = []
+        for liquidacion in liquidaciones or []:
+            with trazas.span("liquidacion", oferta=liquidacion.oferta):
+                previos.append(
+                    await self._ejecutar(
+                        estado,
+                        liquidacion.decision,
+                        "negociacion",
+                        reservas,
+                        liquidacion.oferta,
+                    )
+                )
+        limite = asyncio.Semaphore(max(1, CARTAS_MAX_WORKERS))
+        por_remi: dict[str, list[tuple[str, dict]]] = {}
+        for cid, carta in nuevas.items():
+            por_remi.setdefault(carta.get("remi") or "", []).append((cid, carta))
+        grupos = sorted(
+            (self._descartar_superadas(cartas) for cartas in por_remi.values()),
+            key=_urgencia,
+        )
+
+        async def _procesar_grupo(cartas: list[tuple[str, dict]]) -> list[dict]:
+            resultados = []
+            async with limite:
+                if self.agrupar and len(cartas) > 1:
+                    try:
+                        resultados = await self.procesar_conversacion(
+                            estado, [c for _, c in cartas], reservas, detectada
+                        )
+                    except Exception as e:  # noqa: BLE001 — un expéditeur en erreur n'arrête pas le lot
+                        logger.error(
+                            "Erreur traitement cartas de %s: %s",
+                            cartas[0][1].get("remi"),
+                            e,
+                        )
+                    for cid, _ in cartas:
+                        self.sincronizador.completar(cid)
+                    return resultados
+                for cid, carta in cartas:
+                    try:
+                        resultados.append(
+                            await self.procesar_carta(
+                                estado, carta, reservas, detectada
+                            )
+                        )
+                    except Exception as e:  # noqa: BLE001 — une carta en erreur n'arrête pas le lot
+                        logger.error(
+                            "Erreur traitement carta de %s: %s", carta.get("remi"), e
+                        )
+                    self.sincronizador.completar(cid)
+            return resultados
+
+        async with asyncio.TaskGroup() as grupo_tareas:
+            tareas = [
+                grupo_tareas.create_task(_procesar_grupo(grupo))
+                for grupo in grupos
+                if grupo
+            ]
+        resultados = previos + [r for tarea in tareas for r in tarea.result()]
+
+        if any(r.get("estado") == "aceptado_y_enviado" for r in resultados):
+            logger.info(
+                "Post-accept: re-broadcast avec ressources mises à jour (réservé: %s).",
+                reservas.comprometido(),
+            )
+            try:
+                with trazas.span("rebroadcast"):
+                    await self.broadcast_completo()
+            except Exception as e:  # noqa: BLE001 — les décisions du lot sont déjà exécutées
+                logger.error("Erreur re-broadcast post-accept: %s", e)
+        return resultados
+
+    def _descartar_superadas(
+        self, cartas: list[tuple[str, dict]]
+    ) -> list[tuple[str, dict]]:
+        """Trie les cartas d'un expéditeur par fecha et retire (en les marquant
+        traitées) les cartas générales qu'une carta générale plus récente rend
+        caduques : ses besoins et offres ont changé depuis. Une carta dont le
+        type est incertain n'est jamais retirée : le LLM en juge."""
+        cartas = sorted(cartas, key=lambda c: c[1].get("fecha") or "")
+        generales = [
+            cid
+            for cid, c in cartas
+            if llm.clasificar_carta(c) == "general" and not llm.carta_incierta(c)
+        ]
+        superadas = set(generales[:-1])
+        for cid in superadas:
+            metricas.cartas_descartadas_total.inc(motivo="superada")
+            self.sincronizador.completar(cid)
+        if superadas:
+            logger.info(
+                "%d carta(s) générale(s) de '%s' superada(s) par une plus récente.",
+                len(superadas),
+                cartas[0][1].get("remi"),
+            )
+        return [(cid, c) for cid, c in cartas if cid not in superadas]
+
+    # ── Boucle de polling ──────────────────────────────────────────────────────
+
+    async def poll_buzon(self) -> int:
+        """Un cycle de polling : /info → détection des nouvelles cartas → traitement.
+
+        Les Recursos observés alimentent la mémoire des négociations : une
+        offre confirmée dont le paquete est arrivé depuis est réglée dans le
+        même cycle, même sans nouvelle carta.
+
+        Returns:
+            Nombre de cartas traitées (0 si le buzón n'a rien de nouveau).
+        """
+        with metricas.poll_ciclo_segundos.medir(), trazas.span("poll") as span_poll:
+            with trazas.span("fetch"):
+                inicio = time.monotonic()
+                estado = await self.cliente.obtener_estado(fresco=True)
+                lectura = (inicio, time.monotonic())
+                nuevas = self.sincronizador.detectar(estado.Buzon or {})
+                self.negociaciones.observar(estado.Recursos, lectura)
+                liquidaciones = self.negociaciones.liquidables()
+            metricas.poll_cartas_nuevas.observar(len(nuevas))
+            if nuevas or liquidaciones:
+                span_poll.anotar(cartas=len(nuevas), liquidaciones=len(liquidaciones))
+                logger.info("%d nouvelle(s) carta(s) détectée(s).", len(nuevas))
+                await self.procesar_lote(estado, nuevas, liquidaciones)
+            else:
+                span_poll.descartar()  # rien à tracer pour un poll vide
+        return len(nuevas)
+
+    async def conectar(self) -> None:
+        """Attend que Butler soit accessible (retry toutes les 5s), puis
+        initialise le buzón : sans checkpoint, les cartas existantes sont
+        marquées comme déjà vues (évite de les retraiter) ; avec checkpoint,
+        les cartas arrivées pendant l'arrêt et celles restées pendientes
+        seront traitées au premier poll."""
+        while True:
+            try:
+                estado = await self.cliente.obtener_estado()
+                break
+            except (httpx.HTTPError, ValueError):
+                logger.warning("Butler non disponible, retry dans 5s...")
+                await asyncio.sleep(5)
+        ignoradas = self.sincronizador.inicializar(estado.Buzon or {})
+        logger.info(
+            "Butler connecté. %d cartas existantes ignorées (reprise: %s).",
+            ignoradas,
+            self.sincronizador.reanudado,
+        )
+
+    async def _esperar(self, intervalo: float) -> None:
+        """Attend `intervalo` secondes ou un réveil de /notify."""
+        try:
+            await asyncio.wait_for(self.despertar.wait(), intervalo)
+            logger.info("Notificación recibida: poll inmediato.")
+        except TimeoutError:
+            pass
+        self.despertar.clear()
+
+    async def bucle(self) -> None:
+        """Tâche principale de polling.
+
+        1. Reprend le checkpoint du buzón s'il existe, puis attend Butler (conectar).
+        2. Envoie les broadcasts initiaux.
+        3. Polling adaptatif : détecte les nouvelles cartas et les traite en lot
+           parallèle (procesar_lote). L'intervalle revient à POLL_INTERVAL_MIN
+           après chaque poll actif et s'allonge (×POLL_BACKOFF, plafonné à
+           POLL_INTERVAL_MAX) tant que le buzón reste calme. Un appel à /notify
+           réveille la boucle immédiatement.
+        4. Toutes les BROADCAST_INTERVAL secondes : re-broadcast périodique.
+
+        Les erreurs d'un cycle sont journalisées sans arrêter la boucle ;
+        seule l'annulation (detener) la termine.
+        """
+        trazas.slot_actual.set(self.slot)
+        logger.info("Polling démarré.")
+        self.sincronizador.cargar()
+        await self.conectar()
+
+        try:
+            await self.broadcast_completo()
+        except Exception as e:  # noqa: BLE001 — le polling démarre quand même
+            logger.error("Erreur broadcast initial: %s", e)
+
+        ultimo_broadcast = time.time()
+        intervalo = POLL_INTERVAL_MIN
+
+        while True:
+            await self._esperar(intervalo)
+            try:
+                if time.time() - ultimo_broadcast >= BROADCAST_INTERVAL:
+                    logger.info("Broadcast périodique...")
+                    try:
+                        await self.broadcast_completo()
+                        ultimo_broadcast = time.time()
+                    except Exception as e:  # noqa: BLE001 — réessayé au prochain intervalle
+                        logger.error("Erreur broadcast périodique: %s", e)
+
+                if await self.poll_buzon():
+                    intervalo = POLL_INTERVAL_MIN
+                else:
+                    intervalo = min(intervalo * POLL_BACKOFF, POLL_INTERVAL_MAX)
+
+            except Exception as e:  # noqa: BLE001 — la boucle de polling ne doit pas mourir
+                logger.error("Erreur polling: %s", e)
+
+
+class Anfitrion:
+    """Plusieurs slots hébergés dans un même processus.
+
+    Chaque slot a son AgenteRuntime (buzón et checkpoint, cooldown, carnet
+    d'ordres, menus, chaînes, négociations, cache LLM) ; tous partagent une session Butler
+    (un seul pool de connexions) et une llm.ColaLLM (une seule file vers
+    Ollama, au plus LLM_CONCURRENCIA générations à la fois).
+
+    Args:
+        slots:     Identifiants des slots ; le premier est le slot par défaut.
+        base_url:  URL racine du serveur Butler.
+        pool_size: Connexions keep-alive vers Butler, pour tous les slots.
+        cola:      File LLM partagée (créée si None).
+    """
+
+    def __init__(
+        self,
+        slots: list[str] = AGENTE_SLOTS,
+        base_url: str = BUTLER_BASE_URL,
+        pool_size: int = BUTLER_POOL_SIZE,
+        cola: llm.ColaLLM | None = None,
+    ) -> None:
+        if not slots:
+            raise ValueError("Aucun slot à héberger")
+        rutas = [buzon.ruta_checkpoint(slot) for slot in slots]
+        if len(set(rutas)) < len(rutas):
+            raise ValueError(
+                "Checkpoints du buzón en collision : BUZON_CHECKPOINT doit contenir {slot}"
+            )
+        if len({ruta_negociaciones(slot) for slot in slots}) < len(slots):
+            raise ValueError(
+                "Bases des négociations en collision : NEGOCIACIONES_DB doit contenir {slot}"
+            )
+        self.sesion = butler.nueva_sesion(pool_size)
+        self.cola = cola or llm.ColaLLM()
+        self.runtimes: dict[str, AgenteRuntime] = {
+            slot: AgenteRuntime(
+                ButlerClient(base_url, slot, session=self.sesion),
+                buzon.SincronizadorBuzon(ruta),
+                cola=self.cola,
+            )
+            for slot, ruta in zip(slots, rutas)
+        }
+        self.por_defecto = slots[0]
+
+    def runtime(self, slot: str | None = None) -> AgenteRuntime:
+        """Le runtime du slot (slot par défaut si None).
+
+        Raises:
+            KeyError: Si le slot n'est pas hébergé ici.
+        """
+        return self.runtimes[slot or self.por_defecto]
+
+    def iniciar(self) -> None:
+        """Lance la tâche de polling de chaque slot."""
+        for runtime in self.runtimes.values():
+            runtime.iniciar()
+        logger.info(
+            "%d slot(s) démarré(s): %s", len(self.runtimes), list(self.runtimes)
+        )
+
+    async def detener(self) -> None:
+        """Arrête tous les slots, puis ferme la file LLM et la session Butler."""
+        await asyncio.gather(*(r.detener() for r in self.runtimes.values()))
+        await self.cola.cerrar()
+        await self.sesion.aclose()
@@ -0,0 +1,642 @@
+"""
+simulador.py — Butler simulé et agents synthétiques (banc d'essai local).
+
+Permet de faire tourner l'agent sans Butler ni pairs réels :
+
+- MundoSimulado : l'état du monde (agents, ressources, objectifs, buzones)
+  et les opérations Butler (/info, /gente, /carta, /paquete/{dest}) ;
+- AgenteSintetico : un pair au comportement scripté (accepte les
+  propositions et les lignes de menu utiles, honore les confirmations,
+  propose des échanges 1:1) selon une estrategia ;
+- crear_app : une app FastAPI qui expose le monde avec les mêmes payloads
+  que Butler, plus un faux Ollama (/api/chat) à latence configurable ;
+- ServidorSimulado : lance cette app avec uvicorn dans un thread.
+
+Les agents synthétiques agissent directement sur le monde (sans HTTP) : seul
+l'agent testé passe par le réseau, comme en production.
+"""
+
+import json
+import logging
+import random
+import re
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+
+from agent import calcular_faltan_sobran
+from reglas import _normalizar, _parsear_cantidades, parsear_carta
+
+logger = logging.getLogger(__name__)
+
+RECURSOS_SIMULADOS = [
+    "madera",
+    "piedra",
+    "queso",
+    "tela",
+    "trigo",
+    "hierro",
+    "lana",
+    "sal",
+]
+ESTRATEGIAS = ("cooperativo", "exigente", "pasivo", "tramposo")
+TICKS_ESPERA = 50  # ticks avant d'abandonner une proposition sans réponse
+
+
+# ── Monde simulé ───────────────────────────────────────────────────────────────
+
+
+@dataclass
+class EstadoAgente:
+    """Un agent du monde simulé, tel que Butler le connaît."""
+
+    alias: str
+    slot: str
+    recursos: dict
+    objetivo: dict
+    buzon: dict = field(default_factory=dict)
+    completado_en: float | None = None  # secondes depuis le début, ou None
+    # Trafic quand l'objectif est atteint : MundoSimulado.trafico(alias)
+    trafico_objetivo: dict | None = None
+
+
+class MundoSimulado:
+    """État du monde et opérations Butler, thread-safe.
+
+    Compte les cartas et paquetes échangés (par expéditeur, et par
+    destinataire), l'instant où chaque agent atteint son objectif et le trafic
+    qu'il lui a fallu : cartas envoyées, paquetes envoyés et reçus.
+    """
+
+    def __init__(self) -> None:
+        self.agentes: dict[str, EstadoAgente] = {}  # alias → agent
+        self._por_slot: dict[str, str] = {}  # slot → alias
+        self._lock = threading.RLock()
+        self._siguiente_id = 0
+        self.inicio = time.time()
+        self.cartas: dict[str, int] = {}  # remi → cartas envoyées
+        self.paquetes: dict[str, int] = {}  # remi → paquetes envoyés
+        self.paquetes_recibidos: dict[str, int] = {}  # dest → paquetes reçus
+        self.cartas_recibidas: dict[str, int] = {}  # dest → cartas reçues
+        self.llamadas_llm = 0
+
+    def agregar(self, alias: str, slot: str, recursos: dict, objetivo: dict) -> None:
+        with self._lock:
+            self.agentes[alias] = EstadoAgente(
+                alias, slot, dict(recursos), dict(objetivo)
+            )
+            self._por_slot[slot] = alias
+
+    def _agente(self, slot: str) -> EstadoAgente:
+        alias = self._por_slot.get(slot)
+        if alias is None:
+            raise KeyError(slot)
+        return self.agentes[alias]
+
+    def _entregar(self, dest: str, remi: str, asunto: str, cuerpo: str) -> None:
+        self._siguiente_id += 1
+        self.cartas_recibidas[dest] = self.cartas_recibidas.get(dest, 0) + 1
+        cid = f"{self._siguiente_id:08x}"
+        self.agentes[dest].buzon[cid] = {
+            "remi": remi,
+            "dest": dest,
+            "asunto": asunto,
+            "cuerpo": cuerpo,
+            "id": cid,
+            "fecha": datetime.now().isoformat(),
+        }
+
+    def _comprobar_objetivo(self, agente: EstadoAgente) -> None:
+        if agente.completado_en is not None:
+            return
+        faltan, _ = calcular_faltan_sobran(agente.recursos, agente.objetivo)
+        if not faltan:
+            agente.completado_en = time.time() - self.inicio
+            agente.trafico_objetivo = self.trafico(agente.alias)
+
+    # ── Opérations Butler ──────────────────────────────────────────────────────
+
+    def info(self, slot: str) -> dict:
+        """Payload de /info : {"Alias", "Recursos", "Objetivo", "Buzon"}."""
+        with self._lock:
+            a = self._agente(slot)
+            return {
+                "Alias": a.alias,
+                "Recursos": dict(a.recursos),
+                "Objetivo": dict(a.objetivo),
+                "Buzon": dict(a.buzon),
+            }
+
+    def gente(self) -> list[dict]:
+        """Payload de /gente : [{"Alias": ...}, ...]."""
+        with self._lock:
+            return [{"Alias": alias} for alias in self.agentes]
+
+    def carta(self, remi: str, dest: str, asunto: str, cuerpo: str) -> bool:
+        """Dépose une carta dans le buzón de dest. False si dest est inconnu."""
+        with self._lock:
+            if dest not in self.agentes:
+                return False
+            self._entregar(dest, remi, asunto, cuerpo)
+            self.cartas[remi] = self.cartas.get(remi, 0) + 1
+            return True
+
+    def paquete(self, remi: str, dest: str, recursos: dict) -> bool:
+        """Transfère des ressources de remi à dest, notifié par une carta Sistema.
+
+        Returns:
+            False si dest est inconnu ou si remi n'a pas les ressources.
+        """
+        with self._lock:
+            origen, destino = self.agentes.get(remi), self.agentes.get(dest)
+            if origen is None or destino is None or not recursos:
+                return False
+            if any(
+                not isinstance(c, int) or c <= 0 or origen.recursos.get(r, 0) < c
+                for r, c in recursos.items()
+            ):
+                return False
+            for rec, cant in recursos.items():
+                origen.recursos[rec] -= cant
+                destino.recursos[rec] = destino.recursos.get(rec, 0) + cant
+            self._entregar(
+                dest,
+                "Sistema",
+                "Paquete recibido",
+                "Has recibido:\n" + "\n".join(f"{r}: {c}" for r, c in recursos.items()),
+            )
+            self.paquetes[remi] = self.paquetes.get(remi, 0) + 1
+            self.paquetes_recibidos[dest] = self.paquetes_recibidos.get(dest, 0) + 1
+            self._comprobar_objetivo(destino)
+            return True
+
+    def recoger(self, alias: str) -> list[dict]:
+        """Vide et retourne le buzón d'un agent synthétique (ordre d'arrivée)."""
+        with self._lock:
+            agente = self.agentes[alias]
+            cartas = list(agente.buzon.values())
+            agente.buzon.clear()
+            return cartas
+
+    def estado(self, alias: str) -> tuple[dict, dict]:
+        """Copie de (Recursos, Objetivo) d'un agent."""
+        with self._lock:
+            a = self.agentes[alias]
+            return dict(a.recursos), dict(a.objetivo)
+
+    def trafico(self, alias: str) -> dict:
+        """Cartas envoyées et paquetes envoyés + reçus par un agent jusqu'ici,
+        et appels au faux Ollama (tous faits par l'agent testé)."""
+        with self._lock:
+            return {
+                "cartas": self.cartas.get(alias, 0),
+                "paquetes": self.paquetes.get(alias, 0)
+                + self.paquetes_recibidos.get(alias, 0),
+                "llamadas_llm": self.llamadas_llm,
+            }
+
+    def completados(self) -> dict[str, float]:
+        """{alias: instant (s) où l'objectif a été atteint} des agents qui l'ont atteint."""
+        with self._lock:
+            for a in self.agentes.values():
+                self._comprobar_objetivo(a)
+            return {
+                a.alias: a.completado_en
+                for a in self.agentes.values()
+                if a.completado_en is not None
+            }
+
+
+def generar_mundo(
+    n_sinteticos: int,
+    alias_probado: str,
+    slot_probado: str,
+    semilla: int = 0,
+    n_recursos: int = 6,
+    max_unidades: int = 3,
+) -> MundoSimulado:
+    """Crée un monde soluble : chaque unité manquante existe chez un autre agent.
+
+    Chaque agent vise 2 à 3 ressources (1 à max_unidades unités), en possède déjà une
+    partie, et le reste est distribué comme SOBRAN chez d'autres agents.
+    Chacun reçoit aussi 3 à 9 oro.
+
+    Args:
+        n_sinteticos:  Nombre d'agents synthétiques.
+        alias_probado: Alias de l'agent testé (piloté via HTTP).
+        slot_probado:  Slot de l'agent testé.
+        semilla:       Graine du générateur aléatoire.
+        n_recursos:    Nombre de ressources différentes en jeu.
+        max_unidades:  Unités maximales visées par ressource (taille des manques).
+    """
+    rnd = random.Random(semilla)
+    catalogo = RECURSOS_SIMULADOS[:n_recursos]
+    alias = [alias_probado] + [f"sintetico_{i:02d}" for i in range(1, n_sinteticos + 1)]
+    recursos = {a: {"oro": rnd.randint(3, 9)} for a in alias}
+    objetivos = {}
+    for a in alias:
+        objetivos[a] = {
+            rec: rnd.randint(1, max_unidades)
+            for rec in rnd.sample(catalogo, rnd.randint(2, 3))
+        }
+        for rec, cant in objetivos[a].items():
+            ya = rnd.randint(0, cant - 1)
+            if ya:
+                recursos[a][rec] = ya
+            sin_ese_objetivo = [
+                b for b in alias if b != a and rec not in objetivos.get(b, {})
+            ]
+            for _ in range(cant - ya):
+                otro = rnd.choice(sin_ese_objetivo or [b for b in alias if b != a])
+                recursos[otro][rec] = recursos[otro].get(rec, 0) + 1
+
+    mundo = MundoSimulado()
+    for a in alias:
+        mundo.agregar(
+            a, slot_probado if a == alias_probado else a, recursos[a], objetivos[a]
+        )
+    return mundo
+
+
+# ── Agents synthétiques ────────────────────────────────────────────────────────
+
+_LINEA_MENU = re.compile(r"#(\d+-\d+): te doy ([^\n]+?) a cambio de ([^\n]+)")
+_NECESITO = re.compile(r"necesito: ([^\n]+)")
+_CADENA = re.compile(
+    r"cadena #(\d+)\b.*tu parte: envia (\{[^{}]*\}) a (\S+); "
+    r"recibiras (\{[^{}]*\}) de (\S+?)\.",
+    re.DOTALL,
+)
+_OFREZCO = re.compile(r"ofrezco a cambio: ([^\n]+)")
+_RECIBIDO = re.compile(r"^([a-z_]+): (\d+)$", re.MULTILINE)
+
+
+def _cubre(recursos: dict, pedido: dict) -> bool:
+    return bool(pedido) and all(recursos.get(r, 0) >= c for r, c in pedido.items())
+
+
+class AgenteSintetico:
+    """Pair scripté qui négocie directement sur un MundoSimulado.
+
+    Estrategias :
+    - cooperativo : accepte toute proposition, ligne de menu ou part de
+      chaîne qui lui apporte du FALTAN (ou 3 oro par unité) contre du
+      SOBRAN, honore les
+      confirmations, annonce ses besoins, propose des échanges 1:1 ou des
+      achats à 3 oro et répond aux annonces « Busco intercambio » ;
+    - exigente    : comme cooperativo, mais n'accepte que si l'échange lui
+      rapporte au moins autant d'unités qu'il en cède, ne vend contre de
+      l'oro qu'une fois son objectif atteint, et ignore les menus ;
+    - pasivo      : accepte et honore, mais ne propose jamais ;
+    - tramposo    : accepte en annonçant un envoi qu'il ne fait jamais.
+
+    Args:
+        mundo:        Le monde simulé.
+        alias:        Alias de l'agent (déjà ajouté au monde).
+        estrategia:   Une des ESTRATEGIAS.
+        rnd:          Générateur aléatoire (reproductibilité).
+        prob_propuesta: Probabilité d'envoyer une proposition spontanée par tick.
+    """
+
+    def __init__(
+        self,
+        mundo: MundoSimulado,
+        alias: str,
+        estrategia: str = "cooperativo",
+        rnd: random.Random | None = None,
+        prob_propuesta: float = 0.1,
+    ) -> None:
+        if estrategia not in ESTRATEGIAS:
+            raise ValueError(f"Estrategia desconocida: {estrategia}")
+        self.mundo = mundo
+        self.alias = alias
+        self.estrategia = estrategia
+        self.rnd = rnd or random.Random()
+        self.prob_propuesta = prob_propuesta
+        self.ticks = 0
+        # remi → échanges en cours : {"dar", "recibir", "pagado", "tick"}
+        self.tratos: dict[str, list[dict]] = {}
+        self.ofertas: dict[str, set[str]] = {}  # remi → ressources annoncées en SOBRAN
+        self._anunciado: tuple | None = None  # dernier (faltan, sobran) annoncé
+        # ressources reçues (cartas Sistema) pas encore imputées à une chaîne
+        self.recibido: dict[str, int] = {}
+
+    # ── Helpers ────────────────────────────────────────────────────────────────
+
+    def _faltan_sobran(self) -> tuple[dict, dict, dict]:
+        recursos, objetivo = self.mundo.estado(self.alias)
+        faltan, sobran = calcular_faltan_sobran(recursos, objetivo)
+        return recursos, faltan, {r: c for r, c in sobran.items() if c > 0}
+
+    def _interesa(self, dar: dict, recibir: dict) -> bool:
+        """L'échange (je donne dar, je reçois recibir) est-il acceptable ?"""
+        _, faltan, sobran = self._faltan_sobran()
+        if not _cubre(sobran, dar):
+            return False
+        if any(r in faltan for r in recibir):
+            return self.estrategia != "exigente" or sum(recibir.values()) >= sum(
+                dar.values()
+            )
+        # vend aussi son SOBRAN contre de l'oro (3 par unité) ; l'exigente
+        # seulement une fois son objectif atteint
+        if self.estrategia == "exigente" and faltan:
+            return False
+        return recibir.get("oro", 0) >= 3 * sum(dar.values())
+
+    def _pagar(self, dest: str, recursos: dict) -> bool:
+        if self.estrategia == "tramposo":
+            return True
+        return self.mundo.paquete(self.alias, dest, recursos)
+
+    def _escribir(self, dest: str, asunto: str, cuerpo: str) -> None:
+        self.mundo.carta(self.alias, dest, asunto, cuerpo)
+
+    def _aceptar(self, remi: str, dar: dict, recibir: dict, cuerpo: str) -> None:
+        if self._pagar(remi, dar):
+            self.tratos.setdefault(remi, []).append(
+                {"dar": dar, "recibir": recibir, "pagado": True, "tick": self.ticks}
+            )
+            self._escribir(remi, "Intercambio aceptado", cuerpo)
+
+    # ── Réactions aux cartas ───────────────────────────────────────────────────
+
+    def _leer_menu(self, remi: str, texto: str) -> bool:
+        lineas = _LINEA_MENU.findall(texto)
+        if not lineas:
+            return False
+        if self.estrategia == "exigente":
+            return True
+        for codigo, ellos_dan, ellos_piden in lineas:
+            recibir = _parsear_cantidades(ellos_dan)
+            dar = _parsear_cantidades(ellos_piden)
+            if recibir and dar and self._interesa(dar, recibir):
+                self._aceptar(
+                    remi,
+                    dar,
+                    recibir,
+                    f"Acepto #{codigo}. Te envié: {json.dumps(dar)}.",
+                )
+                break
+        return True
+
+    def _leer_cadena(self, remi: str, texto: str) -> bool:
+        m = _CADENA.search(texto)
+        if not m:
+            return False
+        numero, dar, para, recibir, _ = m.groups()
+        dar, recibir = json.loads(dar), json.loads(recibir)
+        # Notre part a pu arriver avant la carta (l'initiateur paie dès que
+        # le fournisseur accepte) : on honore alors la chaîne sans condition.
+        ya_recibido = _cubre(self.recibido, recibir)
+        if ya_recibido:
+            acepta = _cubre(self._faltan_sobran()[2], dar)
+        else:
+            acepta = self._interesa(dar, recibir)
+        if acepta and self._pagar(para, dar):
+            if ya_recibido:
+                for rec, cant in recibir.items():
+                    self.recibido[rec] -= cant
+            detalle = "Te envié" if para == remi else f"Envié a {para}"
+            self._escribir(
+                remi,
+                "Intercambio aceptado",
+                f"Acepto cadena #{numero}. {detalle}: {json.dumps(dar)}.",
+            )
+        return True
+
+    def _leer_anuncio(self, remi: str, texto: str) -> bool:
+        necesita, ofrece = _NECESITO.search(texto), _OFREZCO.search(texto)
+        if not (necesita and ofrece):
+            return False
+        ofrecidos = _parsear_cantidades(ofrece.group(1))
+        self.ofertas[remi] = set(ofrecidos)
+        if self.estrategia == "pasivo":
+            return True
+        _, faltan, sobran = self._faltan_sobran()
+        dar = [r for r in _parsear_cantidades(necesita.group(1)) if sobran.get(r, 0)]
+        recibir = [r for r in ofrecidos if r in faltan]
+        if dar and recibir:
+            self._proponer(remi, {dar[0]: 1}, {recibir[0]: 1})
+        return True
+
+    def _leer_confirmacion(self, remi: str, ofrece: dict, pide: dict) -> None:
+        tratos = self.tratos.get(remi, [])
+        for trato in tratos:
+            if trato["dar"] == pide and trato["recibir"] == ofrece:
+                tratos.remove(trato)
+                if not trato["pagado"]:
+                    self._pagar(remi, pide)
+                return
+        # Confirmation sans proposition de notre part : on honore si on peut.
+        if self.estrategia != "tramposo" and self._interesa(pide, ofrece):
+            self._pagar(remi, pide)
+
+    def leer(self, carta: dict) -> None:
+        """Réagit à une carta reçue."""
+        remi = carta.get("remi", "")
+        if remi == "Sistema":
+            for rec, cant in _RECIBIDO.findall(carta.get("cuerpo", "")):
+                self.recibido[rec] = self.recibido.get(rec, 0) + int(cant)
+            return
+        texto = _normalizar(f"{carta.get('asunto', '')}\n{carta.get('cuerpo', '')}")
+        if (
+            self._leer_cadena(remi, texto)
+            or self._leer_menu(remi, texto)
+            or self._leer_anuncio(remi, texto)
+        ):
+            return
+        terminos = parsear_carta(carta)
+        if terminos is None:
+            return
+        # termes du point de vue de remi : 'ofrece' est ce que NOUS recevons
+        if terminos["tipo"] == "confirmacion":
+            self._leer_confirmacion(remi, terminos["ofrece"], terminos["pide"])
+        elif self._interesa(terminos["pide"], terminos["ofrece"]):
+            self._aceptar(
+                remi,
+                terminos["pide"],
+                terminos["ofrece"],
+                f"Acepto el trato. Te envié: {json.dumps(terminos['pide'])}. "
+                f"Espero recibir: {json.dumps(terminos['ofrece'])}.",
+            )
+
+    # ── Initiative ─────────────────────────────────────────────────────────────
+
+    def _proponer(self, dest: str, dar: dict, recibir: dict) -> None:
+        tratos = self.tratos.setdefault(dest, [])
+        if any(t["dar"] == dar and t["recibir"] == recibir for t in tratos):
+            return  # déjà proposé, on attend la réponse
+        tratos.append(
+            {"dar": dar, "recibir": recibir, "pagado": False, "tick": self.ticks}
+        )
+        describir = lambda d: " y ".join(f"{v} de {k}" for k, v in d.items())
+        self._escribir(
+            dest,
+            "Propuesta de intercambio",
+            f"Te propongo: te doy {describir(dar)} a cambio de {describir(recibir)}.",
+        )
+
+    def _anunciar(self, faltan: dict, sobran: dict) -> None:
+        """Annonce besoins et offres à tous, au format de hacer_broadcast_general."""
+        self._anunciado = (faltan, sobran)
+        cuerpo = (
+            f"Hola, soy {self.alias}.\n"
+            f"Necesito: {', '.join(f'{v} de {k}' for k, v in faltan.items())}.\n"
+            f"Ofrezco a cambio: {', '.join(f'{v} de {k}' for k, v in sobran.items())}."
+        )
+        for dest in self.mundo.agentes:
+            if dest != self.alias:
+                self._escribir(dest, "Busco intercambio", cuerpo)
+
+    def avanzar(self) -> None:
+        """Un tick : lit le buzón, annonce ses besoins s'ils ont changé, puis
+        propose éventuellement un échange 1:1 à un agent qui a annoncé ce qui
+        lui manque (à défaut, à un agent au hasard)."""
+        self.ticks += 1
+        for carta in self.mundo.recoger(self.alias):
+            self.leer(carta)
+        for tratos in self.tratos.values():  # propositions restées sans réponse
+            tratos[:] = [
+                t
+                for t in tratos
+                if t["pagado"] or self.ticks - t["tick"] < TICKS_ESPERA
+            ]
+        if self.estrategia == "pasivo":
+            return
+        _, faltan, sobran = self._faltan_sobran()
+        oro = sobran.pop("oro", 0)
+        if self._anunciado != (faltan, sobran) and (faltan or sobran):
+            self._anunciar(faltan, sobran)
+        if not faltan or self.rnd.random() >= self.prob_propuesta:
+            return
+        quiero = self.rnd.choice(list(faltan))
+        otros = [a for a, ofertas in self.ofertas.items() if quiero in ofertas] or [
+            a for a in self.mundo.agentes if a != self.alias
+        ]
+        if sobran and (oro < 3 or self.rnd.random() < 0.5):
+            dar = {self.rnd.choice(list(sobran)): 1}
+        elif oro >= 3:
+            dar = {"oro": 3}
+        else:
+            return
+        self._proponer(self.rnd.choice(otros), dar, {quiero: 1})
+
+
+# ── Serveur HTTP ───────────────────────────────────────────────────────────────
+
+
+def crear_app(mundo: MundoSimulado, latencia_llm: float = 0.5) -> FastAPI:
+    """App FastAPI exposant le monde avec les payloads Butler, plus un faux Ollama.
+
+    Args:
+        mundo:        Le monde simulé.
+        latencia_llm: Durée (s) de chaque réponse du faux /api/chat, qui
+                      répond toujours {"accion": "esperar"}.
+    """
+    app = FastAPI(title="Butler simulado")
+
+    def _alias(agente: str) -> str:
+        try:
+            return mundo.info(agente)["Alias"]
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Agente no encontrado")
+
+    @app.get("/info")
+    def info(agente: str) -> dict:
+        try:
+            return mundo.info(agente)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Agente no encontrado")
+
+    @app.get("/gente")
+    def gente(agente: str | None = None) -> list[dict]:
+        return mundo.gente()
+
+    @app.post("/carta")
+    def carta(agente: str, carta: dict) -> dict:
+        _alias(agente)
+        if not mundo.carta(
+            carta.get("remi", ""),
+            carta.get("dest", ""),
+            carta.get("asunto", ""),
+            carta.get("cuerpo", ""),
+        ):
+            raise HTTPException(status_code=404, detail="Destinatario no encontrado")
+        return {"status": "ok"}
+
+    @app.post("/paquete/{dest}")
+    def paquete(dest: str, agente: str, recursos: dict) -> dict:
+        if not mundo.paquete(_alias(agente), dest, recursos):
+            raise HTTPException(status_code=400, detail="Paquete rechazado")
+        return {"status": "ok"}
+
+    @app.post("/api/chat")
+    def chat(payload: dict):
+        with mundo._lock:
+            mundo.llamadas_llm += 1
+        time.sleep(latencia_llm)
+        contenido = json.dumps({"accion": "esperar"})
+        final = {
+            "done": True,
+            "prompt_eval_count": 0,
+            "eval_count": len(contenido) // 4,
+        }
+        if not payload.get("stream", True):
+            return {"message": {"role": "assistant", "content": contenido}, **final}
+
+        def _trozos():
+            for i in range(0, len(contenido), 4):
+                trozo = {
+                    "message": {"role": "assistant", "content": contenido[i : i + 4]}
+                }
+                yield json.dumps({**trozo, "done": False}) + "\n"
+            yield json.dumps(final) + "\n"
+
+        return StreamingResponse(_trozos(), media_type="application/x-ndjson")
+
+    return app
+
+
+class ServidorSimulado:
+    """Lance crear_app(mundo) avec uvicorn dans un thread daemon.
+
+    Args:
+        mundo:        Le monde simulé.
+        latencia_llm: Latence du faux Ollama (s).
+        puerto:       Port d'écoute (0 : un port libre).
+    """
+
+    def __init__(
+        self, mundo: MundoSimulado, latencia_llm: float = 0.5, puerto: int = 0
+    ):
+        if not puerto:
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                puerto = s.getsockname()[1]
+        self.url = f"http://127.0.0.1:{puerto}"
+        self._servidor = uvicorn.Server(
+            uvicorn.Config(
+                crear_app(mundo, latencia_llm),
+                host="127.0.0.1",
+                port=puerto,
+                log_level="warning",
+            )
+        )
+        self._thread = threading.Thread(target=self._servidor.run, daemon=True)
+
+    def iniciar(self) -> str:
+        """Démarre le serveur et attend qu'il accepte les connexions. Retourne son URL."""
+        self._thread.start()
+        while not self._servidor.started:
+            time.sleep(0.01)
+        return self.url
+
+    def detener(self) -> None:
+        self._servidor.should_exit = True
+        self._thread.join(timeout=5)
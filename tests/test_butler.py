@@ -0,0 +1,88 @@
+"""Cache des lectures Butler (/info et /gente) de ButlerClient."""
+
+import asyncio
+import json
+
+import httpx
+
+from butler import ButlerClient
+
+
+class ButlerFalso:
+    """Transport httpx factice : compte les requêtes par chemin."""
+
+    def __init__(self) -> None:
+        self.peticiones: list[str] = []
+        self.recursos = {"oro": 3}
+        self.gente_caida = False
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.peticiones.append(request.url.path)
+        if request.url.path == "/gente":
+            if self.gente_caida:
+                return httpx.Response(503)
+            return httpx.Response(200, json=[{"Alias": "yo"}, {"Alias": "bob"}])
+        if request.url.path == "/paquete/bob":
+            self.recursos = {"oro": 2}
+            return httpx.Response(200)
+        cuerpo = json.dumps({"Alias": "yo", "Recursos": self.recursos, "Objetivo": {}})
+        etag = f'"{hash(cuerpo)}"'
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304)
+        return httpx.Response(200, content=cuerpo, headers={"ETag": etag})
+
+
+def _cliente(butler: ButlerFalso, **kwargs) -> ButlerClient:
+    sesion = httpx.AsyncClient(transport=httpx.MockTransport(butler))
+    return ButlerClient("http://butler", slot="yo", session=sesion, **kwargs)
+
+
+def test_lecturas_de_info_compartidas():
+    """Les lectures simultanées partagent une requête, la fenêtre en évite
+    d'autres ; fresco interroge toujours Butler (304 : état réutilisé)."""
+    butler = ButlerFalso()
+    cliente = _cliente(butler, info_ventana=60)
+
+    async def _leer():
+        estados = await asyncio.gather(*(cliente.obtener_estado() for _ in range(3)))
+        estados.append(await cliente.obtener_estado())
+        estados.append(await cliente.obtener_estado(fresco=True))
+        return estados
+
+    estados = asyncio.run(_leer())
+
+    assert butler.peticiones == ["/info", "/info"]
+    assert all(e is estados[0] for e in estados)
+
+
+def test_envio_de_paquete_invalida_info():
+    """Après un paquete, la lecture suivante voit les nouveaux Recursos."""
+    butler = ButlerFalso()
+    cliente = _cliente(butler, info_ventana=60)
+
+    async def _leer():
+        antes = await cliente.obtener_estado()
+        await cliente.enviar_paquete("bob", {"oro": 1})
+        return antes, await cliente.obtener_estado()
+
+    antes, despues = asyncio.run(_leer())
+
+    assert antes.Recursos == {"oro": 3}
+    assert despues.Recursos == {"oro": 2}
+
+
+def test_gente_en_cache_y_caida():
+    """La liste des agents est gardée `gente_ttl` ; Butler en erreur, la
+    dernière liste connue sert encore."""
+    butler = ButlerFalso()
+    cliente = _cliente(butler, gente_ttl=30)
+
+    async def _leer():
+        primera = await cliente.obtener_otros_agentes("yo")
+        segunda = await cliente.obtener_otros_agentes("yo")
+        cliente._gente = (cliente._gente[0] - 31, cliente._gente[1])
+        butler.gente_caida = True
+        return primera, segunda, await cliente.obtener_otros_agentes("yo")
+
+    assert asyncio.run(_leer()) == (["bob"], ["bob"], ["bob"])
+    assert butler.peticiones == ["/gente", "/gente"]
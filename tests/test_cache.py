@@ -0,0 +1,68 @@
+"""Cache des décisions LLM (llm.CacheDecisiones)."""
+
+import time
+
+from config import ButlerState
+from llm import CacheDecisiones
+
+ESTADO = ButlerState(Alias="yo", Recursos={"oro": 6}, Objetivo={"madera": 1})
+
+
+def _carta(remi: str) -> dict:
+    return {
+        "remi": remi,
+        "asunto": "Oferta",
+        "cuerpo": f"Hola, soy {remi}. Te doy 1 de madera a cambio de 3 de oro.",
+    }
+
+
+def _aceptar(remi: str) -> dict:
+    return {
+        "accion": "aceptar",
+        "dest": remi,
+        "envio": {"oro": 3},
+        "recibir": {"madera": 1},
+    }
+
+
+def test_misma_propuesta_de_otro_remitente():
+    """Une décision sert la même proposition reçue d'un autre agent, réécrite
+    pour lui."""
+    cache = CacheDecisiones()
+    cache.guardar(
+        cache.clave(ESTADO, _carta("bob"), False), ESTADO, "bob", _aceptar("bob")
+    )
+
+    decision = cache.obtener(cache.clave(ESTADO, _carta("ana"), False), ESTADO, "ana")
+
+    assert decision == _aceptar("ana")
+    assert cache.estadisticas()["aciertos"] == 1
+
+
+def test_cambio_de_recursos_vacia_el_cache():
+    """Les décisions dépendent de FALTAN/SOBRAN : un nouvel état vide le cache."""
+    cache = CacheDecisiones()
+    clave = cache.clave(ESTADO, _carta("bob"), False)
+    cache.guardar(clave, ESTADO, "bob", _aceptar("bob"))
+    otro = ButlerState(Alias="yo", Recursos={"oro": 3}, Objetivo={"madera": 1})
+
+    assert cache.obtener(cache.clave(otro, _carta("bob"), False), otro, "bob") is None
+    assert cache.obtener(clave, ESTADO, "bob") is None
+    assert cache.estadisticas()["invalidaciones"] == 1
+
+
+def test_entrada_caducada_y_capacidad(monkeypatch):
+    """Au-delà du TTL l'entrée est expulsée ; au-delà de la capacité, la
+    moins récemment utilisée part."""
+    ahora = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: ahora[0])
+    cache = CacheDecisiones(capacidad=1, ttl=10)
+    claves = [cache.clave(ESTADO, _carta("bob"), c) for c in (False, True)]
+    for clave in claves:
+        cache.guardar(clave, ESTADO, "bob", _aceptar("bob"))
+
+    assert cache.obtener(claves[0], ESTADO, "bob") is None
+    assert cache.obtener(claves[1], ESTADO, "bob") == _aceptar("bob")
+    ahora[0] += 11
+    assert cache.obtener(claves[1], ESTADO, "bob") is None
+    assert cache.estadisticas()["expulsiones"] == 2
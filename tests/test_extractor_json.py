@@ -0,0 +1,32 @@
+"""Détection incrémentale de la décision JSON dans le flux Ollama (llm.ExtractorJSON)."""
+
+from llm import ExtractorJSON, extraer_objeto_json
+
+
+def test_objeto_anidado_recibido_por_trozos():
+    """L'objet est rendu au fragment qui le ferme, imbrications comprises."""
+    extractor = ExtractorJSON()
+    trozos = ['Decisión: {"accion": "acep', 'tar", "envio": {"oro"', ": 3}", "} y más"]
+
+    resultados = [extractor.alimentar(t) for t in trozos]
+
+    assert resultados[:3] == [None, None, None]
+    assert resultados[3] == {"accion": "aceptar", "envio": {"oro": 3}}
+
+
+def test_llaves_dentro_de_cadenas_se_ignoran():
+    """Accolades et guillemets échappés dans une chaîne ne comptent pas."""
+    texto = '{"accion": "ofrecer", "cuerpo": "te doy } y \\" {"}'
+
+    assert extraer_objeto_json(texto) == {
+        "accion": "ofrecer",
+        "cuerpo": 'te doy } y " {',
+    }
+
+
+def test_objeto_invalido_se_descarta():
+    """Un objet équilibré mais invalide est abandonné au profit du suivant."""
+    assert extraer_objeto_json('{accion: x} {"accion": "esperar"}') == {
+        "accion": "esperar"
+    }
+    assert extraer_objeto_json("sin JSON") is None
@@ -0,0 +1,64 @@
+"""Classifieur d'intention des cartas (intenciones.py)."""
+
+import pytest
+
+import intenciones
+from intenciones import ClasificadorIntencion
+
+EJEMPLOS = [
+    (
+        {"asunto": "Intercambio aceptado", "cuerpo": "Acepto el trato. Te envié 2 oro"},
+        "confirmacion",
+    ),
+    ({"asunto": "Re: Oferta", "cuerpo": "Acepto, te envié la madera"}, "confirmacion"),
+    (
+        {"asunto": "Oferta", "cuerpo": "Te doy 1 de madera a cambio de 1 de piedra"},
+        "propuesta",
+    ),
+    (
+        {"asunto": "Intercambio", "cuerpo": "Te doy 2 de lana a cambio de 3 oro"},
+        "propuesta",
+    ),
+    ({"asunto": "Hola", "cuerpo": "¿Qué tal va la partida?"}, "general"),
+]
+
+
+def test_clasifica_y_cita_no_es_aceptacion():
+    """Un texte cité (« 'acepto el trato' ») ne fait pas d'une proposition
+    une confirmation."""
+    modelo = ClasificadorIntencion.entrenar(EJEMPLOS)
+    propuesta = {
+        "asunto": "Intercambio",
+        "cuerpo": "Te doy 1 de tela a cambio de 2 de oro; responde 'acepto el trato'",
+    }
+
+    assert modelo.clasificar(EJEMPLOS[0][0])[0] == "confirmacion"
+    assert modelo.clasificar(propuesta)[0] == "propuesta"
+    assert sum(modelo.probabilidades(propuesta).values()) == pytest.approx(1.0)
+
+
+def test_temperatura_suaviza_la_confianza():
+    """Une température plus haute rapproche la confiance de l'uniforme."""
+    carta = {"asunto": "Oferta", "cuerpo": "Te doy 1 de piedra a cambio de 1 oro"}
+    seco = ClasificadorIntencion.entrenar(EJEMPLOS).clasificar(carta)
+    suave = ClasificadorIntencion.entrenar(EJEMPLOS, temperatura=5.0).clasificar(carta)
+
+    assert seco[0] == suave[0] == "propuesta"
+    assert 1 / 3 < suave[1] < seco[1]
+
+
+def test_guardar_y_cargar(tmp_path):
+    """Le modèle relu classe comme l'original ; un fichier absent ou
+    invalide donne None (repli sur les mots-clés)."""
+    modelo = ClasificadorIntencion.entrenar(EJEMPLOS, temperatura=2.0)
+    ruta = tmp_path / "modelo.json"
+    modelo.guardar(str(ruta))
+
+    relu = intenciones.cargar_modelo(str(ruta))
+
+    assert relu.probabilidades(EJEMPLOS[2][0]) == modelo.probabilidades(EJEMPLOS[2][0])
+    assert intenciones.cargar_modelo(str(tmp_path / "ausente.json")) is None
+    (tmp_path / "roto.json").write_text('{"tipos": []}', encoding="utf-8")
+    assert intenciones.cargar_modelo(str(tmp_path / "roto.json")) is None
+    with pytest.raises(ValueError):
+        ClasificadorIntencion.entrenar([({"cuerpo": "x"}, "desconocido")])
@@ -0,0 +1,63 @@
+"""Carnet d'ordres du marché (mercado.LibroOrdenes)."""
+
+import time
+
+from mercado import LibroOrdenes, parsear_anuncio
+
+
+def test_anuncio_en_texto_y_en_json():
+    """« Necesito ... Ofrezco a cambio ... » en liste ou en JSON."""
+    assert parsear_anuncio(
+        "Necesito: 2 de madera. Ofrezco a cambio: 1 de piedra y 3 oro"
+    ) == ({"madera": 2}, {"piedra": 1, "oro": 3})
+    assert parsear_anuncio('Necesito {"lana": 1}\nOfrezco {"tela": 2}') == (
+        {"lana": 1},
+        {"tela": 2},
+    )
+    assert parsear_anuncio("Te doy 1 de madera que necesito por oro") is None
+
+
+def test_destinatarios_conocidos_e_inconocidos():
+    """Un agent connu ne reçoit que ce qu'il peut céder, même en partie ;
+    un agent inconnu reçoit tout."""
+    libro = LibroOrdenes()
+    libro.registrar_carta(
+        {
+            "remi": "bob",
+            "asunto": "Anuncio",
+            "cuerpo": "Necesito 1 oro. Ofrezco 2 madera",
+        }
+    )
+    libro.registrar_carta(
+        {
+            "remi": "ana",
+            "asunto": "Oferta",
+            "cuerpo": "Te doy 1 de tela a cambio de 3 de oro.",
+        }
+    )
+    otros = ["bob", "ana", "carlos"]
+
+    assert libro.destinatarios({"madera": 1}, otros) == ["bob", "carlos"]
+    assert libro.destinatarios({"madera": 1, "tela": 1}, otros) == otros
+    assert libro.puede_dar("ana", {"madera": 1}) is False
+    assert libro.puede_dar("carlos", {"madera": 1}) is None
+    assert libro.ofertas("madera") == {"bob": 2}
+    assert libro.demandas("oro") == {"bob": 1, "ana": 3}
+
+
+def test_anuncio_reemplaza_y_caduca(monkeypatch):
+    """Une nouvelle annonce remplace l'entrée (et l'index) ; au-delà du TTL
+    l'agent redevient inconnu."""
+    ahora = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: ahora[0])
+    libro = LibroOrdenes(ttl=60)
+    libro.actualizar("bob", {"oro": 1}, {"madera": 2})
+    libro.actualizar("bob", {"oro": 1}, {"piedra": 1})
+
+    assert libro.ofertas("madera") == {}
+    assert libro.destinatarios({"madera": 1}, ["bob"]) == []
+
+    ahora[0] += 61
+    assert libro.destinatarios({"madera": 1}, ["bob"]) == ["bob"]
+    assert libro.instantanea() == {}
+    assert libro.ofertas("piedra") == {}
@@ -0,0 +1,136 @@
+"""Règlement des confirmations par la mémoire des négociations."""
+
+import asyncio
+import time
+
+import httpx
+
+import agent
+import buzon
+from config import ButlerState
+from negociaciones import Negociaciones
+from runtime import AgenteRuntime
+
+
+class ClienteFalso:
+    """Butler factice : les paquetes partent, les cartas échouent."""
+
+    slot = "test"
+
+    def __init__(self) -> None:
+        self.paquetes: list[tuple[str, dict]] = []
+
+    async def enviar_paquete(self, dest: str, recursos: dict) -> bool:
+        self.paquetes.append((dest, recursos))
+        return True
+
+    async def enviar_carta(self, **_) -> bool:
+        raise httpx.ConnectError("Butler inaccessible")
+
+
+def test_confirmacion_fallida_no_repaga():
+    """Une carta de confirmation en échec ne fait pas repartir le paquete."""
+    negociaciones = Negociaciones(None)
+    cliente = ClienteFalso()
+    runtime = AgenteRuntime(
+        cliente,
+        sincronizador=buzon.SincronizadorBuzon(None),
+        negociaciones=negociaciones,
+    )
+    negociaciones.registrar_ofertas(
+        [{"dest": "bob", "envio": {"oro": 1}, "recibir": {"madera": 2}}], "1:1"
+    )
+    negociaciones.observar({"oro": 3})
+    negociaciones.observar({"oro": 3, "madera": 2})
+    estado = ButlerState(
+        Alias="yo", Recursos={"oro": 3, "madera": 2}, Objetivo={"madera": 2}
+    )
+
+    liquidacion = negociaciones.liquidar("bob", {"madera": 2})
+    assert liquidacion.decision["accion"] == "aceptar"
+
+    async def _escenario():
+        resultado = await runtime._ejecutar(
+            estado,
+            liquidacion.decision,
+            "negociacion",
+            agent.LibroReservas(),
+            liquidacion.oferta,
+        )
+        assert resultado["estado"] == "aceptado_y_enviado"
+        for _ in range(2):  # polls suivants
+            negociaciones.observar({"oro": 2, "madera": 2})
+            for pendiente in negociaciones.liquidables():
+                await runtime._ejecutar(
+                    estado,
+                    pendiente.decision,
+                    "negociacion",
+                    agent.LibroReservas(),
+                    pendiente.oferta,
+                )
+
+    asyncio.run(_escenario())
+    assert cliente.paquetes == [("bob", {"oro": 1})]
+
+
+class Reloj:
+    """Horloge factice avancée à la main (time.time)."""
+
+    def __init__(self) -> None:
+        self.ahora = 1000.0
+
+    def __call__(self) -> float:
+        return self.ahora
+
+
+def test_regalo_anterior_no_liquida(monkeypatch):
+    """Une arrivée constatée avant l'offre ne la règle pas."""
+    reloj = Reloj()
+    monkeypatch.setattr(time, "time", reloj)
+    negociaciones = Negociaciones(None)
+    negociaciones.observar({"oro": 3})
+    reloj.ahora += 1
+    negociaciones.observar({"oro": 3, "madera": 2})  # cadeau d'un tiers
+    reloj.ahora += 1
+    negociaciones.registrar_ofertas(
+        [{"dest": "bob", "envio": {"oro": 1}, "recibir": {"madera": 2}}], "1:1"
+    )
+
+    liquidacion = negociaciones.liquidar("bob", {"madera": 2})
+    assert liquidacion.decision["motivo"] == "paquete_pendiente"
+    assert negociaciones.liquidables() == []
+
+
+def test_confirmada_se_liquida_al_llegar_el_paquete(monkeypatch):
+    """Une offre confirmée est réglée quand son paquete arrive, sans autre carta."""
+    reloj = Reloj()
+    monkeypatch.setattr(time, "time", reloj)
+    negociaciones = Negociaciones(None)
+    negociaciones.registrar_ofertas(
+        [{"dest": "bob", "envio": {"oro": 1}, "recibir": {"madera": 2}}], "1:1"
+    )
+    negociaciones.observar({"oro": 3})
+    reloj.ahora += 1
+    pendiente = negociaciones.liquidar("bob", {"madera": 2})
+    assert pendiente.decision["motivo"] == "paquete_pendiente"
+    assert negociaciones.liquidables() == []
+
+    reloj.ahora += 1
+    negociaciones.observar({"oro": 3, "madera": 2})
+    liquidaciones = negociaciones.liquidables()
+
+    assert [liq.oferta for liq in liquidaciones] == [pendiente.oferta]
+    assert liquidaciones[0].decision["dest"] == "bob"
+    assert negociaciones.liquidables()[0].oferta == pendiente.oferta  # cobrada
+
+
+def test_envio_durante_la_lectura_no_inventa_llegada():
+    """Un paquete parti pendant la lecture de Recursos, que celle-ci l'ait vu
+    ou non, ne fait jamais apparaître une arrivée au poll suivant."""
+    for vista in ({"oro": 1}, {"oro": 3}):
+        negociaciones = Negociaciones(None)
+        negociaciones.observar({"oro": 3})
+        negociaciones.registrar_envio("bob", {"oro": 2}, {}, inicio=10.0)
+        negociaciones.observar(vista, (9.0, float("inf")))
+        negociaciones.observar({"oro": 1}, (20.0, 21.0))
+        assert negociaciones._llegadas() == {}
@@ -0,0 +1,72 @@
+"""Planificateur d'échanges en chaîne et registre des chaînes proposées."""
+
+import agent
+import planificador
+
+
+def _anuncio(necesita: dict, ofrece: dict) -> dict:
+    return {"necesita": necesita, "ofrece": ofrece}
+
+
+def test_cadena_mas_corta_sin_bilateral():
+    """bob a la madera mais veut de la piedra : la chaîne passe par ana, et
+    l'oro ne sert pas à conclure un simple échange bilatéral avec bob."""
+    anuncios = {
+        "bob": _anuncio({"piedra": 1}, {"madera": 1}),
+        "ana": _anuncio({"lana": 1}, {"piedra": 1}),
+    }
+
+    planes = planificador.planificar(
+        "yo", {"madera": 1}, {"lana": 1, "oro": 6}, anuncios
+    )
+
+    assert [(p.de, p.para, p.recursos) for p in planes[0].pasos] == [
+        ("yo", "ana", {"lana": 1}),
+        ("ana", "bob", {"piedra": 1}),
+        ("bob", "yo", {"madera": 1}),
+    ]
+    assert len(planes) == 1
+
+
+def test_oro_como_puente_y_recursos_comprometidos():
+    """Sans ressource qui boucle, 3 oro par unité ferment la chaîne ; une
+    offre engagée par un plan ne sert pas deux fois."""
+    anuncios = {
+        "bob": _anuncio({"piedra": 2}, {"madera": 2}),
+        "ana": _anuncio({}, {"piedra": 1}),
+    }
+
+    planes = planificador.planificar("yo", {"madera": 2}, {"oro": 9}, anuncios)
+
+    assert len(planes) == 1
+    assert planes[0].cantidad == 1
+    assert planes[0].pasos[0].recursos == {"oro": 3}
+    assert planes[0].participantes == ["ana", "bob"]
+
+
+def test_completar_retira_la_cadena_citada():
+    """Deux chaînes vers le même dernier maillon : seule celle dont le
+    numéro est cité est retirée."""
+    cadenas = agent.RegistroCadenas()
+    planes = [
+        planificador.Plan(
+            rec,
+            1,
+            [
+                planificador.Paso("yo", "ana", {"oro": 3}),
+                planificador.Paso("ana", "bob", {"piedra": 1}),
+                planificador.Paso("bob", "yo", {rec: 1}),
+            ],
+        )
+        for rec in ("madera", "lana")
+    ]
+    primera, segunda = (cadenas.registrar(p) for p in planes)
+    assert cadenas.registrar(planes[0]) is None  # déjà proposée
+
+    assert cadenas.resolver(primera, "ana") is None  # pas le fournisseur
+    assert cadenas.resolver(primera, "bob") is planes[0]
+    assert cadenas.resolver(segunda, "bob") is planes[1]
+
+    assert cadenas.completar(segunda)
+    assert not cadenas.completar(segunda)
+    assert cadenas.resolver(primera, "bob") is planes[0]
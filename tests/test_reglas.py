@@ -0,0 +1,89 @@
+"""Moteur de règles : analyse des gabarits et décisions sans LLM."""
+
+import reglas
+from config import ButlerState
+
+ESTADO = ButlerState(
+    Alias="yo", Recursos={"oro": 6, "piedra": 2}, Objetivo={"madera": 1}
+)
+
+
+def test_propuesta_que_pide_sobran_se_acepta():
+    """« te doy 1 de madera a cambio de 1 de piedra » : accepté tel quel."""
+    carta = {
+        "remi": "bob",
+        "asunto": "Oferta",
+        "cuerpo": "Te doy 1 de madera a cambio de 1 de piedra.",
+    }
+
+    decision = reglas.decidir_carta(ESTADO, carta)
+
+    assert decision == {
+        "accion": "aceptar",
+        "dest": "bob",
+        "envio": {"piedra": 1},
+        "recibir": {"madera": 1},
+    }
+
+
+def test_propuesta_en_cooldown_se_reofrece():
+    """En cooldown, la même proposition est renvoyée au lieu d'être payée."""
+    carta = {
+        "remi": "bob",
+        "asunto": "Oferta",
+        "cuerpo": "Te doy 1 de madera a cambio de 1 de piedra.",
+    }
+
+    decision = reglas.decidir_carta(ESTADO, carta, en_cooldown=True)
+
+    assert decision["accion"] == "ofrecer"
+    assert (decision["envio"], decision["recibir"]) == ({"piedra": 1}, {"madera": 1})
+
+
+def test_carta_libre_pasa_al_llm():
+    """Une carta hors gabarit est laissée au LLM et comptée comme telle."""
+    estadisticas = reglas.EstadisticasReglas()
+    carta = {"remi": "bob", "asunto": "Hola", "cuerpo": "¿Qué tal va la partida?"}
+
+    assert reglas.decidir_carta(ESTADO, carta, estadisticas=estadisticas) is None
+    assert estadisticas.estadisticas()["llamadas_llm"] == 1
+
+
+def test_referencia_de_menu_conserva_el_json():
+    """Les termes d'une ligne de menu sont lus sur le cuerpo brut (casse,
+    accents) ; la confirmation seule n'est pas payée par les règles."""
+    carta = {
+        "remi": "bob",
+        "asunto": "Re: Menú",
+        "cuerpo": "Acepto #1-2\n(Referencia a tu oferta #1-2: tú envías "
+        '{"Piedra": 1} y recibes {"madera": 1})',
+    }
+
+    terminos = reglas.parsear_carta(carta)
+
+    assert terminos == {
+        "tipo": "confirmacion",
+        "ofrece": {"madera": 1},
+        "pide": {"Piedra": 1},
+    }
+    assert reglas.decidir_carta(ESTADO, carta)["accion"] == "esperar"
+
+
+def test_aceptacion_de_cadena_lleva_su_numero():
+    """L'acceptation d'une de nos chaînes paie le dernier maillon et cite la chaîne."""
+    carta = {
+        "remi": "ana",
+        "asunto": "Re: Cadena #7",
+        "cuerpo": "Acepto cadena #7\n(Referencia a tu cadena #7: tu envias "
+        '{"piedra": 1} a carlos y recibes {"madera": 1})',
+    }
+
+    decision = reglas.decidir_carta(ESTADO, carta)
+
+    assert decision == {
+        "accion": "aceptar",
+        "dest": "carlos",
+        "envio": {"piedra": 1},
+        "recibir": {"madera": 1},
+        "cadena": 7,
+    }
@@ -0,0 +1,78 @@
+"""Réservation des envois entre cartas d'un même lot (agent.LibroReservas)."""
+
+import asyncio
+
+import agent
+from config import ButlerState
+
+ESTADO = ButlerState(
+    Alias="yo", Recursos={"oro": 5, "piedra": 1}, Objetivo={"madera": 1}
+)
+
+
+class ClienteFalso:
+    """Butler factice : enregistre les paquetes, refuse ceux pour `caido`."""
+
+    def __init__(self, caido: str = "") -> None:
+        self.caido = caido
+        self.paquetes: list[tuple[str, dict]] = []
+
+    async def enviar_paquete(self, dest: str, recursos: dict) -> bool:
+        await asyncio.sleep(0)
+        if dest == self.caido:
+            return False
+        self.paquetes.append((dest, recursos))
+        return True
+
+    async def enviar_carta(self, **_) -> bool:
+        return True
+
+
+def _aceptar(dest: str, envio: dict) -> dict:
+    return {"accion": "aceptar", "dest": dest, "envio": envio, "recibir": {}}
+
+
+def test_reservas_no_prometen_dos_veces_la_misma_unidad():
+    """Les réservations successives se partagent SOBRAN ; un lot est tout ou rien."""
+    reservas = agent.LibroReservas()
+
+    assert reservas.reservar({"oro": 3}, ESTADO) == {"oro": 3}
+    assert reservas.reservar({"oro": 3}, ESTADO) == {"oro": 2}
+    assert reservas.reservar({"oro": 1, "piedra": 1}, ESTADO, completo=True) is None
+    assert reservas.comprometido() == {"oro": 5}
+
+    reservas.liberar({"oro": 2})
+    assert reservas.reservar({"oro": 1, "piedra": 1}, ESTADO, completo=True) == {
+        "oro": 1,
+        "piedra": 1,
+    }
+
+
+def test_aceptaciones_simultaneas_comparten_el_sobran():
+    """Deux acceptations du même lot exécutées en parallèle ne dépassent pas
+    SOBRAN (un lot part en entier ou pas du tout) ; un paquete refusé rend
+    sa réservation."""
+    cliente = ClienteFalso(caido="carlos")
+    reservas = agent.LibroReservas()
+
+    async def _lote(destinos):
+        return await asyncio.gather(
+            *(
+                agent.ejecutar_decision(
+                    _aceptar(dest, {"oro": 3}), "yo", ESTADO, cliente, reservas
+                )
+                for dest in destinos
+            )
+        )
+
+    resultados = asyncio.run(_lote(["bob", "ana"]))
+
+    assert [r["estado"] for r in resultados] == [
+        "aceptado_y_enviado",
+        "envio_bloqueado",
+    ]
+    assert cliente.paquetes == [("bob", {"oro": 3})]
+
+    reservas.liberar({"oro": 3})
+    assert [r["estado"] for r in asyncio.run(_lote(["carlos"]))] == ["paquete_fallido"]
+    assert reservas.comprometido() == {}
@@ -0,0 +1,66 @@
+"""Traitement des cartas d'un même expéditeur par AgenteRuntime."""
+
+import asyncio
+
+import httpx
+
+import buzon
+import llm
+from config import ButlerState
+from negociaciones import Negociaciones
+from runtime import AgenteRuntime
+
+
+class ClienteFalso:
+    slot = "test"
+
+
+def test_conversacion_fallida_repliega_carta_por_carta(monkeypatch):
+    """Si l'appel LLM groupé échoue, chaque carta est décidée seule."""
+
+    async def _conversacion(*_, **__):
+        raise httpx.ReadTimeout("Ollama ne répond pas")
+
+    decididas = []
+
+    async def _carta(estado, carta, *_, **__):
+        decididas.append(carta["id"])
+        return {"accion": "esperar"}
+
+    monkeypatch.setattr(llm, "decidir_conversacion", _conversacion)
+    monkeypatch.setattr(llm, "decidir_carta", _carta)
+    runtime = AgenteRuntime(
+        ClienteFalso(),
+        sincronizador=buzon.SincronizadorBuzon(None),
+        negociaciones=Negociaciones(None),
+    )
+    estado = ButlerState(Alias="yo", Recursos={"oro": 3}, Objetivo={"madera": 1})
+    cartas = [
+        {"id": str(i), "remi": "bob", "asunto": "Hola", "cuerpo": f"¿Qué tal? {i}"}
+        for i in range(2)
+    ]
+
+    resultados = asyncio.run(runtime.procesar_conversacion(estado, cartas))
+
+    assert decididas == ["0", "1"]
+    assert resultados == [{"estado": "esperando"}] * 2
+
+
+def test_confirmacion_desconocida_no_se_paga():
+    """« Te envié ... Espero recibir ... » sans offre connue : rien n'est payé."""
+    runtime = AgenteRuntime(
+        ClienteFalso(),
+        sincronizador=buzon.SincronizadorBuzon(None),
+        negociaciones=Negociaciones(None),
+    )
+    estado = ButlerState(Alias="yo", Recursos={"oro": 3}, Objetivo={"madera": 1})
+    carta = {
+        "remi": "bob",
+        "asunto": "Intercambio aceptado",
+        "cuerpo": 'Te envié: {"madera": 1}. Espero recibir: {"oro": 3}.',
+    }
+
+    decision, _origen, oferta = runtime._decidir_sin_llm(estado, carta, False)
+
+    assert decision == {"accion": "esperar", "motivo": "confirmacion_desconocida"}
+    assert oferta is None
@@ -0,0 +1,200 @@
+"""
+trazas.py — Traçage par spans du traitement d'une carta (chronologie détaillée).
+
+Un span mesure une étape (fetch, règles, prompt, LLM, validation, envoi du
+paquete, envoi de la carta, re-broadcast...). Les spans s'imbriquent via un
+ContextVar : un span ouvert pendant un autre en devient l'enfant et partage
+son identifiant de trace. Les tâches asyncio héritent du contexte de la
+tâche qui les crée, et asyncio.to_thread emporte ce contexte dans son
+thread : tout le traitement d'une carta tient dans la même trace.
+
+Quand le span racine se ferme, la trace complète est :
+- journalisée, un span par ligne, sur le logger « trazas » (en INFO et
+  en JSON avec trace_id/span_id/parent_id si LOG_JSON, sinon en DEBUG) ;
+- gardée dans un historique borné, consultable via ultimas().
+
+Une racine peut être abandonnée (descartar) : un poll sans nouvelle carta
+ne produit ainsi aucune trace.
+
+FiltroTraza ajoute aux autres logs les identifiants du span courant, et
+FormateadorJSON les écrit en JSON, pour relier chaque ligne de log à sa trace.
+Quand un processus héberge plusieurs slots, slot_actual (posé par la tâche
+de polling de chaque slot) est ajouté aux logs et aux spans racines.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import LOG_JSON, TRAZAS_HISTORIAL, TRAZAS_MAX_SPANS
+
+logger = logging.getLogger("trazas")
+
+
+def _nuevo_id() -> str:
+    return os.urandom(8).hex()
+
+
+class Traza:
+    """Spans terminés d'une même trace (partagée entre threads)."""
+
+    def __init__(self) -> None:
+        self.id = _nuevo_id()
+        self.spans: list[dict] = []
+        self.omitidos = 0
+        self.descartada = False
+        self._lock = threading.Lock()
+
+    def agregar(self, datos: dict) -> None:
+        with self._lock:
+            if len(self.spans) < TRAZAS_MAX_SPANS:
+                self.spans.append(datos)
+            else:
+                self.omitidos += 1
+
+
+class Span:
+    """Une étape mesurée. Les attributs peuvent être complétés avant la fin."""
+
+    def __init__(self, nombre: str, traza: Traza, padre: "Span | None", **atributos):
+        self.nombre = nombre
+        self.traza = traza
+        self.id = _nuevo_id()
+        self.padre = padre
+        self.atributos = atributos
+        self.inicio = time.time()
+
+    def anotar(self, **atributos) -> None:
+        """Ajoute des attributs au span (ex. l'action décidée)."""
+        self.atributos.update(atributos)
+
+    def descartar(self) -> None:
+        """Abandonne toute la trace : rien n'est journalisé ni gardé."""
+        self.traza.descartada = True
+
+
+_span_actual: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "span_actual", default=None
+)
+slot_actual: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "slot_actual", default=None
+)
+_historial: deque[dict] = deque(maxlen=TRAZAS_HISTORIAL)
+_lock_historial = threading.Lock()
+
+
+@contextmanager
+def span(nombre: str, **atributos):
+    """Ouvre un span enfant du span courant (ou racine d'une nouvelle trace).
+
+    Usage :
+        with trazas.span("llm", remi=remi) as s:
+            ...
+            s.anotar(accion=decision["accion"])
+    """
+    padre = _span_actual.get()
+    if padre is None and slot_actual.get() is not None:
+        atributos.setdefault("slot", slot_actual.get())
+    actual = Span(nombre, padre.traza if padre else Traza(), padre, **atributos)
+    token = _span_actual.set(actual)
+    error = None
+    try:
+        yield actual
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _span_actual.reset(token)
+        fin = time.time()
+        datos = {
+            "trace_id": actual.traza.id,
+            "span_id": actual.id,
+            "parent_id": padre.id if padre else None,
+            "nombre": nombre,
+            "inicio": datetime.fromtimestamp(actual.inicio).isoformat(),
+            "duracion_ms": round(1000 * (fin - actual.inicio), 2),
+            "hilo": threading.current_thread().name,
+            "atributos": actual.atributos,
+        }
+        if error:
+            datos["error"] = error
+        actual.traza.agregar(datos)
+        if padre is None and not actual.traza.descartada:
+            _cerrar_traza(actual.traza)
+
+
+def _cerrar_traza(traza: Traza) -> None:
+    spans = sorted(traza.spans, key=lambda s: s["inicio"])
+    nivel = logging.INFO if LOG_JSON else logging.DEBUG  # trop verbeux en texte
+    for datos in spans:
+        logger.log(
+            nivel,
+            "span %s %.1f ms",
+            datos["nombre"],
+            datos["duracion_ms"],
+            extra={"span": datos},
+        )
+    raiz = spans[-1] if spans else {}
+    for datos in spans:
+        if datos["parent_id"] is None:
+            raiz = datos
+    with _lock_historial:
+        _historial.append(
+            {
+                "trace_id": traza.id,
+                "raiz": raiz.get("nombre"),
+                "duracion_ms": raiz.get("duracion_ms"),
+                "spans": spans,
+                "spans_omitidos": traza.omitidos,
+            }
+        )
+
+
+def ultimas(n: int = 20) -> list[dict]:
+    """Les n dernières traces terminées (la plus récente en dernier)."""
+    with _lock_historial:
+        return list(_historial)[-n:]
+
+
+# ── Intégration au logging ─────────────────────────────────────────────────────
+
+
+class FiltroTraza(logging.Filter):
+    """Ajoute trace_id et span_id (ou None) du span courant à chaque log, et
+    le slot courant (`slot`, et `prefijo_slot` « [slot] » pour le format texte)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        actual = _span_actual.get()
+        record.trace_id = actual.traza.id if actual else None
+        record.span_id = actual.id if actual else None
+        record.slot = slot_actual.get()
+        record.prefijo_slot = f"[{record.slot}] " if record.slot else ""
+        return True
+
+
+class FormateadorJSON(logging.Formatter):
+    """Une ligne JSON par log : horodatage, niveau, logger, message, trace, span."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        datos = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds"
+            ),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+            "trace_id": getattr(record, "trace_id", None),
+            "span_id": getattr(record, "span_id", None),
+            "slot": getattr(record, "slot", None),
+        }
+        if hasattr(record, "span"):
+            datos["span"] = record.span
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)